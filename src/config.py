@@ -81,9 +81,11 @@ async def connect_to_ollama():
             SUMMARIZE_MODEL = "mistral-large:latest"#"deepseek-v3:latest"
             CONNECTION_MODE = "armstrong ollama"
     else:
-        # local
+        # local. OLLAMA_HOST can target another server (ex: llm/ollama_stub.py)
         port = 11434
-        OLLAMA_HOST = f"http://localhost:{port}"
+        OLLAMA_HOST = os.environ.get("OLLAMA_HOST", f"http://localhost:{port}")
+        if not OLLAMA_HOST.startswith("http"):
+            OLLAMA_HOST = "http://" + OLLAMA_HOST
         OLLAMA_MODEL = "gemma3:4b"#"gemma3:12b"#"orca2:7b"#"ministral-3:14b"
         OLLAMA_MODEL_NAME = "gemma3:4b"#"gemma3:12b"#"orca2:7b"#"ministral-3:14b"
         SUMMARIZE_MODEL = "gemma3:4b"
@@ -105,6 +107,41 @@ ALLOW_BROAD_NARROW_MATCH = False # This will add difficulty to the classificatio
 # LLM computation result files
 LLM_CATEGORIES_FILE = CACHE_DIR / "llm_categories.json"
 LLM_EMBEDDINGS_FILE = CACHE_DIR / f"llm_embeddings_{OLLAMA_MODEL}.pkl"
+LLM_MODELS_FILE = CACHE_DIR / "llm_models.json" # Models' metadata (context length)
+LLM_DECISIONS_FILE = CACHE_DIR / "llm_decisions.json" # Same/distinct decisions with a hash of the entities
+DECISION_REUSE_POLICY = "semantic" # "exact": reuse if the prompt fields are the same, "semantic": also if only descriptions changed
+
+# LLM embeddings (llm_embedding embedder)
+LLM_EMBEDDING_BATCH_SIZE = 32 # Texts sent in one /api/embed request
+LLM_EMBEDDING_WORKERS = 4 # Concurrent requests sent to Ollama
+
+# Web pages download (CacheManager)
+HTTP_MAX_CONNECTIONS_PER_HOST = 4 # Concurrent requests to a host
+HTTP_REQUESTS_PER_SECOND = 5 # Request rate to a host. -1 for no limit
+HTTP_RETRIES = 4 # Retries on 429 and 5xx status codes
+HTTP_BACKOFF = 1 # Seconds before the first retry, doubled at every retry
+HTTP_TIMEOUT = 60 # Seconds
+HTTP_WORKERS = 16 # Pages downloaded at the same time by CacheManager.get_many
+PARSE_WORKERS = os.cpu_count() or 1 # Processes parsing the downloaded XML files (PDS)
+HTTP_HOST_LIMITS = {"query.wikidata.org": (2, 1)} # {host: (max connections, requests per second)}
+CACHE_COMPRESSION = "gzip" # Pages in cache: "zstd" (needs the zstandard package), "gzip" or None
+CACHE_DEFAULT_TTL_DAYS = -1 # Days before a cached page is revalidated. -1 to never revalidate
+CACHE_TTL_DAYS = {"N2YO": 30} # {list cache folder (extractor.CACHE): days}
+CACHE_BACKEND = "files" # "files": one file per page, "sqlite": pages packed in CACHE_PACK_FILE
+CACHE_PACK_FILE = CACHE_DIR / "pages.sqlite" # Import / export with python -m graph.extractor.cache_pack
+VERSION_REFRESH_BATCH_SIZE = 500 # Versions kept in memory by VersionManager.buffered_refresh before they are saved
+VERSION_REFRESH_INTERVAL = 30 # Seconds before the versions in memory are saved
+EXTRACT_BATCH_SIZE = 200 # Entities per batch yielded by the streaming extractors (Extractor.iter_extract)
+EXTRACT_QUEUE_SIZE = 4 # Batches extracted in advance by an extractor run in parallel (update.py -j)
+WIKIDATA_HOST = os.environ.get("WIKIDATA_HOST", "https://www.wikidata.org") # Wikidata API. Can target graph/extractor/wikidata_stub.py
+WIKIPEDIA_HOST = os.environ.get("WIKIPEDIA_HOST", "https://{lang}.wikipedia.org") # Wikipedia API of a language. Can target wikidata_stub.py (http://localhost:8181/{lang})
+IMCCE_HOST = os.environ.get("IMCCE_HOST", "https://api.ssodnet.imcce.fr") # SsODNet quaero API. Can target graph/extractor/list_stub.py
+NSSDC_HOST = os.environ.get("NSSDC_HOST", "https://nssdc.gsfc.nasa.gov") # NSSDC spacecraft query and pages. Can target list_stub.py
+GEOCODER = "offline" # "offline": local gazetteer (utils/offline_geocoder.py), "nominatim": geopy's Nominatim (1 request per second)
+GEOCODER_FALLBACK = True # Request Nominatim when the offline geocoder does not find a location
+GAZETTEER_DIR = Path(os.environ.get("GAZETTEER_DIR", DATA_DIR / "gazetteer")) # GeoNames files of the offline geocoder (cities1000.txt, admin1CodesASCII.txt)
+LOCATION_CACHE_FILE = CACHE_DIR / "location_infos.sqlite" # Location information (utils/location_cache.py). location_infos.json is imported at creation
+GEOHASH_PRECISION = 7 # Characters of the coordinates' geohashes (7: cells of about 150 m). The points of a cell share their location information
 
 # HuggingFace, sentence transformers environment variables
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
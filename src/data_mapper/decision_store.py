@@ -0,0 +1,282 @@
+"""
+Store of the LLM decisions on candidate pairs, kept between runs and
+between the lines of a mapping strategy.
+
+A decision is saved with the (uri1, uri2) pair and a hash of the entities'
+fields that went into the prompt, so that it is not reused once an
+entity's description changed. Two hashes are saved:
+    - the content hash of all the prompt fields,
+    - the semantic hash, that ignores the fields that do not change the
+      identity of an entity (description, definition...) and normalizes
+      the values (case, punctuation, order of the values).
+With the "semantic" policy, a decision is also reused if only the
+semantic hash is the same.
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import atexit
+import hashlib
+import json
+import re
+
+from collections import defaultdict
+from pathlib import Path
+
+import config
+from config import LLM_DECISIONS_FILE
+from graph.properties import Properties
+
+properties = Properties()
+
+
+class DecisionStore():
+
+    # Policies
+    EXACT = "exact" # Reuse if the prompt fields are the same
+    SEMANTIC = "semantic" # Also reuse if only non-semantic fields changed
+
+    # Validations whose decision depends on the order of the entities
+    # (2 = entity1 is narrower, 3 = entity1 is broader)
+    DIRECTIONAL_KINDS = ["same_distinct_narrow_broad"]
+
+    # Fields that can change without changing the decision
+    NON_SEMANTIC_ATTRS = ["description",
+                          "definition",
+                          "ext_ref",
+                          "url",
+                          "modified",
+                          "provenance",
+                          "source",
+                          "literal_form",
+                          "location_confidence",
+                          "type_confidence"]
+
+    def __init__(self,
+                 policy: str = config.DECISION_REUSE_POLICY,
+                 filename: str | Path = LLM_DECISIONS_FILE):
+        """
+        Args:
+            policy: "exact" or "semantic"
+            filename: json file of the decisions
+        """
+        if policy not in (self.EXACT, self.SEMANTIC):
+            raise ValueError(f"Unknown decision reuse policy: {policy}. Use '{self.EXACT}' or '{self.SEMANTIC}'.")
+        self._policy = policy
+        self._filename = Path(filename)
+        # {"kind uri1 uri2": {content_hash: {"semantic_hash", "model", "decision", "justification"}}}
+        self._decisions = defaultdict(dict)
+        if self._filename.exists():
+            with open(self._filename, "r", encoding = "utf-8") as file:
+                try:
+                    self._decisions.update(json.load(file))
+                except json.JSONDecodeError:
+                    print(f"Warning: could not read {self._filename}. Starting with an empty decision store.")
+        self._modified = False
+        self._line = ""
+        # {line: {"exact": int, "semantic": int, "llm": int}}
+        self._counts = defaultdict(lambda: defaultdict(int))
+        atexit.register(self.save)
+
+
+    @staticmethod
+    def _normalize(value) -> str:
+        return re.sub(r"[\W_]+", " ", str(value).casefold()).strip()
+
+
+    @classmethod
+    def entity_hashes(cls,
+                      entity,
+                      exclude: list[str]) -> tuple[str, str]:
+        """
+        Compute the content hash and the semantic hash of an entity.
+
+        Args:
+            entity: the entity
+            exclude: fields that are not sent to the LLM
+        """
+        content = dict()
+        semantic = dict()
+        for key in entity.data.keys():
+            attr = properties.get_attr_name(key)
+            if attr in exclude:
+                continue
+            values = [str(v) for v in entity.get_values_for(attr)]
+            if not values:
+                continue
+            content[attr] = sorted(values)
+            if attr not in cls.NON_SEMANTIC_ATTRS:
+                semantic[attr] = sorted({cls._normalize(v) for v in values})
+        return (hashlib.sha256(json.dumps(content, sort_keys = True).encode("utf-8")).hexdigest(),
+                hashlib.sha256(json.dumps(semantic, sort_keys = True).encode("utf-8")).hexdigest())
+
+
+    @classmethod
+    def _entities(cls,
+                  entity1,
+                  entity2,
+                  kind: str) -> list:
+        """
+        Entities of the pair in the order of the key.
+        Entities are sorted by URI so that (entity1, entity2) and
+        (entity2, entity1) are the same pair, except for the directional
+        kinds where the reversed pair has a different decision.
+        """
+        if kind in cls.DIRECTIONAL_KINDS:
+            return [entity1, entity2]
+        return sorted([entity1, entity2], key = lambda e: str(e.uri))
+
+
+    @classmethod
+    def _key(cls,
+             entity1,
+             entity2,
+             kind: str) -> str:
+        """
+        Key of the pair.
+        """
+        entities = cls._entities(entity1, entity2, kind)
+        return f"{kind} {entities[0].uri} {entities[1].uri}"
+
+
+    @classmethod
+    def _pair(cls,
+              entity1,
+              entity2,
+              kind: str,
+              exclude: list[str]) -> tuple[str, str, str]:
+        """
+        Key of the pair and hashes of the pair's content.
+        """
+        entities = cls._entities(entity1, entity2, kind)
+        hashes = [cls.entity_hashes(entity, exclude) for entity in entities]
+        content_hash = hashlib.sha256(" ".join(h[0] for h in hashes).encode("utf-8")).hexdigest()
+        semantic_hash = hashlib.sha256(" ".join(h[1] for h in hashes).encode("utf-8")).hexdigest()
+        return cls._key(entity1, entity2, kind), content_hash, semantic_hash
+
+
+    def start_line(self,
+                   line: str):
+        """
+        Set the strategy line that the next decisions are counted for.
+
+        Args:
+            line: name of the strategy line
+        """
+        self._line = line
+
+
+    def has_pair(self,
+                 entity1,
+                 entity2,
+                 kind: str) -> bool:
+        """
+        Whether a decision was saved for the pair, whatever the
+        content of the entities was.
+
+        Args:
+            entity1: first entity
+            entity2: compared entity
+            kind: type of validation (same_distinct, same_distinct_narrow_broad)
+        """
+        return bool(self._decisions.get(self._key(entity1, entity2, kind)))
+
+
+    def lookup(self,
+               entity1,
+               entity2,
+               kind: str,
+               exclude: list[str]) -> tuple | None:
+        """
+        Get a previous decision on a candidate pair, or None.
+
+        Args:
+            entity1: first entity
+            entity2: compared entity
+            kind: type of validation (same_distinct, same_distinct_narrow_broad)
+            exclude: fields that are not sent to the LLM
+        """
+        key, content_hash, semantic_hash = self._pair(entity1, entity2, kind, exclude)
+        records = self._decisions.get(key, {})
+        record = records.get(content_hash)
+        reuse = self.EXACT
+        if record is not None and record["model"] != config.OLLAMA_MODEL_NAME:
+            record = None
+        if record is None and self._policy == self.SEMANTIC:
+            reuse = self.SEMANTIC
+            for candidate in records.values():
+                if (candidate["semantic_hash"] == semantic_hash and
+                    candidate["model"] == config.OLLAMA_MODEL_NAME):
+                    record = candidate
+                    break
+        if record is None:
+            return None
+        self._counts[self._line][reuse] += 1
+        return record["decision"], record["justification"]
+
+
+    def add(self,
+            entity1,
+            entity2,
+            kind: str,
+            exclude: list[str],
+            decision: bool | int,
+            justification: str,
+            llm_called: bool = True):
+        """
+        Save a decision of the LLM on a candidate pair.
+
+        Args:
+            entity1: first entity
+            entity2: compared entity
+            kind: type of validation (same_distinct, same_distinct_narrow_broad)
+            exclude: fields that are not sent to the LLM
+            decision: the LLM's decision
+            justification: the LLM's justification
+            llm_called: False if the decision was read from the LLM caches
+        """
+        key, content_hash, semantic_hash = self._pair(entity1, entity2, kind, exclude)
+        self._decisions[key][content_hash] = {"semantic_hash": semantic_hash,
+                                              "model": config.OLLAMA_MODEL_NAME,
+                                              "decision": decision,
+                                              "justification": justification}
+        if llm_called:
+            self._counts[self._line]["llm"] += 1
+        self._modified = True
+
+
+    def report(self) -> dict:
+        """
+        Reused decisions and LLM calls per strategy line.
+        """
+        return {line: {"exact": counts["exact"],
+                       "semantic": counts["semantic"],
+                       "llm": counts["llm"]}
+                for line, counts in self._counts.items()}
+
+
+    def write_report(self,
+                     filename: str | Path):
+        """
+        Save the report as a json file.
+
+        Args:
+            filename: the output json file
+        """
+        if not self._counts:
+            return
+        Path(filename).parent.mkdir(parents = True, exist_ok = True)
+        with open(filename, "w", encoding = "utf-8") as file:
+            json.dump(self.report(), file, indent = 2)
+
+
+    def save(self):
+        """
+        Save the decisions in the json file.
+        """
+        if not self._modified:
+            return
+        self._filename.parent.mkdir(parents = True, exist_ok = True)
+        with open(self._filename, "w", encoding = "utf-8") as file:
+            json.dump(self._decisions, file, indent = 2)
+        self._modified = False
@@ -8,7 +8,7 @@ Author:
 import numpy as np
 import psutil # battery checks
 from sklearn.decomposition import PCA
-from typing import List, Type, Set, Tuple, Any
+from typing import List, Type, Set, Tuple, Any, Iterator
 from tqdm import tqdm
 
 from data_mapper.tools.embedders.embedder import Embedder
@@ -19,6 +19,8 @@ from data_mapper.tools.tool import Tool
 from data_mapper.tools.mapping_tools_list import MappingToolsList
 from data_mapper.indexer import Indexer
 from data_mapper.selector import Selector
+from data_mapper.prescreen import PreScreen
+from data_mapper.decision_store import DecisionStore
 from data_mapper.gui import server
 from graph.entity import Entity
 from graph.extractor.extractor import Extractor
@@ -26,6 +28,7 @@ from graph.mapping_graph import MappingGraph
 from graph.properties import Properties
 # import faiss # pip3 install faiss-cpu (use faiss-gpu for GPU support)
 from llm.llm_connection import LLMConnection
+from llm.llm_stats import LLMStats
 from data_mapper.validator import strat1
 
 from config import USERNAME
@@ -235,7 +238,10 @@ class HybridRetriever():
                       ignore_deprecated = True,
                       top_k: int = 10,
                       human_validation: bool = True,
-                      allow_broad_narrow: bool = False) -> None:
+                      allow_broad_narrow: bool = False,
+                      prescreen: PreScreen = None,
+                      decision_store: DecisionStore = None,
+                      defer_validation: bool = False) -> Iterator[tuple[bool, bool]] | None:
         """
         Map entities from extractor1 to entities from extractor2 using the
         hybrid retriever. extractor1 and extractor2 might be inversed depending
@@ -249,6 +255,11 @@ class HybridRetriever():
             limit: limit the number of entities to map from list2
             ignore_deprecated: do not map entities that are deprecated
             human_validation: de-activate LLM validation and let the user validate each mapping
+            allow_broad_narrow: let the LLM choose narrow or broad relations
+            prescreen: trained pre-screen to reject unlikely pairs before the LLM
+            decision_store: previous LLM decisions to reuse
+            defer_validation: do not validate the candidate pairs but return
+                              the validation steps (see validation_steps)
         """
         self.filters = []
         self.matchers = []
@@ -446,15 +457,91 @@ class HybridRetriever():
         #with open(extractor1.NAMESPACE + '-' + extractor2.NAMESPACE + '.csv', 'w') as f:
         #    f.write(str(self.selector))
         if not human_validation:
-            # Validate from highest to lowest score
-            for score, entity1, entity2, scores_dict in self.selector:
+            steps = self.validation_steps(indexer1 = indexer1,
+                                          indexer2 = indexer2,
+                                          extractor1 = extractor1,
+                                          extractor2 = extractor2,
+                                          entities2 = entities2,
+                                          on_types = on_types,
+                                          allow_broad_narrow = allow_broad_narrow,
+                                          prescreen = prescreen,
+                                          decision_store = decision_store)
+            if defer_validation:
+                return steps
+            for _ in steps:
+                pass
+
+
+    def validation_steps(self,
+                         indexer1: Indexer,
+                         indexer2: Indexer,
+                         extractor1: Extractor,
+                         extractor2: Extractor,
+                         entities2: list[Entity],
+                         on_types: list[str] = None,
+                         allow_broad_narrow: bool = False,
+                         prescreen: PreScreen = None,
+                         decision_store: DecisionStore = None) -> Iterator[tuple[bool, bool]]:
+        """
+        Validate the selected candidate pairs from highest to lowest score.
+        This is a generator that yields after every candidate pair, so that
+        the LLM budget can stop the validation of a line (see LLMBudget).
+
+        Yield:
+            whether the LLM was called (False if the decision was reused
+            or the pair was rejected by the pre-screen),
+            whether the candidate pair was accepted.
+        """
+        if allow_broad_narrow:
+            kind, to_exclude = "same_distinct_narrow_broad", LLMConnection.NARROW_BROAD_EXCLUDE
+        else:
+            kind, to_exclude = "same_distinct", LLMConnection.SAME_DISTINCT_EXCLUDE
+        line = f"{extractor1.NAMESPACE}-{extractor2.NAMESPACE} ({', '.join(sorted(on_types)) if on_types else 'all'})"
+        if decision_store is not None:
+            decision_store.start_line(line)
+        progress = tqdm(self.selector,
+                        desc = f"Validating {extractor1.NAMESPACE}-{extractor2.NAMESPACE} pairs")
+        try:
+            for score, entity1, entity2, scores_dict in progress:
                 # TODO use a dynamic allow_broad_narrow, depending on the entities' type.
                 if entity2 not in entities2:
                     continue
-                if allow_broad_narrow:
-                    llmchoice, justification = LLMConnection().validate_same_distinct_narrow_broad(entity1, entity2)
+                progress.set_postfix_str(LLMStats.summary(), refresh = False)
+                if prescreen is not None:
+                    rejected, probability = prescreen.reject({**scores_dict, "hybrid": score})
+                    if rejected:
+                        self.invalidate_mapping(entity1 = entity1,
+                                                entity2 = entity2,
+                                                extractor1 = extractor1,
+                                                extractor2 = extractor2,
+                                                score_value = score,
+                                                score_name = "hybrid",
+                                                scores = scores_dict,
+                                                justification_string = f"Match probability {probability:.3f} is below the pre-screen threshold.",
+                                                validator_name = PreScreen.NAME)
+                        yield False, False
+                        continue
+                decision = None
+                if decision_store is not None:
+                    decision = decision_store.lookup(entity1, entity2, kind, to_exclude)
+                llm_called = False
+                if decision is not None:
+                    llmchoice, justification = decision
+                    LLMStats.record_cache_hit(kind)
                 else:
-                    llmchoice, justification = LLMConnection().validate_same_distinct(entity1, entity2)
+                    # The LLM caches are keyed by URIs only: only use them for the
+                    # pairs that the decision store does not know yet, so that a
+                    # decision is not reused after an entity changed.
+                    from_cache = decision_store is None or not decision_store.has_pair(entity1, entity2, kind)
+                    calls = LLMStats.calls(kind)
+                    if allow_broad_narrow:
+                        llmchoice, justification = LLMConnection().validate_same_distinct_narrow_broad(entity1, entity2, from_cache = from_cache)
+                    else:
+                        llmchoice, justification = LLMConnection().validate_same_distinct(entity1, entity2, from_cache = from_cache)
+                    llm_called = LLMStats.calls(kind) > calls
+                    if decision_store is not None:
+                        decision_store.add(entity1, entity2, kind, to_exclude, llmchoice, justification,
+                                           llm_called = llm_called)
                 if llmchoice == 1: # same
                     self.validate_mapping(indexer1 = indexer1,
                                           indexer2 = indexer2,
@@ -467,7 +554,7 @@ class HybridRetriever():
                                           scores_dict = scores_dict,
                                           score_name = "hybrid",
                                           justification_string  = justification,
-                                          is_human_validation = human_validation,
+                                          is_human_validation = False,
                                           validator_name = config.OLLAMA_MODEL_NAME)
                     self.selector.remove_entities(entity1, entity2)
                     self.selector.cut_distinct_streak()
@@ -484,7 +571,7 @@ class HybridRetriever():
                                           scores_dict = scores_dict,
                                           score_name = "hybrid",
                                           justification_string  = justification,
-                                          is_human_validation = human_validation,
+                                          is_human_validation = False,
                                           validator_name = config.OLLAMA_MODEL_NAME)
                     self.selector.cut_distinct_streak()
                 else:
@@ -500,6 +587,14 @@ class HybridRetriever():
                                            )
                     self.selector.update_distinct_streak()
                 self.check_battery()
+                yield llm_called, llmchoice in [1, 2, 3]
+        finally:
+            progress.close()
+            if decision_store is not None:
+                counts = decision_store.report().get(line, {})
+                print(f"{line}: {counts.get('exact', 0)} decisions reused, " +
+                      f"{counts.get('semantic', 0)} reused after non-semantic changes, " +
+                      f"{counts.get('llm', 0)} LLM validations.")
 
 
     def validate_mapping(self,
@@ -573,7 +668,7 @@ class HybridRetriever():
         Add a distinct relation but only in the SSSOM ontology. Use to keep
         track of negative decisions by the LLM.
         """
-        print("Classified as distinct entities by LLM. Saved in mapping graph.")
+        print(f"Classified as distinct entities by {validator_name}. Saved in mapping graph.")
         mapping_graph = MappingGraph()
         mapping_graph.add_mapping(entity1.uri,
                                   entity2.uri,
@@ -0,0 +1,199 @@
+"""
+Run-level budget of LLM validations, split between the lines of a
+mapping strategy.
+
+The lines are validated one after the other, in the strategy order, as a
+line can depend on the mappings of the previous lines (same_broader filter,
+entities without an equivalent in a list). Every line gets a share of the
+budget left (calls and time) for the lines left, weighted by its yield
+(acceptance rate): the share is updated after every decision, with the
+yield observed so far on the line against the yield expected from the
+lines not yet run. The yield of a line starts from a prior, the pooled
+acceptance rate of the lines already run, so that a new line starts with
+an equal share. The budget that a line did not use goes to the next
+lines. A line is stopped when its recent acceptance rate drops under
+min_yield.
+
+Lines stopped by the budget (calls or time) are not recorded in the
+progress, so that they are continued by the next run from the checkpoint.
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import json
+import time
+
+from collections import deque
+from pathlib import Path
+from typing import Callable, Iterator
+
+
+class LLMBudget():
+
+    # Line status
+    DONE = "done" # No more candidate pairs
+    LOW_YIELD = "low yield"
+    OUT_OF_BUDGET = "out of budget"
+
+    # Weight of the prior in the yield of a line, in number of decisions
+    PRIOR_DECISIONS = 10
+
+    def __init__(self,
+                 max_calls: int = -1,
+                 max_seconds: float = -1,
+                 min_yield: float = 0.05,
+                 window: int = 30):
+        """
+        Args:
+            max_calls: maximum LLM calls for the run. -1 for no limit.
+            max_seconds: maximum duration of the run (from the budget's
+                         creation). -1 for no limit.
+            min_yield: stop a line if its acceptance rate over the last
+                       window decisions is lower.
+            window: number of decisions to compute the recent acceptance rate.
+        """
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        self.min_yield = min_yield
+        self.window = window
+        self._start = time.time()
+        self._calls = 0
+        self._lines = dict()
+
+
+    def exhausted(self) -> bool:
+        """
+        True if there is no budget left (calls or time).
+        """
+        if self.max_calls >= 0 and self._calls >= self.max_calls:
+            return True
+        if self.max_seconds >= 0 and time.time() - self._start >= self.max_seconds:
+            return True
+        return False
+
+
+    def _prior(self,
+               line: str) -> float:
+        """
+        Expected yield of a line not yet run: the acceptance rate of the
+        other lines, with one accepted and one rejected decision so that
+        it is never 0 or 1.
+        """
+        others = [state for name, state in self._lines.items() if name != line]
+        return ((sum(state["accepted"] for state in others) + 1) /
+                (sum(state["decisions"] for state in others) + 2))
+
+
+    def _share(self,
+               line: str,
+               lines_left: int) -> tuple[float, float]:
+        """
+        Maximum LLM calls and end time of a line: its share of the budget
+        left when it started, weighted by its yield against the expected
+        yield of the other lines left.
+        """
+        state = self._lines[line]
+        prior = self._prior(line)
+        line_yield = ((state["accepted"] + prior * self.PRIOR_DECISIONS) /
+                      (state["decisions"] + self.PRIOR_DECISIONS))
+        weight = line_yield / (line_yield + (max(lines_left, 1) - 1) * prior)
+        return (state["calls_left"] * weight,
+                state["started"] + state["seconds_left"] * weight)
+
+
+    def run_line(self,
+                 line: str,
+                 steps: Iterator[tuple[bool, bool]],
+                 on_done: Callable = None,
+                 lines_left: int = 1) -> str:
+        """
+        Validate the candidate pairs of a strategy line within its share of
+        the budget, updated with the line's yield after every decision.
+        Return the line's status.
+
+        Args:
+            line: name of the line
+            steps: generator that validates one candidate pair per step and
+                   yields (whether the LLM was called, whether it was accepted)
+            on_done: called when the line has no more candidate pairs or
+                     was stopped for low yield.
+            lines_left: number of lines left to validate, this one included
+        """
+        now = time.time()
+        state = {"status": self.OUT_OF_BUDGET,
+                 "llm_calls": 0,
+                 "decisions": 0,
+                 "accepted": 0,
+                 "seconds": 0.,
+                 "recent": deque(maxlen = self.window),
+                 "started": now,
+                 "calls_left": max(self.max_calls - self._calls, 0) if self.max_calls >= 0 else float("inf"),
+                 "seconds_left": max(self._start + self.max_seconds - now, 0) if self.max_seconds >= 0 else float("inf")}
+        self._lines[line] = state
+        while not self.exhausted():
+            max_calls, deadline = self._share(line, lines_left)
+            if state["llm_calls"] >= max_calls or time.time() >= deadline:
+                break
+            start = time.time()
+            try:
+                llm_called, accepted = next(steps)
+            except StopIteration:
+                state["status"] = self.DONE
+                break
+            finally:
+                state["seconds"] += time.time() - start
+            state["decisions"] += 1
+            state["accepted"] += int(accepted)
+            state["recent"].append(accepted)
+            if llm_called:
+                state["llm_calls"] += 1
+                self._calls += 1
+            recent = state["recent"]
+            if (len(recent) == self.window and
+                sum(recent) / len(recent) < self.min_yield):
+                print(f"{line}: acceptance rate dropped under {self.min_yield:.0%}. Stopping the line.")
+                state["status"] = self.LOW_YIELD
+                break
+        steps.close()
+        if state["status"] in (self.DONE, self.LOW_YIELD) and on_done is not None:
+            on_done()
+        return state["status"]
+
+
+    def report(self) -> dict:
+        """
+        LLM spend per line.
+        """
+        report = {line: {"status": state["status"],
+                         "llm_calls": state["llm_calls"],
+                         "decisions": state["decisions"],
+                         "accepted": state["accepted"],
+                         "acceptance_rate": state["accepted"] / state["decisions"] if state["decisions"] else 0,
+                         "seconds": round(state["seconds"], 3)}
+                  for line, state in self._lines.items()}
+        report["total"] = {"llm_calls": self._calls,
+                           "max_calls": self.max_calls,
+                           "seconds": round(time.time() - self._start, 3),
+                           "max_seconds": self.max_seconds}
+        return report
+
+
+    def print_report(self):
+        for line, spend in self.report().items():
+            if line == "total":
+                continue
+            print(f"{line}\t{spend['status']}\tLLM calls: {spend['llm_calls']}\t" +
+                  f"accepted: {spend['accepted']}/{spend['decisions']}\t{spend['seconds']:.0f}s")
+
+
+    def write_report(self,
+                     filename: str | Path):
+        """
+        Save the report as a json file.
+
+        Args:
+            filename: the output json file
+        """
+        Path(filename).parent.mkdir(parents = True, exist_ok = True)
+        with open(filename, "w", encoding = "utf-8") as file:
+            json.dump(self.report(), file, indent = 2)
@@ -0,0 +1,232 @@
+"""
+Pre-screen of the candidate pairs before the LLM validation.
+
+A logistic regression over the scores of a candidate pair (scores_dict) is
+trained from the decisions saved in previous SSSOM outputs (mapping.ttl).
+Candidate pairs with a very low predicted match probability are rejected
+without calling the LLM.
+
+Part of the decisions are held out to estimate the false-reject rate (the
+ratio of "same" pairs that would have been rejected) before the model is
+re-trained on all the decisions.
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import json
+import numpy as np
+
+from pathlib import Path
+from rdflib import Graph, Literal
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+
+from graph.mapping_graph import MappingGraph
+from graph.properties import Properties
+
+properties = Properties()
+
+
+class PreScreen():
+    """
+    Reject candidate pairs with a low match probability.
+    """
+
+    NAME = "prescreen"
+
+    # Value of the missing scores and of the discriminant scores that
+    # did not eliminate the candidate pair (saved as negative values).
+    _MISSING = -1.
+
+    def __init__(self,
+                 threshold: float = 0.02,
+                 test_size: float = 0.2,
+                 min_decisions: int = 50):
+        """
+        Args:
+            threshold: candidate pairs with a lower match probability are rejected.
+            test_size: ratio of the decisions held out to evaluate the model.
+            min_decisions: minimum number of decisions (with both same and
+                           distinct decisions) to train the model.
+        """
+        self.threshold = threshold
+        self.test_size = test_size
+        self.min_decisions = min_decisions
+        self._model = None
+        self._score_names = []
+        self._rejected = 0
+        self._checked = 0
+        self._evaluation = dict()
+
+
+    @property
+    def trained(self) -> bool:
+        return self._model is not None
+
+
+    @staticmethod
+    def load_decisions(mapping_files: list[str | Path]) -> list[tuple[dict, bool]]:
+        """
+        Get the LLM and human decisions (same or distinct) on candidate pairs
+        and their scores from SSSOM ontologies. Only hybrid mappings are
+        used (pairs that were sent to the validator after scoring).
+
+        Args:
+            mapping_files: SSSOM ontologies (mapping.ttl) of previous runs
+        """
+        sssom = MappingGraph._SSSOM
+        obs = str(properties.OBS)
+        decisions = []
+        for mapping_file in mapping_files:
+            graph = Graph()
+            graph.parse(mapping_file)
+            for mapping in graph.subjects(sssom.predicate_id, None):
+                measures = {str(m) for m in graph.objects(mapping, sssom.similarity_measure)}
+                if "hybrid" not in measures:
+                    continue
+                validators = {str(v) for v in graph.objects(mapping, sssom.creator_label)}
+                if PreScreen.NAME in validators:
+                    continue # Do not learn from our own rejections
+                predicate = graph.value(mapping, sssom.predicate_id)
+                if predicate == properties.exact_match:
+                    is_same = True
+                elif predicate == properties.distinct:
+                    is_same = False
+                else:
+                    continue # narrow, broad
+                scores = dict()
+                for pred, value in graph.predicate_objects(mapping):
+                    if str(pred).startswith(obs) and isinstance(value, Literal):
+                        scores[str(pred)[len(obs):]] = float(value)
+                similarity_score = graph.value(mapping, sssom.similarity_score)
+                if similarity_score is not None:
+                    scores["hybrid"] = float(similarity_score)
+                decisions.append((scores, is_same))
+        return decisions
+
+
+    def _vectorize(self,
+                   scores: dict) -> np.ndarray:
+        values = [scores.get(name, self._MISSING) for name in self._score_names]
+        return np.array([value if value >= 0 else self._MISSING for value in values])
+
+
+    def _train(self,
+               X: np.ndarray,
+               y: np.ndarray) -> LogisticRegression:
+        model = LogisticRegression(class_weight = "balanced", max_iter = 1000)
+        model.fit(X, y)
+        return model
+
+
+    def fit(self,
+            mapping_files: list[str | Path],
+            seed: int = 0) -> bool:
+        """
+        Train the model from previous SSSOM outputs. Return False if
+        there is not enough decisions to train it.
+
+        Args:
+            mapping_files: SSSOM ontologies (mapping.ttl) of previous runs
+            seed: seed of the held-out split
+        """
+        decisions = self.load_decisions(mapping_files)
+        return self.fit_decisions(decisions, seed = seed)
+
+
+    def fit_decisions(self,
+                      decisions: list[tuple[dict, bool]],
+                      seed: int = 0) -> bool:
+        """
+        Train the model from a list of (scores_dict, is_same) decisions.
+
+        Args:
+            decisions: the scores of candidate pairs and their validation
+            seed: seed of the held-out split
+        """
+        y = np.array([is_same for _, is_same in decisions], dtype = int)
+        if len(decisions) < self.min_decisions or len(set(y)) < 2:
+            print(f"Warning: not enough decisions to train the pre-screen ({len(decisions)} decisions). " +
+                  "Every candidate pair will be validated by the LLM.")
+            return False
+        self._score_names = sorted({name for scores, _ in decisions for name in scores})
+        X = np.array([self._vectorize(scores) for scores, _ in decisions])
+
+        # Estimate the false-reject rate on held-out decisions
+        X_train, X_test, y_train, y_test = train_test_split(X, y,
+                                                            test_size = self.test_size,
+                                                            random_state = seed,
+                                                            stratify = y)
+        model = self._train(X_train, y_train)
+        rejected = model.predict_proba(X_test)[:, 1] < self.threshold
+        n_same = int(y_test.sum())
+        self._evaluation = {
+            "train_decisions": len(y_train),
+            "held_out_decisions": len(y_test),
+            "held_out_rejected": int(rejected.sum()),
+            "held_out_false_rejects": int((rejected & (y_test == 1)).sum()),
+            "false_reject_rate": float((rejected & (y_test == 1)).sum() / n_same) if n_same else 0.,
+            "held_out_reject_rate": float(rejected.mean()),
+        }
+        self._model = self._train(X, y)
+        print(f"Pre-screen trained on {len(y)} decisions. Estimated false-reject rate: " +
+              f"{self._evaluation['false_reject_rate']:.1%}, calls saved on held-out decisions: " +
+              f"{self._evaluation['held_out_reject_rate']:.1%}.")
+        return True
+
+
+    def probability(self,
+                    scores: dict) -> float:
+        """
+        Predicted probability that a candidate pair is a match.
+
+        Args:
+            scores: the candidate pair's scores_dict
+        """
+        return float(self._model.predict_proba(self._vectorize(scores).reshape(1, -1))[0, 1])
+
+
+    def reject(self,
+               scores: dict) -> tuple[bool, float]:
+        """
+        Return True if the candidate pair should be rejected without
+        calling the LLM, and its match probability.
+
+        Args:
+            scores: the candidate pair's scores_dict
+        """
+        if not self.trained:
+            return False, 1.
+        self._checked += 1
+        probability = self.probability(scores)
+        if probability < self.threshold:
+            self._rejected += 1
+            return True, probability
+        return False, probability
+
+
+    def report(self) -> dict:
+        """
+        LLM calls saved in this run and evaluation on held-out decisions.
+        """
+        return {"threshold": self.threshold,
+                "checked": self._checked,
+                "llm_calls_saved": self._rejected,
+                **self._evaluation}
+
+
+    def write_report(self,
+                     filename: str | Path):
+        """
+        Save the report as a json file.
+
+        Args:
+            filename: the output json file
+        """
+        if not self.trained:
+            return
+        Path(filename).parent.mkdir(parents = True, exist_ok = True)
+        with open(filename, "w", encoding = "utf-8") as file:
+            json.dump(self.report(), file, indent = 2)
+        print(f"Pre-screen rejected {self._rejected} candidate pairs out of {self._checked} " +
+              f"without calling the LLM. Report saved in {filename}.")
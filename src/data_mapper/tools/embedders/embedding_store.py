@@ -0,0 +1,175 @@
+"""
+Memory-mapped storage for embeddings. Vectors are saved as rows of a float32
+matrix on disk, and an index maps the hash of each embedded text to its row.
+This prevents loading (or pickling) every embedding in memory at once and
+lets an interrupted run resume from the rows that were already computed.
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import atexit
+import hashlib
+import json
+import os
+import re
+import numpy as np
+
+from pathlib import Path
+from config import CACHE_DIR
+
+
+class EmbeddingStore():
+    """
+    One store per embedder and per model, as vectors computed by
+    different models can not be compared.
+    The store is saved in CACHE_DIR / embeddings / embedder_name / model.
+    """
+
+    # Rows to add to the matrix file when it is full
+    _GROWTH = 1024
+
+    def __init__(self,
+                 name: str,
+                 model: str,
+                 folder: Path = None):
+        """
+        Args:
+            name: name of the embedder (folder of the store)
+            model: name of the model that computes the vectors
+            folder: root folder of the stores. Default is the cache folder.
+        """
+        if folder is None:
+            folder = CACHE_DIR / "embeddings"
+        self._folder = Path(folder) / name / re.sub(r"[^\w\d.-]+", "_", model)
+        self._folder.mkdir(parents = True, exist_ok = True)
+        self._index_file = self._folder / "index.json"
+        self._matrix_file = self._folder / "vectors.f32"
+        self._model = model
+        self._rows = dict() # {text hash: row}
+        self._dim = 0
+        self._capacity = 0
+        self._matrix = None
+        self._dirty = False # True if rows were written since the last flush
+        if self._index_file.exists():
+            with open(self._index_file, "r", encoding = "utf-8") as file:
+                index = json.load(file)
+            self._dim = index["dim"]
+            self._rows = index["rows"]
+            self._capacity = index["capacity"]
+            if self._dim:
+                self._matrix = np.memmap(self._matrix_file,
+                                         dtype = np.float32,
+                                         mode = "r+",
+                                         shape = (self._capacity, self._dim))
+        atexit.register(self.flush)
+
+
+    @staticmethod
+    def key(text: str) -> str:
+        """
+        Key of a text in the store.
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+    def __contains__(self,
+                     text: str) -> bool:
+        return self.key(text) in self._rows
+
+
+    def get(self,
+            text: str) -> np.ndarray | None:
+        """
+        Get the vector of a text, or None if it was never stored.
+
+        Args:
+            text: the embedded text
+        """
+        row = self._rows.get(self.key(text), None)
+        if row is None:
+            return None
+        return np.array(self._matrix[row])
+
+
+    def put_many(self,
+                 texts: list[str],
+                 vectors: list[list[float]]) -> None:
+        """
+        Write vectors in the matrix. Texts that are already
+        in the store are overwritten.
+
+        Args:
+            texts: the embedded texts
+            vectors: one vector per text, in the same order
+        """
+        if len(texts) != len(vectors):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(texts)} texts.")
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype = np.float32)
+        if not self._dim:
+            self._dim = vectors.shape[1]
+        elif vectors.shape[1] != self._dim:
+            raise ValueError(f"Vectors of dimension {vectors.shape[1]} can not be " +
+                             f"stored with vectors of dimension {self._dim} ({self._model}).")
+        new_keys = {self.key(text) for text in texts} - self._rows.keys()
+        self._reserve(len(self._rows) + len(new_keys))
+        for text, vector in zip(texts, vectors):
+            key = self.key(text)
+            row = self._rows.get(key, None)
+            if row is None:
+                row = len(self._rows)
+                self._rows[key] = row
+            self._matrix[row] = vector
+        self._dirty = True
+
+
+    def _reserve(self,
+                 n_rows: int) -> None:
+        """
+        Grow the matrix file so that it can hold at least n_rows.
+
+        Args:
+            n_rows: number of rows needed
+        """
+        if n_rows <= self._capacity:
+            return
+        capacity = max(n_rows, self._capacity + self._GROWTH)
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        mode = "r+b" if os.path.exists(self._matrix_file) else "w+b"
+        with open(self._matrix_file, mode) as file:
+            file.truncate(capacity * self._dim * np.dtype(np.float32).itemsize)
+        self._capacity = capacity
+        self._matrix = np.memmap(self._matrix_file,
+                                 dtype = np.float32,
+                                 mode = "r+",
+                                 shape = (self._capacity, self._dim))
+
+
+    def flush(self) -> None:
+        """
+        Write the matrix to disk, then the index.
+        The index is written last so that it never refers to missing rows.
+        """
+        if not self._dirty:
+            return
+        self._matrix.flush()
+        tmp_file = self._index_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding = "utf-8") as file:
+            json.dump({"model": self._model,
+                       "dim": self._dim,
+                       "capacity": self._capacity,
+                       "rows": self._rows}, file)
+        os.replace(tmp_file, self._index_file)
+        self._dirty = False
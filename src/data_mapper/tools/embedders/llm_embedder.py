@@ -0,0 +1,106 @@
+"""
+Compute embeddings of entities with the Ollama LLM. Texts are sent by batches
+to /api/embed, and batches are sent concurrently. Vectors are saved in an
+EmbeddingStore so that an entity is only embedded once per model.
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+from tqdm import tqdm
+
+from data_mapper.tools.embedders.embedder import Embedder
+from data_mapper.tools.embedders.embedding_store import EmbeddingStore
+from graph.entity import Entity
+from llm.llm_connection import LLMConnection
+from utils.performances import timeall
+import config
+
+
+class LLMEmbedder(Embedder):
+    """
+    Only for one list of entities at a time.
+    """
+
+    # Name of the score computed by this class (as in score.py)
+    NAME = "llm_embedding"
+
+    TO_EXCLUDE = ["code",
+                  "url",
+                  "ext_ref",
+                  "uri",
+                  "type_confidence",
+                  "location_confidence",
+                  "modified",
+                  "deprecated",
+                  "source",
+                  "exact_match",
+                  "latitude",
+                  "longitude",
+                  "has_part",
+                  "is_part_of",
+                  "prior_id"]
+
+    # One store per model
+    _stores = dict()
+
+    @timeall
+    def compute(self, entities: List[Entity]) -> np.ndarray:
+        """
+        Get the LLM embeddings of the entities. Only the entities that
+        are not in the store yet are sent to the LLM.
+
+        Args:
+            entities: the entities to embed
+        """
+        if type(entities) == Entity:
+            entities = [entities]
+        texts = [entity.to_string(exclude = self.TO_EXCLUDE,
+                                  limit = 200)
+                 for entity in entities]
+        store = self._get_store(config.OLLAMA_MODEL)
+
+        # Remove duplicates and already embedded texts
+        missing = [text for text in dict.fromkeys(texts) if text not in store]
+        if missing:
+            self._embed_missing(missing, store)
+
+        return np.stack([store.get(text) for text in texts])
+
+
+    def _embed_missing(self,
+                       texts: list[str],
+                       store: EmbeddingStore) -> None:
+        """
+        Send the texts by batches to the LLM and save the vectors
+        in the store as soon as each batch is computed.
+
+        Args:
+            texts: texts that are not in the store
+            store: the store of the current model
+        """
+        batch_size = config.LLM_EMBEDDING_BATCH_SIZE
+        batches = [texts[i:i + batch_size]
+                   for i in range(0, len(texts), batch_size)]
+        try:
+            with ThreadPoolExecutor(max_workers = config.LLM_EMBEDDING_WORKERS) as executor:
+                futures = {executor.submit(LLMConnection.embed_batch,
+                                           batch,
+                                           model = config.OLLAMA_MODEL):
+                           batch for batch in batches}
+                for future in tqdm(as_completed(futures),
+                                   total = len(futures),
+                                   desc = f"{self.NAME} ({len(texts)} texts)"):
+                    store.put_many(futures[future], future.result())
+        finally:
+            # Keep the computed batches if a request failed
+            store.flush()
+
+
+    def _get_store(self,
+                   model: str) -> EmbeddingStore:
+        if model not in self._stores:
+            self._stores[model] = EmbeddingStore(self.NAME, model)
+        return self._stores[model]
@@ -0,0 +1,125 @@
+"""
+Benchmark of the offline geocoder (utils/offline_geocoder.py) on the
+locations of the observatories already geocoded by Nominatim: the
+coordinates (latlong/) and the names or addresses (geocode/) saved in the
+location cache (location_infos.sqlite, or the previous location_infos.json).
+
+get_location_info is run again on each location without the cache and
+without the Nominatim fallback. The countries and continents found are
+compared to Nominatim's. Nominatim's time is estimated from its rate
+limit (1 request per second), without the network's latency.
+
+The gazetteer must be downloaded first (https://download.geonames.org/export/dump/),
+ex: cities1000.txt and admin1CodesASCII.txt in data/gazetteer.
+
+Usage (from the src folder):
+    python -m evaluation.benchmark_geocoding --gazetteer ../data/gazetteer
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import config
+import json
+import sys
+import time
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+from utils import location_utilities
+from utils.location_cache import LocationCache
+from utils.offline_geocoder import OfflineGeocoder
+
+
+def load_reference(location_infos_file: Path) -> tuple[list, list]:
+    """
+    Get the coordinates and the names geocoded by Nominatim,
+    with their country and continent.
+
+    Args:
+        location_infos_file: the location cache (SQLite or JSON file)
+    """
+    if location_infos_file.suffix == ".json":
+        with open(location_infos_file, "r", encoding = "utf-8") as file:
+            location_infos = json.load(file)
+    else:
+        location_infos = dict(LocationCache(location_infos_file))
+    points = []
+    names = []
+    for key, value in location_infos.items():
+        if not value.get("country"):
+            continue
+        reference = (value["country"], value.get("continent"))
+        if key.startswith("latlong/"):
+            _, latitude, longitude = key.split('/')
+            points.append(((float(latitude), float(longitude)), reference))
+        elif key.startswith("geocode/"):
+            names.append((key[len("geocode/"):], reference))
+    return points, names
+
+
+def main(gazetteer_dir: Path,
+         location_infos_file: Path,
+         repeat: int):
+    config.GEOCODER = "offline"
+    config.GEOCODER_FALLBACK = False
+    start = time.perf_counter()
+    geocoder = OfflineGeocoder.load(gazetteer_dir)
+    if geocoder is None:
+        print(f"No gazetteer in {gazetteer_dir}. Download cities1000.txt and admin1CodesASCII.txt from " +
+              "https://download.geonames.org/export/dump/", file = sys.stderr)
+        return
+    OfflineGeocoder._GEOCODER, OfflineGeocoder._LOADED = geocoder, True
+    print(f"Gazetteer of {len(geocoder.places)} places loaded in {time.perf_counter() - start:.2f}s.")
+
+    points, names = load_reference(location_infos_file)
+    for method, queries, get_location_info in [
+            ("reverse", points, lambda point: location_utilities.get_location_info(latitude = point[0],
+                                                                                   longitude = point[1],
+                                                                                   from_cache = False)),
+            ("geocode", names, lambda name: location_utilities.get_location_info(location = name,
+                                                                                 from_cache = False))]:
+        durations = []
+        for _ in range(repeat):
+            location_utilities.location_infos = dict() # Not saved at exit
+            start = time.perf_counter()
+            results = [get_location_info(query) for query, _ in queries]
+            durations.append(time.perf_counter() - start)
+        found = [(result, reference) for result, (_, reference) in zip(results, queries)
+                 if result.get("country")]
+        same_country = sum(result["country"] == reference[0] for result, reference in found)
+        same_continent = sum(result.get("continent") == reference[1] for result, reference in found)
+        print(f"{method}\t{len(queries)} locations\tbest of {repeat}: {min(durations):.2f}s " +
+              f"(Nominatim: more than {len(queries)}s)\t" +
+              f"{len(queries) / min(durations):.0f} locations/s")
+        print(f"\tfound: {len(found)}, not found (Nominatim fallback): {len(queries) - len(found)}")
+        if found:
+            print(f"\tsame country as Nominatim: {same_country / len(found):.1%}, " +
+                  f"same continent: {same_continent / len(found):.1%}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog = "benchmark_geocoding",
+                            description = "Benchmark the offline geocoder on the locations geocoded by Nominatim.")
+    parser.add_argument("-g",
+                        "--gazetteer",
+                        dest = "gazetteer_dir",
+                        default = config.GAZETTEER_DIR,
+                        type = Path,
+                        help = f"Folder of the GeoNames files. Default is {config.GAZETTEER_DIR}.")
+    parser.add_argument("-c",
+                        "--cache",
+                        dest = "location_infos_file",
+                        default = config.LOCATION_CACHE_FILE,
+                        type = Path,
+                        help = "Locations geocoded by Nominatim. Default is the location cache.")
+    parser.add_argument("-r",
+                        "--repeat",
+                        dest = "repeat",
+                        default = 3,
+                        type = int,
+                        help = "Number of runs of each method. Default is 3.")
+    args = parser.parse_args()
+    main(args.gazetteer_dir,
+         args.location_infos_file,
+         args.repeat)
@@ -0,0 +1,86 @@
+"""
+Benchmark of the insertion of an extractor's data into the graph:
+one Graph.add per predicate (previous Updater.add_entities) against
+Graph.add_many (a single addN). Location retrieval is not included.
+The data is extracted from the cache (the first run will download it).
+
+Usage (from the src folder):
+    python -m evaluation.benchmark_graph_insertion -l wikidata
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import time
+
+from argparse import ArgumentParser
+
+from graph.graph import Graph
+from graph.extractor.extractor_lists import ExtractorLists
+from utils.string_utilities import standardize_uri
+
+
+def _entities(data: dict) -> dict:
+    """
+    Typed entities, as inserted by Updater.add_entities.
+    """
+    return {identifier: features for identifier, features in data.items()
+            if features.get("type")}
+
+
+def insert_one_by_one(data: dict,
+                      extractor) -> tuple[Graph, float]:
+    graph = Graph(replace = True)
+    start = time.perf_counter()
+    for subj, features in _entities(data).items():
+        for predicate, obj in features.items():
+            graph.add((subj, predicate, obj), extractor = extractor)
+    return graph, time.perf_counter() - start
+
+
+def insert_many(data: dict,
+                extractor) -> tuple[Graph, float]:
+    graph = Graph(replace = True)
+    start = time.perf_counter()
+    graph.add_many(_entities(data), extractor = extractor)
+    return graph, time.perf_counter() - start
+
+
+def main(list_name: str,
+         repeat: int):
+    extractor = ExtractorLists.EXTRACTORS_BY_NAMES[list_name]()
+    data = extractor.extract(from_cache = True)
+    print(f"{list_name}: {len(data)} entities.")
+    for name, insert in [("Graph.add", insert_one_by_one),
+                         ("Graph.add_many", insert_many)]:
+        durations = []
+        for _ in range(repeat):
+            standardize_uri.cache_clear() # Cold memo table
+            graph, duration = insert(data, extractor)
+            durations.append(duration)
+        triples = set(graph.graph)
+        print(f"{name}\t{len(triples)} triples\tbest of {repeat}: {min(durations):.2f}s\t" +
+              f"{len(triples) / min(durations):.0f} triples/s")
+        if name == "Graph.add":
+            reference = triples
+        elif triples != reference:
+            print("Warning: the graphs are different.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog = "benchmark_graph_insertion",
+                            description = "Benchmark the insertion of an extractor's data into the graph.")
+    parser.add_argument("-l",
+                        "--list",
+                        dest = "list_name",
+                        default = "wikidata",
+                        choices = list(ExtractorLists.EXTRACTORS_BY_NAMES.keys()),
+                        help = "List to insert. Default is wikidata.")
+    parser.add_argument("-r",
+                        "--repeat",
+                        dest = "repeat",
+                        default = 3,
+                        type = int,
+                        help = "Number of runs of each method. Default is 3.")
+    args = parser.parse_args()
+    main(args.list_name,
+         args.repeat)
@@ -0,0 +1,192 @@
+"""
+Benchmark of the retrieval of the paged lists (IMCCE and NSSDC): the
+previous retrieval, one page after the other (the IMCCE search pages until
+an empty page, the NSSDC disciplines' queries then the spacecraft pages),
+against the extractors' prefetching (IMCCE's pages offsets computed from
+the total of the first page, NSSDC's queries and pages downloaded at the
+same time).
+
+Each run is cold: the pages are downloaded in an empty cache from a local
+stand-in of the websites (graph/extractor/list_stub.py) answering with a
+latency, without rate limit (config.HTTP_MAX_CONNECTIONS_PER_HOST
+concurrent requests).
+
+Usage (from the src folder):
+    python -m evaluation.benchmark_paged_retrieval
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import config
+import json
+import tempfile
+import threading
+import time
+
+from argparse import ArgumentParser
+from bs4 import BeautifulSoup
+from pathlib import Path
+from urllib.parse import urlparse
+
+from graph.extractor import cache
+from graph.extractor.cache import CacheManager
+from graph.extractor.imcce_extractor import ImcceExtractor
+from graph.extractor.list_stub import ListStub
+from graph.extractor.nssdc_extractor import NssdcExtractor
+
+
+NSSDC_PAGE = ('<html><body><h1>{label}</h1><p><strong>NSSDCA/COSPAR ID:</strong> {id}</p>' +
+              '<div class="twocol"><div class="urone"><h2>Description</h2><p>The {label} spacecraft.</p></div>' +
+              '<div class="urtwo"><p><strong>Launch Date:</strong> {launch_date}</p>' +
+              '<h2>Alternate Names</h2><ul><li>{alt_label}</li></ul>' +
+              '<h2>Disciplines</h2><ul><li>{discipline}</li></ul></div></div></body></html>')
+
+
+def write_fixtures(fixtures_dir: Path,
+                   count: int):
+    """
+    Write count IMCCE results and count NSSDC spacecraft pages
+    in the fixtures folder of the list stub.
+
+    Args:
+        fixtures_dir: the stub's fixtures folder.
+        count: number of entities of each list.
+    """
+    results = [{"id": f"Spacecraft_{i}",
+                "name": f"Spacecraft {i}",
+                "type": "Spacecraft",
+                "parent": "Sun" if i % 2 else "Neptune",
+                "updated": "2024-01-01",
+                "aliases": [f"SC-{i}", f"{1990 + i % 30}-{i % 1000:03d}A"],
+                "links": {"self": f"https://api.ssodnet.imcce.fr/quaero/1/sso/Spacecraft_{i}"}}
+               for i in range(count)]
+    fixtures_dir.mkdir(parents = True, exist_ok = True)
+    (fixtures_dir / "imcce.json").write_text(json.dumps(results), encoding = "utf-8")
+
+    (fixtures_dir / "nssdc").mkdir(exist_ok = True)
+    disciplines = {discipline: [] for discipline in NssdcExtractor.DISCIPLINES}
+    for i in range(count):
+        spacecraft_id = f"{1990 + i % 30}-{i:03d}A"
+        discipline = list(disciplines)[i % len(disciplines)]
+        disciplines[discipline].append(spacecraft_id)
+        if i % 3 == 0:
+            # Listed in two disciplines
+            disciplines[list(disciplines)[(i + 1) % len(disciplines)]].append(spacecraft_id)
+        page = NSSDC_PAGE.format(label = f"Spacecraft {i}",
+                                 id = spacecraft_id,
+                                 launch_date = f"{1990 + i % 30}-01-01",
+                                 alt_label = f"SC-{i}",
+                                 discipline = NssdcExtractor.DISCIPLINES[discipline])
+        (fixtures_dir / "nssdc" / f"{spacecraft_id}.html").write_text(page, encoding = "utf-8")
+    (fixtures_dir / "nssdc" / "disciplines.json").write_text(json.dumps(disciplines), encoding = "utf-8")
+
+
+def imcce_pages_sequential(extractor: ImcceExtractor) -> list[dict]:
+    """
+    Previous retrieval of the IMCCE search pages (ImcceExtractor.extract's
+    loop): one page after the other, until an empty page.
+    """
+    pages = []
+    offset = 0
+    while True:
+        page = extractor._get_page(offset)
+        if not page:
+            break # last page
+        pages.append(page)
+        offset += extractor.LIMIT
+    return pages
+
+
+def nssdc_pages_sequential(extractor: NssdcExtractor) -> list[str]:
+    """
+    Previous retrieval of the NSSDC pages: the disciplines' queries,
+    then the spacecraft pages, one after the other.
+    """
+    entities_url = set()
+    for discipline in extractor.DISCIPLINES.keys():
+        content = CacheManager.get_page(config.NSSDC_HOST + extractor._QUERY_PATH,
+                                        extractor.CACHE,
+                                        data = {"name": "",
+                                                "discipline": discipline,
+                                                "launch": ""},
+                                        data_str = discipline)
+        table = BeautifulSoup(content, "html.parser").find('table')
+        for a_tag in table.find_all('a', href=True):
+            entities_url.add(a_tag['href'])
+    return [CacheManager.get_page(config.NSSDC_HOST + entity_url, extractor.CACHE)
+            for entity_url in sorted(entities_url)]
+
+
+def nssdc_pages(extractor: NssdcExtractor) -> list[str]:
+    """
+    Pages downloaded by NssdcExtractor.extract.
+    """
+    return CacheManager.get_many([config.NSSDC_HOST + entity_url
+                                  for entity_url in extractor._get_entities_url()],
+                                 extractor.CACHE)
+
+
+def main(count: int,
+         latency: float,
+         repeat: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        write_fixtures(Path(tmp) / "fixtures", count)
+        stub = ListStub(Path(tmp) / "fixtures", port = 0, latency = latency)
+        threading.Thread(target = stub.serve_forever, daemon = True).start()
+        config.IMCCE_HOST = stub.url
+        config.NSSDC_HOST = stub.url
+        CacheManager.PACK = None
+        CacheManager.POOL.host_limits = {**CacheManager.POOL.host_limits,
+                                         urlparse(stub.url).netloc: (config.HTTP_MAX_CONNECTIONS_PER_HOST, -1)}
+        print(f"{count} entities per list, {latency * 1000:.0f} ms per request.")
+        try:
+            for name, runs in [("imcce", [("sequential", lambda: imcce_pages_sequential(ImcceExtractor())),
+                                          ("prefetch", lambda: ImcceExtractor()._get_pages())]),
+                               ("nssdc", [("sequential", lambda: nssdc_pages_sequential(NssdcExtractor())),
+                                          ("concurrent", lambda: nssdc_pages(NssdcExtractor()))])]:
+                for method, run in runs:
+                    durations = []
+                    for i in range(repeat):
+                        # Cold cache
+                        cache.CACHE_DIR = Path(tmp) / f"cache_{name}_{method}_{i}"
+                        requests_count = stub.requests_count
+                        start = time.perf_counter()
+                        pages = run()
+                        durations.append(time.perf_counter() - start)
+                        requests_count = stub.requests_count - requests_count
+                    print(f"{name} {method}\tbest of {repeat}: {min(durations):.2f}s\t" +
+                          f"{requests_count} requests\t" +
+                          f"{requests_count / min(durations):.0f} requests/s")
+                    if method == "sequential":
+                        reference = pages
+                    elif pages != reference:
+                        print("Warning: the pages are different.")
+        finally:
+            stub.shutdown()
+            stub.server_close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog = "benchmark_paged_retrieval",
+                            description = "Benchmark the retrieval of the IMCCE and NSSDC pages on a local stub.")
+    parser.add_argument("-n",
+                        "--count",
+                        dest = "count",
+                        default = 1000,
+                        type = int,
+                        help = "Number of entities of each list. Default is 1000.")
+    parser.add_argument("--latency",
+                        dest = "latency",
+                        default = 0.05,
+                        type = float,
+                        help = "Seconds to wait before answering a request. Default is 0.05.")
+    parser.add_argument("-r",
+                        "--repeat",
+                        dest = "repeat",
+                        default = 3,
+                        type = int,
+                        help = "Number of runs of each method. Default is 3.")
+    args = parser.parse_args()
+    main(args.count,
+         args.latency,
+         args.repeat)
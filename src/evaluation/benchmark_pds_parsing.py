@@ -0,0 +1,167 @@
+"""
+Benchmark of the parsing of the PDS XML files: the previous parsing
+(ET.fromstring of the whole file, then a search of the tree for each
+needed element, one file after the other) against parse_label
+(single-pass iterparse), run sequentially and in the pool of processes
+of PdsExtractor._iter_labels.
+
+The benchmark runs on a warm cache to measure the parsing throughput
+and not the network: run the PDS extractor once before to download the
+files (python update.py -l pds).
+
+Usage (from the src folder):
+    python -m evaluation.benchmark_pds_parsing
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import re
+import time
+
+from argparse import ArgumentParser
+from xml.etree import ElementTree as ET
+
+from graph import entity_types
+from graph.extractor.cache import CacheManager
+from graph.extractor.pds_extractor import PdsExtractor, parse_label
+from utils.string_utilities import get_aperture
+
+
+def parse_label_tree(content: str,
+                     cat: str,
+                     resource_url: str) -> dict:
+    """
+    Previous parsing of a PDS XML file (PdsExtractor.extract's loop).
+    """
+    data = dict()
+    content = re.sub(r'xmlns="[^"]+"', '', content)
+    root = ET.fromstring(content.encode("utf-8"))
+    has_part = []
+    is_part_of = []
+    for internal_reference in root.findall(".//Internal_Reference"):
+        lid_reference = internal_reference.find("lid_reference")
+        if lid_reference is None or not lid_reference.text:
+            continue
+        reference_type = internal_reference.find("reference_type")
+        if reference_type.text in ["investigation_to_instrument_host",
+                                   "instrument_host_to_instrument",
+                                   "investigation_to_instrument",
+                                   "facility_to_telescope"]:
+            has_part.append(lid_reference.text)
+        elif reference_type.text in ["instrument_host_to_investigation",
+                                     "instrument_to_instrument_host",
+                                     "instrument_to_investigation",
+                                     "telescope_to_facility"]:
+            is_part_of.append(lid_reference.text)
+        elif reference_type.text.endswith("to_destination"):
+            data["destination"] = lid_reference.text
+    if has_part:
+        data["has_part"] = has_part
+    if is_part_of:
+        data["is_part_of"] = is_part_of
+
+    facility = root.find(f".//{cat.title()}")
+    if facility is None:
+        facility = root.findall('*')[-1]
+    for tag in facility.findall('*'):
+        if tag.text is None:
+            continue
+        tag_text = tag.text.strip()
+        if tag_text in ["NULL", "Unknown"]:
+            continue
+        tag_str = PdsExtractor.FACILITY_ATTRS.get(tag.tag, tag.tag)
+        tag_text = re.sub("[\n ]+", " ", tag_text)
+        if tag_str == "aperture":
+            unit = tag.attrib["unit"]
+            tag_text = tag_text + unit
+            if unit != 'm':
+                _, tag_text = get_aperture(tag_text)
+                tag_text = list(tag_text)[0]
+        if tag_str == "label":
+            data["label"] = tag_text
+        elif tag_str in data:
+            data[tag_str].add(tag_text)
+        else:
+            data[tag_str] = {tag_text}
+
+    aliases = root.find(".//Alias_List")
+    if aliases is not None and len(aliases):
+        for tag in aliases.iter():
+            if tag.text is None or tag.tag not in PdsExtractor.FACILITY_ATTRS:
+                continue
+            tag_text = tag.text.strip()
+            if tag_text in ["NULL", "Unknown"]:
+                continue
+            tag_str = PdsExtractor.FACILITY_ATTRS.get(tag.tag, tag.tag)
+            tag_text = re.sub("[\n ]+", " ", tag_text)
+            if tag_str == "label":
+                data["label"] = tag_text
+                continue
+            if tag_str in data:
+                data[tag_str].add(tag_text)
+            else:
+                data[tag_str] = {tag_text}
+
+    data["url"] = resource_url
+    label = root.find(".//title")
+    if label is not None:
+        label = label.text.strip()
+        if "label" not in data:
+            data["label"] = label
+    logical_identifier = root.find(".//logical_identifier")
+    if logical_identifier is not None:
+        data["code"] = logical_identifier.text.strip()
+    data["type"] = PdsExtractor.TYPES[cat]
+    data["type_confidence"] = 1
+    if data["type"] == entity_types.GROUND_OBSERVATORY:
+        for name, new_cat in PdsExtractor.NAME_CONTAINS.items():
+            if name in data["label"].lower():
+                data["type"] = new_cat
+                break
+    return data
+
+
+def main(repeat: int):
+    extractor = PdsExtractor()
+    resources = extractor._resources(from_cache = True)
+    contents = [CacheManager.get_cached(url, extractor.CACHE) for _, url in resources]
+    resources = [resource for resource, content in zip(resources, contents) if content]
+    contents = [content for content in contents if content]
+    size = sum(len(content) for content in contents) / 1e6
+    print(f"pds: {len(contents)} cached XML files ({size:.1f} MB).")
+    if not contents:
+        print("The cache is empty: run python update.py -l pds first.")
+        return
+
+    def sequential(parse):
+        return lambda: [parse(content, cat, url)
+                        for (cat, url), content in zip(resources, contents)]
+
+    for name, run in [("ET.fromstring", sequential(parse_label_tree)),
+                      ("iterparse", sequential(parse_label)),
+                      ("iterparse (processes)", lambda: list(extractor._iter_labels(resources)))]:
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            entities = run()
+            durations.append(time.perf_counter() - start)
+        print(f"{name}\tbest of {repeat}: {min(durations):.2f}s\t" +
+              f"{len(entities) / min(durations):.0f} files/s\t" +
+              f"{size / min(durations):.1f} MB/s")
+        if name == "ET.fromstring":
+            reference = entities
+        elif entities != reference:
+            print("Warning: the entities are different.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog = "benchmark_pds_parsing",
+                            description = "Benchmark the parsing of the cached PDS XML files.")
+    parser.add_argument("-r",
+                        "--repeat",
+                        dest = "repeat",
+                        default = 3,
+                        type = int,
+                        help = "Number of runs of each method. Default is 3.")
+    args = parser.parse_args()
+    main(args.repeat)
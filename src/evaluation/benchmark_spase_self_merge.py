@@ -0,0 +1,252 @@
+"""
+Benchmark of the merging of the SPASE entities: the previous pairwise
+comparisons of SpaseExtractor._self_merge and _self_merge_instruments
+(every pair of entities) against the blocking index (only the entities
+that share an identifier, a first word, a label or a filename).
+Both must give the same merged entities.
+
+The SPASE repository is read from the cache (the first run will clone it).
+
+Usage (from the src folder):
+    python -m evaluation.benchmark_spase_self_merge
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import copy
+import time
+
+from argparse import ArgumentParser
+from collections import defaultdict
+
+from graph import entity_types
+from graph.extractor import data_fixer
+from graph.extractor.spase_extractor import SpaseExtractor
+from utils.dict_utilities import merge_into, UnionFind
+from utils.location_utilities import distance
+from utils.string_utilities import cut_acronyms, get_suffix_number
+
+
+def self_merge_pairwise(result: dict) -> dict:
+    """
+    Previous SpaseExtractor._self_merge: compare every pair of entities.
+    """
+    reached = 0
+    replacement_labels = dict()
+    uf = UnionFind()
+    groups = defaultdict(set)
+    items = sorted(result.items()) # Make sure to always get the same uris
+    for uri1, data1 in items:
+        if data1.get("type") == entity_types.INSTRUMENT:
+            continue
+        label1 = data1["label"]
+        labels1 = data1.get("alt_label", set())
+        labels1.add(label1)
+        first_words1 = {label.replace('-', ' ').replace('.', ' ').split(' ')[0] for label in labels1 if label}
+
+        num1 = get_suffix_number(uri1)
+        for uri2, data2 in items:
+            if uri1 >= uri2:
+                continue
+            if data1.get("type") != data2.get("type"):
+                continue
+
+            to_check = ["NSSDCA_ID", "prior_id", "code"]
+            v1 = []
+            v2 = []
+            for attr in to_check:
+                if attr in data1:
+                    v1.extend(data1[attr])
+                if attr in data2:
+                    v2.extend(data2[attr])
+            if set(v1) & set(v2):
+                uf.union(uri1, uri2)
+                continue
+
+            num2 = get_suffix_number(uri2)
+            if num1 != num2:
+                continue
+            label2 = data2["label"]
+            labels2 = data2.get("alt_label", set())
+            labels2.add(label2)
+            first_words2 = {label.replace('-', ' ').replace('.', ' ').split(' ')[0] for label in labels2 if label}
+            if not first_words1 & first_words2:
+                continue
+            if "NSSDCA_ID" in data1 and "NSSDCA_ID" in data2:
+                if data1["NSSDCA_ID"] != data2["NSSDCA_ID"]:
+                    continue
+            if uri1.split('/')[-1] == uri2.split('/')[-1]:
+                uf.union(uri1, uri2)
+                continue
+            if "latitude" in data1 and "latitude" in data2 and "longitude" in data1 and "longitude" in data2:
+                reached += 1
+                latitude1 = data1["latitude"]
+                longitude1 = data1["longitude"]
+                latitude2 = data2["latitude"]
+                longitude2 = data2["longitude"]
+                if type(latitude1) in (set, list):
+                    assert len(latitude1) == 1
+                    latitude1 = list(latitude1)[0]
+                    longitude1 = list(longitude1)[0]
+                if type(latitude2) in (set, list):
+                    assert len(latitude2) == 1
+                    latitude2 = list(latitude2)[0]
+                    longitude2 = list(longitude2)[0]
+                dist = distance((latitude1, longitude1), (latitude2, longitude2))
+                if dist < 4.0: # change from 4.0 to 30.0 for Fort.Rae & FRA. Better: fix in data_fixer for this case only.
+                    uf.union(uri1, uri2)
+                    continue
+            elif "start_date" in data1 and "start_date" in data2:
+                if data1["start_date"] == data2["start_date"]:
+                    uf.union(uri1, uri2)
+                    continue
+            elif "launch_date" in data1 and "launch_date" in data2:
+                if data1["launch_date"] == data2["launch_date"]:
+                    uf.union(uri1, uri2)
+                    continue
+            alt_labels1 = data1.get("alt_label", set())
+            alt_labels2 = data2.get("alt_label", set())
+            label1, acr1 = cut_acronyms(label1)
+            label2, acr2 = cut_acronyms(label2)
+            alt_labels1.add(label1)
+            alt_labels2.add(label2)
+            alt_labels1 = {l.replace('-', ' ').lower() for l in alt_labels1}
+            alt_labels2 = {l.replace('-', ' ').lower() for l in alt_labels2}
+            if any(l.startswith("iaga") for l in alt_labels1):
+                for label in alt_labels1.copy():
+                    alt_labels1.add(label + " geomagnetic observatory")
+            if any(l.startswith("iaga") for l in alt_labels2):
+                for label in alt_labels2.copy():
+                    alt_labels2.add(label + " geomagnetic observatory")
+            if alt_labels1 & alt_labels2:
+                uf.union(uri1, uri2)
+                continue
+
+    for uri in result:
+        groups[uf.find(uri)].add(uri)
+    for synset in groups.values():
+        if len(synset) <= 1:
+            continue
+        synset = sorted(synset, key=lambda x: (len(x), x), reverse=True)
+        for i in range(0, len(synset)):
+            longest = synset[i]
+            if "Deprecated" not in longest:
+                break
+        data1 = result[longest]
+
+        for label2 in synset:
+            if label2 == longest:
+                continue
+            data2 = result[label2]
+            merge_into(data1, data2)
+            del result[label2]
+            replacement_labels[label2] = longest
+    return replacement_labels
+
+
+def self_merge_instruments_pairwise(result: dict):
+    """
+    Previous SpaseExtractor._self_merge_instruments: compare every
+    pair of instruments of a host.
+    """
+    uf = UnionFind()
+    all_instruments = set()
+    for _, data in sorted(result.items()):
+        has_part = sorted(data.get("has_part", []))
+        if len(has_part) <= 1:
+            continue
+        for instrument1 in has_part:
+            data1 = result[instrument1]
+            if data1["type"] != entity_types.INSTRUMENT:
+                continue
+            for instrument2 in has_part:
+                if instrument1 >= instrument2:
+                    continue
+                data2 = result[instrument2]
+
+                if data2["type"] != entity_types.INSTRUMENT:
+                    continue
+
+                alt_labels1 = data1.get("alt_label", set())
+                alt_labels2 = data2.get("alt_label", set())
+                label1 = data1["label"]
+                label2 = data2["label"]
+                alt_labels1.add(label1)
+                alt_labels2.add(label2)
+                if alt_labels1 & alt_labels2:
+                    uf.union(instrument1, instrument2)
+                    all_instruments.update([instrument1, instrument2])
+                    continue
+
+                urls1 = data1["url"]
+                urls2 = data2["url"]
+                if type(urls1) == str:
+                    urls1 = [urls1]
+                if type(urls2) == str:
+                    urls2 = [urls2]
+                urls1 = [f1.split('/')[-1] for f1 in urls1 if f1]
+                urls2 = [f2.split('/')[-1] for f2 in urls2 if f2]
+                if set(urls1) & set(urls2):
+                    uf.union(instrument1, instrument2)
+                    all_instruments.update([instrument1, instrument2])
+                    continue
+    for instrument2 in all_instruments:
+        instrument1 = uf.find(instrument2)
+        if instrument1 == instrument2:
+            continue
+        data1 = result[instrument1]
+        data2 = result[instrument2]
+        merge_into(data1, data2)
+        del result[instrument2]
+
+
+def merge_pairwise(extractor: SpaseExtractor,
+                   result: dict) -> dict:
+    """
+    Previous merging steps of SpaseExtractor.extract.
+    """
+    self_merge_pairwise(result)
+    extractor._restore_self_ref(result)
+    self_merge_instruments_pairwise(result)
+    return result
+
+
+def merge_blocked(extractor: SpaseExtractor,
+                  result: dict) -> dict:
+    extractor._self_merge(result)
+    extractor._restore_self_ref(result)
+    extractor._self_merge_instruments(result)
+    return result
+
+
+def main(repeat: int):
+    extractor = SpaseExtractor()
+    data = extractor._extract_files(from_cache = True)
+    data_fixer.fix(data, extractor)
+    print(f"spase: {len(data)} entities.")
+    for name, merge in [("pairwise", merge_pairwise),
+                        ("blocking index", merge_blocked)]:
+        durations = []
+        for _ in range(repeat):
+            result = copy.deepcopy(data)
+            start = time.perf_counter()
+            merge(extractor, result)
+            durations.append(time.perf_counter() - start)
+        print(f"{name}\t{len(result)} entities after merging\tbest of {repeat}: {min(durations):.2f}s")
+        if name == "pairwise":
+            reference = result
+        elif result != reference:
+            print("Warning: the merged entities are different.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog = "benchmark_spase_self_merge",
+                            description = "Benchmark the merging of the SPASE entities.")
+    parser.add_argument("-r",
+                        "--repeat",
+                        dest = "repeat",
+                        default = 3,
+                        type = int,
+                        help = "Number of runs of each method. Default is 3.")
+    args = parser.parse_args()
+    main(args.repeat)
@@ -14,6 +14,7 @@ from graph.graph import Graph
 from rdflib import URIRef
 from pathlib import Path
 from llm import llm_connection
+from llm.prompt_builder import PromptBuilder
 
 
 def to_string(data: dict,
@@ -156,4 +157,5 @@ if __name__ == "__main__":
     plt.yticks(rotation=0)
     plt.tight_layout()
     plt.savefig(f"confusion_matrix_types_{config.OLLAMA_MODEL}_score_{score}.jpg")
+    PromptBuilder.print_token_report()
 
@@ -4,7 +4,13 @@ Cache manager to prevent requesting websites many times and keep
 operational local versions of the web pages. This could also be achieved using
 https://web.archive.org/web/date/url instead of the actual page.
 The cache is saved locally in the /cache folder. In order to actualize the
-pages' content, change the cache's file name or remove it.
+pages' content, change the cache's file name or remove it, run with
+from_cache = False, or set a TTL for the list in config.CACHE_TTL_DAYS.
+Pages are compressed (config.CACHE_COMPRESSION) and saved with the
+response's ETag and Last-Modified date, so that a refresh only downloads
+the pages that changed (conditional GET).
+With config.CACHE_BACKEND = "sqlite", the pages are saved in a single
+SQLite file instead (see cache_pack.py).
 
 Author:
     Liza Fretel (liza.fretel@obspm.fr)
@@ -12,6 +18,8 @@ Author:
 
 import glob
 from pathlib import Path
+import gzip
+import hashlib
 import pickle
 import re
 import requests
@@ -20,12 +28,26 @@ import os
 import subprocess
 import json
 import datetime
+import threading
+import time
 
-from config import CACHE_DIR, LOGS_DIR, DATA_DIR # type: ignore
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from config import CACHE_DIR, LOGS_DIR, DATA_DIR, HTTP_WORKERS # type: ignore
+from config import CACHE_COMPRESSION, CACHE_TTL_DAYS, CACHE_DEFAULT_TTL_DAYS # type: ignore
+from config import CACHE_BACKEND, CACHE_PACK_FILE # type: ignore
+from config import VERSION_REFRESH_BATCH_SIZE, VERSION_REFRESH_INTERVAL # type: ignore
+from graph.extractor.cache_pack import CachePack
+from graph.extractor.http_pool import HttpPool
 
 # Set up the basic configuration for logging
 LOG = LOGS_DIR / "error.log"
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None # Pages are compressed with gzip
+
 logging.basicConfig(filename=LOG, level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
@@ -49,6 +71,18 @@ class CacheManager():
     'Referer': 'https://heliophysicsdata.gsfc.nasa.gov/websearch/dispatcher'}
     """
 
+    # Keep-alive sessions with per-host concurrency and rate limits
+    POOL = HttpPool(headers = HEADERS)
+
+    # Packed cache (single SQLite file), or None to save one file per page
+    PACK = CachePack(CACHE_PACK_FILE) if CACHE_BACKEND == "sqlite" else None
+
+    # Statistics of the run per list {list_name: {key: value}}
+    _STATS_KEYS = ["hits", "downloads", "revalidated", "failures",
+                   "bytes_downloaded", "bytes_saved"]
+    _stats = defaultdict(lambda: defaultdict(int))
+    _stats_lock = threading.Lock()
+
     def get_page(url: str,
                  list_name: str,
                  params: str = None,
@@ -58,6 +92,9 @@ class CacheManager():
         """
         Get a page from cache if it is saved in cache, else scrap it online.
         If data & data_str are set, send a POST request instead of GET.
+        A cached page older than the list's TTL (CACHE_TTL_DAYS) or a page
+        refreshed with from_cache = False is revalidated with a conditional
+        GET request if the server sent an ETag or a Last-Modified date.
 
         args:
             url: the URL of the page.
@@ -68,22 +105,98 @@ class CacheManager():
                     as the url of the page may not change.
         """
         cache_path = CacheManager._get_cache_path(url, list_name, data_str)
-        content = ""
-        if from_cache and glob.glob(cache_path):
-            with open(cache_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-        if not content:
-            if not data:
-                content = CacheManager.get(url, params = params)
-            else:
-                content = CacheManager.post(url, data)
-            if content:
-                CacheManager.save_cache(content, cache_path)
+        cached = CacheManager._read_cache(cache_path)
+        metadata = CacheManager._read_metadata(cache_path) if cached else dict()
+        if (cached and from_cache and
+            not CacheManager._expired(cache_path, metadata, list_name)):
+            CacheManager._count(list_name, "hits")
+            return cached
+        if not data:
+            headers = dict()
+            if cached and metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if cached and metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+            response = CacheManager._request("GET",
+                                             url,
+                                             params = params,
+                                             headers = headers)
+            if response.status_code == 304 and cached:
+                # Not modified since the last download
+                CacheManager._count(list_name, "revalidated")
+                CacheManager._count(list_name, "bytes_saved", len(cached.encode("utf-8")))
+                metadata["fetched"] = time.time()
+                CacheManager._save_metadata(metadata, cache_path)
+                return cached
+        else:
+            response = CacheManager._request("POST",
+                                             url,
+                                             data = data)
+        content = CacheManager._response_text(url, response)
+        if content:
+            CacheManager._count(list_name, "downloads")
+            CacheManager._count(list_name, "bytes_downloaded", len(response.content))
+            CacheManager.save_cache(content,
+                                    cache_path,
+                                    metadata = {"url": url,
+                                                "etag": response.headers.get("ETag"),
+                                                "last_modified": response.headers.get("Last-Modified"),
+                                                "fetched": time.time()})
+        elif cached and from_cache:
+            # Keep the expired page if it could not be refreshed
+            CacheManager._count(list_name, "hits")
+            return cached
+        else:
+            CacheManager._count(list_name, "failures")
         if not content:
             print(f"Content could not be downloaded for {url}.")
         return content
 
 
+    def get_cached(url: str,
+                   list_name: str,
+                   data_str: str = "") -> str:
+        """
+        Get a page from cache without requesting it. Return an empty
+        string if the page is not in cache or is older than the list's TTL.
+        Used to only request the missing pages of a batch.
+
+        Args:
+            url: the URL of the page.
+            list_name: used to access the right folder of the cache.
+            data_str: a string to save the response in a specific cache file
+                    as the url of the page may not change.
+        """
+        cache_path = CacheManager._get_cache_path(url, list_name, data_str)
+        cached = CacheManager._read_cache(cache_path)
+        if cached and not CacheManager._expired(cache_path,
+                                                CacheManager._read_metadata(cache_path),
+                                                list_name):
+            CacheManager._count(list_name, "hits")
+            return cached
+        return ""
+
+
+    def in_cache(url: str,
+                 list_name: str,
+                 data_str: str = "") -> bool:
+        """
+        Whether a page is in the cache (in any compression format, or in
+        the packed cache), without reading it. The TTL is not checked.
+
+        Args:
+            url: the URL of the page.
+            list_name: used to access the right folder of the cache.
+            data_str: a string to save the response in a specific cache file
+                    as the url of the page may not change.
+        """
+        cache_path = CacheManager._get_cache_path(url, list_name, data_str)
+        if CacheManager.PACK is not None:
+            return CacheManager._pack_key(cache_path) in CacheManager.PACK
+        suffixes = ["", ".gz"] + ([".zst"] if zstandard is not None else [])
+        return any(os.path.isfile(cache_path + suffix) for suffix in suffixes)
+
+
     def _get_cache_path(url: str,
                         list_name: str,
                         data_str: str = "") -> str:
@@ -98,8 +211,9 @@ class CacheManager():
                       as the url of the page may not change.
         """
         # Create folder CACHE
-        (CACHE_DIR / list_name).mkdir(parents = True,
-                                      exist_ok = True)
+        if CacheManager.PACK is None:
+            (CACHE_DIR / list_name).mkdir(parents = True,
+                                          exist_ok = True)
 
         # Create folder list_name
         cache_path = re.sub(r"[^\w\d]+", "_", url)
@@ -108,60 +222,341 @@ class CacheManager():
         cache_path = cache_path.lower()
         cache_path = CACHE_DIR / list_name / cache_path
         if data_str:
-            cache_path.mkdir(parents = True,
-                             exist_ok = True)
+            if CacheManager.PACK is None:
+                cache_path.mkdir(parents = True,
+                                 exist_ok = True)
             cache_path = cache_path / data_str
         cache_path = str(cache_path)
         return cache_path
 
 
     def save_cache(content: str,
-                   cache_path: str) -> None:
+                   cache_path: str,
+                   metadata: dict = None) -> None:
         """
-        Save the page in the cache folder.
+        Save the page in the cache folder, compressed with CACHE_COMPRESSION.
+        The response's metadata (ETag, Last-Modified, download time)
+        are saved next to it.
 
         Args:
             content: the content of the page.
             cache_path: where to save the cache.
+            metadata: the response's metadata.
         """
-        with open(cache_path, 'w', encoding='utf-8') as file:
-            file.write(content)
+        suffix = CacheManager._compression_suffix()
+        body = content.encode("utf-8")
+        if suffix == ".zst":
+            body = zstandard.ZstdCompressor().compress(body)
+        elif suffix == ".gz":
+            body = gzip.compress(body, mtime = 0)
+        if CacheManager.PACK is not None:
+            CacheManager.PACK.put(CacheManager._pack_key(cache_path), body, suffix, metadata)
+            return
+        with open(cache_path + suffix, 'wb') as file:
+            file.write(body)
+        # Remove the previous version of the page in another format
+        for other in ["", ".gz", ".zst"]:
+            if other != suffix and os.path.exists(cache_path + other):
+                os.remove(cache_path + other)
+        if metadata is not None:
+            CacheManager._save_metadata(metadata, cache_path)
 
 
-    def get(url: str,
-            params: dict = None) -> str:
+    def _compression_suffix() -> str:
         """
-        Scrap the web page's content. Encode it using the response's charset.
+        Suffix of the cache files for CACHE_COMPRESSION.
+        """
+        if CACHE_COMPRESSION == "zstd":
+            if zstandard is not None:
+                return ".zst"
+            return ".gz" # zstandard is not installed
+        if CACHE_COMPRESSION == "gzip":
+            return ".gz"
+        return ""
+
+
+    def _pack_key(cache_path: str) -> str:
+        """
+        Key of a page in the packed cache: its path relative to the cache folder.
+        """
+        return Path(cache_path).relative_to(CACHE_DIR).as_posix()
+
+
+    def _read_cache(cache_path: str) -> str:
+        """
+        Read a page from the cache, or return an empty string
+        if it is not in the cache. Uncompressed pages of the
+        previous cache layout are read as well.
 
         Args:
-            url: the url to scrap from.
+            cache_path: the path of the page in the cache.
+        """
+        if CacheManager.PACK is not None:
+            page = CacheManager.PACK.get(CacheManager._pack_key(cache_path))
+            if page is None:
+                return ""
+            body, suffix, _ = page
+            if suffix == ".zst":
+                body = zstandard.ZstdDecompressor().decompress(body)
+            elif suffix == ".gz":
+                body = gzip.decompress(body)
+            return body.decode("utf-8")
+        if zstandard is not None and os.path.exists(cache_path + ".zst"):
+            with open(cache_path + ".zst", 'rb') as file:
+                return zstandard.ZstdDecompressor().decompress(file.read()).decode("utf-8")
+        if os.path.exists(cache_path + ".gz"):
+            with open(cache_path + ".gz", 'rb') as file:
+                return gzip.decompress(file.read()).decode("utf-8")
+        if os.path.isfile(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as file:
+                return file.read()
+        return ""
+
+
+    def _read_metadata(cache_path: str) -> dict:
+        """
+        Get the metadata saved with a page, or an empty dict.
+
+        Args:
+            cache_path: the path of the page in the cache.
+        """
+        if CacheManager.PACK is not None:
+            page = CacheManager.PACK.get(CacheManager._pack_key(cache_path))
+            return page[2] if page is not None else dict()
+        metadata_path = cache_path + ".meta.json"
+        if not os.path.exists(metadata_path):
+            return dict()
+        with open(metadata_path, 'r', encoding='utf-8') as file:
+            try:
+                return json.load(file)
+            except json.JSONDecodeError:
+                return dict()
+
+
+    def _save_metadata(metadata: dict,
+                       cache_path: str):
+        """
+        Save the metadata of a page next to it.
+
+        Args:
+            metadata: the response's metadata.
+            cache_path: the path of the page in the cache.
+        """
+        if CacheManager.PACK is not None:
+            CacheManager.PACK.put_metadata(CacheManager._pack_key(cache_path), metadata)
+            return
+        with open(cache_path + ".meta.json", 'w', encoding='utf-8') as file:
+            json.dump(metadata, file)
+
+
+    def _expired(cache_path: str,
+                 metadata: dict,
+                 list_name: str) -> bool:
+        """
+        True if the cached page is older than the list's TTL.
+        Pages saved without metadata are dated by their file.
+
+        Args:
+            cache_path: the path of the page in the cache.
+            metadata: the page's metadata.
+            list_name: the list the page belongs to.
+        """
+        ttl = CACHE_TTL_DAYS.get(list_name.strip("/"), CACHE_DEFAULT_TTL_DAYS)
+        if ttl < 0:
+            return False
+        fetched = metadata.get("fetched")
+        if fetched is None and CacheManager.PACK is not None:
+            return True
+        if fetched is None:
+            for suffix in [".zst", ".gz", ""]:
+                if os.path.exists(cache_path + suffix):
+                    fetched = os.path.getmtime(cache_path + suffix)
+                    break
+            else:
+                return True
+        return time.time() - fetched > ttl * 86400
+
+
+    def _count(list_name: str,
+               key: str,
+               value: int = 1):
+        with CacheManager._stats_lock:
+            CacheManager._stats[list_name.strip("/")][key] += value
+
+
+    def stats() -> dict:
+        """
+        Cache hits, downloads, revalidations and bytes per list in this run.
+        """
+        with CacheManager._stats_lock:
+            return {list_name: dict(stats)
+                    for list_name, stats in CacheManager._stats.items()}
+
+
+    def merge_stats(stats: dict):
+        """
+        Add the statistics of another process (ex: an extractor
+        run in a process pool).
+
+        Args:
+            stats: the other process' CacheManager.stats()
+        """
+        for list_name, list_stats in stats.items():
+            for key, value in list_stats.items():
+                CacheManager._count(list_name, key, value)
+
+
+    def cache_size(list_name: str) -> tuple[int, int]:
+        """
+        Number of files and bytes on disk of a list's cache folder
+        (pages and bytes of the list in the packed cache).
+
+        Args:
+            list_name: the list's cache folder.
+        """
+        if CacheManager.PACK is not None:
+            return CacheManager.PACK.size(list_name.strip("/") + "/")
+        files = 0
+        size = 0
+        for root, _, filenames in os.walk(CACHE_DIR / list_name):
+            for filename in filenames:
+                files += 1
+                size += os.path.getsize(os.path.join(root, filename))
+        return files, size
+
+
+    def report() -> dict:
+        """
+        Statistics of the run and size of the cache per list.
+        """
+        report = dict()
+        for list_name, stats in CacheManager.stats().items():
+            files, size = CacheManager.cache_size(list_name)
+            report[list_name] = {key: stats.get(key, 0) for key in CacheManager._STATS_KEYS}
+            report[list_name]["cache_files"] = files
+            report[list_name]["cache_bytes"] = size
+        if report:
+            report["total"] = {key: sum(r[key] for r in report.values())
+                               for key in CacheManager._STATS_KEYS + ["cache_files", "cache_bytes"]}
+        return report
+
+
+    def write_report(filename: str | Path):
+        """
+        Save the report as a json file. Nothing is written
+        if no page was requested.
+
+        Args:
+            filename: the output json file
+        """
+        report = CacheManager.report()
+        if not report:
+            return
+        Path(filename).parent.mkdir(parents = True, exist_ok = True)
+        with open(filename, "w", encoding = "utf-8") as file:
+            json.dump(report, file, indent = 2)
+        total = report["total"]
+        print(f"Cache: {total['hits']} hits, {total['downloads']} downloads, " +
+              f"{total['revalidated']} revalidated ({total['bytes_saved'] / 1e6:.1f} MB saved), " +
+              f"{total['cache_bytes'] / 1e6:.1f} MB on disk. Report saved in {filename}.")
+
+
+    def get_many(urls: list[str],
+                 list_name: str,
+                 params: dict = None,
+                 from_cache: bool = True,
+                 workers: int = HTTP_WORKERS) -> list[str]:
+        """
+        Get pages from cache if they are saved in cache, else scrap them
+        online concurrently (within the per-host limits of the pool).
+        The contents are returned in the order of the urls.
+
+        Args:
+            urls: the URLs of the pages.
+            list_name: used to access the right folder of the cache.
+            params: parameters sent with every GET request.
+            from_cache: whether to get content from cache if it exists.
+            workers: maximum number of pages downloaded at the same time.
+        """
+        return CacheManager.get_pages([{"url": url, "params": params} for url in urls],
+                                      list_name,
+                                      from_cache = from_cache,
+                                      workers = workers)
+
+
+    def get_pages(queries: list[dict],
+                  list_name: str,
+                  from_cache: bool = True,
+                  workers: int = HTTP_WORKERS) -> list[str]:
+        """
+        Like get_many, with the arguments of get_page of each page
+        (url, params, data, data_str), for paged APIs and POST requests.
+        The contents are returned in the order of the queries.
+
+        Args:
+            queries: get_page's arguments of each page.
+            list_name: used to access the right folder of the cache.
+            from_cache: whether to get content from cache if it exists.
+            workers: maximum number of pages downloaded at the same time.
+        """
+        if not queries:
+            return []
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            return list(executor.map(lambda query: CacheManager.get_page(list_name = list_name,
+                                                                         from_cache = from_cache,
+                                                                         **query),
+                                     queries))
+
+
+    def _request(method: str,
+                 url: str,
+                 **kwargs):
+        """
+        Send a request through the pool. Exit on connection errors.
+
+        Args:
+            method: GET or POST
+            url: the url to request
+            kwargs: arguments of the request (params, data, headers)
         """
         try:
-            response = requests.get(
-                    url,
-                    params = params,
-                    headers = CacheManager.HEADERS)
+            return CacheManager.POOL.request(method, url, **kwargs)
         except requests.exceptions.RequestException as e:
             raise SystemExit(e)
 
-        if response.ok:
-            response.encoding = response.apparent_encoding
-            return response.text
-        else:
-            error = f"Request to {url} failed with status code {response.status_code}"
-            logging.info(error)
-            return ""
+
+    def get(url: str,
+            params: dict = None) -> str:
+        """
+        Scrap the web page's content. Encode it using the response's charset.
+
+        Args:
+            url: the url to scrap from.
+        """
+        response = CacheManager._request("GET",
+                                         url,
+                                         params = params)
+        return CacheManager._response_text(url, response)
 
 
     def post(url: str,
              data: dict) -> str:
-        try:
-            response = requests.post(url,
-                                     data,
-                                     headers = CacheManager.HEADERS)
-        except requests.exceptions.RequestException as e:
-            raise SystemExit(e)
+        response = CacheManager._request("POST",
+                                         url,
+                                         data = data)
+        return CacheManager._response_text(url, response)
+
 
+    def _response_text(url: str,
+                       response: requests.Response) -> str:
+        """
+        Get the response's content encoded using its charset,
+        or an empty string if the request failed.
+
+        Args:
+            url: the requested url.
+            response: the response.
+        """
         if response.ok:
             response.encoding = response.apparent_encoding
             return response.text
@@ -211,6 +606,66 @@ class CacheManager():
             logging.warning(' '.join(command), "failed for", git_repo)
 
 
+    def _git(command: list[str],
+             git_repo: str,
+             list_name: str) -> str | None:
+        """
+        Run a git command in a repository of the cache.
+        Return its output, or None if it failed.
+        """
+        try:
+            process = subprocess.run(["git"] + command,
+                                     cwd = str(CACHE_DIR / list_name / git_repo),
+                                     capture_output = True,
+                                     encoding = "utf-8")
+        except OSError:
+            return None
+        if process.returncode != 0:
+            logging.warning(f"git {' '.join(command)} failed for {git_repo}: {process.stderr}")
+            return None
+        return process.stdout
+
+
+    def git_head(git_repo: str,
+                 list_name: str) -> str | None:
+        """
+        Get the hash of the last commit of a repository of the cache
+        (None if it is not a git repository).
+
+        Args:
+            git_repo: the name of the repository / folder of the repository
+            list_name: used to access the right folder of the cache.
+        """
+        head = CacheManager._git(["rev-parse", "HEAD"], git_repo, list_name)
+        return head.strip() if head else None
+
+
+    def git_diff(git_repo: str,
+                 list_name: str,
+                 old_commit: str,
+                 new_commit: str) -> list[tuple[str, str]] | None:
+        """
+        List the files added (A), modified (M, T) or deleted (D) between
+        two commits of a repository of the cache. A renamed file is
+        deleted and added. Return None if the history between the two
+        commits is unknown (ex: the old commit was removed by a force push).
+
+        Args:
+            git_repo: the name of the repository / folder of the repository
+            list_name: used to access the right folder of the cache.
+            old_commit: hash of the old commit
+            new_commit: hash of the new commit
+        """
+        # -z: paths are not quoted (non-ASCII characters), fields end with NUL
+        diff = CacheManager._git(["diff", "-z", "--name-status", "--no-renames",
+                                  f"{old_commit}..{new_commit}"],
+                                 git_repo, list_name)
+        if diff is None:
+            return None
+        fields = diff.split("\0")
+        return list(zip(fields[0:-1:2], fields[1::2]))
+
+
 class VersionManager():
     """
     A class that saves version dictionaries and
@@ -224,6 +679,84 @@ class VersionManager():
         VERSION_MANAGER.mkdir(parents = True,
                               exist_ok = True)
 
+    # Fields set by the version manager, not by the extractors
+    _VERSION_FIELDS = {"modified", "deprecated"}
+
+    def _canonical(value):
+        """
+        JSON-serializable form of an extracted value that does not
+        depend on the order of the sets and dicts.
+        """
+        if isinstance(value, dict):
+            return {str(k): VersionManager._canonical(v) for k, v in value.items()}
+        if isinstance(value, (set, frozenset)):
+            return sorted((VersionManager._canonical(v) for v in value),
+                          key = lambda v: json.dumps(v, sort_keys = True))
+        if isinstance(value, (list, tuple)):
+            return [VersionManager._canonical(v) for v in value]
+        if value is None or type(value) in (bool, int, float, str):
+            return value
+        return str(value)
+
+
+    def content_hash(features: dict) -> str:
+        """
+        Stable hash of an entity's extracted fields (canonical JSON).
+
+        Args:
+            features: the entity's data dict
+        """
+        fields = {key: value for key, value in features.items()
+                  if key not in VersionManager._VERSION_FIELDS}
+        canonical = json.dumps(VersionManager._canonical(fields),
+                               sort_keys = True,
+                               ensure_ascii = False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+    def content_hashes(data: dict) -> dict[str, str]:
+        """
+        Content hash of every entity of an extractor's data.
+
+        Args:
+            data: the extracted data dictionary {identifier: features}
+        """
+        return {key: VersionManager.content_hash(features)
+                for key, features in data.items()}
+
+
+    def versions_hash(hashes: dict[str, str]) -> str:
+        """
+        Hash of a version of an extractor's entities, from their content
+        hashes. Empty string if there is no version.
+
+        Args:
+            hashes: the entities' content hashes {identifier: hash}
+        """
+        if not hashes:
+            return ""
+        canonical = json.dumps(hashes, sort_keys = True)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+    def load_changes(filename: str | Path) -> dict[str, set[str]]:
+        """
+        Load a changes file written by update.py and get the added,
+        removed and modified URIs of all the lists.
+        Use it to only process the entities that changed.
+
+        Args:
+            filename: the changes json file (<output>_changes.json)
+        """
+        with open(filename, "r", encoding = "utf-8") as file:
+            changes = json.load(file)
+        result = {"added": set(), "removed": set(), "modified": set()}
+        for list_changes in changes.values():
+            for key in result:
+                result[key].update(list_changes.get(key, []))
+        return result
+
+
     def get_newer_keys(prev_version_file: str,
                        new_version: dict,
                        list_name: str) -> set:
@@ -240,6 +773,7 @@ class VersionManager():
         result = set()
 
         prev_version_file = str(DATA_DIR / list_name / prev_version_file)
+        VersionJournal.compact(prev_version_file)
 
         if not os.path.exists(prev_version_file):
             # We create the path to save the versions from the
@@ -271,50 +805,82 @@ class VersionManager():
                 list_name: str):
         """
         Replace URIs that are in new_version dict into last_version_file.
-        Used in Wikidata extractor.
+        The whole file is written at every call: use buffered_refresh
+        to refresh many URIs.
 
         Args:
             last_version_file: the json file containing last versions for each uri
             new_version: a dict of format {uri: {last-modified, name}}
             list_name: the cache folder of the list to save data in
         """
-        # Open last_version_file with read+write access
-        save_last_version = False
-
         last_version_file = VersionManager._get_data_path(last_version_file,
                                                           list_name)
+        VersionJournal.compact(last_version_file)
+        VersionManager._merge_versions(last_version_file, new_version)
+
+
+    def buffered_refresh(last_version_file: str,
+                         list_name: str,
+                         batch_size: int = VERSION_REFRESH_BATCH_SIZE,
+                         interval: float = VERSION_REFRESH_INTERVAL) -> "VersionJournal":
+        """
+        Context manager to refresh many URIs of last_version_file
+        (see VersionJournal). Used in Wikidata extractor:
+
+            with VersionManager.buffered_refresh(file, list_name) as versions:
+                versions.refresh({uri: {last-modified, name}})
+
+        Args:
+            last_version_file: the json file containing last versions for each uri
+            list_name: the cache folder of the list to save data in
+            batch_size: number of URIs kept in memory before they are saved
+            interval: seconds before the URIs in memory are saved
+        """
+        return VersionJournal(VersionManager._get_data_path(last_version_file,
+                                                            list_name),
+                              batch_size = batch_size,
+                              interval = interval)
+
+
+    def _merge_versions(last_version_file: str,
+                        new_version: dict):
+        """
+        Merge new_version into the version file. The file is replaced
+        atomically, so that it is never left half-written.
+
+        Args:
+            last_version_file: path of the json file containing last versions for each uri
+            new_version: a dict of format {uri: {last-modified, name}}
+        """
+        last_version = None
         if os.path.exists(last_version_file):
             with open(last_version_file, "r") as f:
                 content = f.read()
-                if content:
-                    # Merge new_version with content
-                    try:
-                        last_version = json.loads(content)
-                        for key, value in new_version.items():
-                            last_version["results"][key] = value
-                        if last_version["processing_date"] != VersionManager._TODAY:
-                            # Only update date for a different run.
-                            last_version["previous_date"] = last_version["processing_date"]
-                            last_version["processing_date"] = VersionManager._TODAY
-                        last_version["results_count"] = len(last_version["results"])
-                        save_last_version = True
-                    except json.JSONDecodeError:
-                        # If the file is malformated
-                        logging.error("FATAL - Error while decoding", last_version_file)
-                        raise(json.JSONDecodeError)
-            if save_last_version:
-                with open(last_version_file, "w") as f:
-                    json.dump(last_version, f, indent = 4)
-                    return
-        # If the file does not exist or is malformated:
-        with open(last_version_file, "w") as f:
-            new_version = {
+            if content:
+                try:
+                    last_version = json.loads(content)
+                except json.JSONDecodeError:
+                    # If the file is malformated
+                    logging.error("FATAL - Error while decoding", last_version_file)
+                    raise
+        if last_version is None:
+            last_version = {
                 "processing_date": VersionManager._TODAY,
                 "previous_date": VersionManager._TODAY,
-                "results_count": len(new_version),
-                "results": new_version["results"]
+                "results_count": 0,
+                "results": {}
             }
-            json.dump(new_version, f, indent = 4)
+        for key, value in new_version.items():
+            last_version["results"][key] = value
+        if last_version["processing_date"] != VersionManager._TODAY:
+            # Only update date for a different run.
+            last_version["previous_date"] = last_version["processing_date"]
+            last_version["processing_date"] = VersionManager._TODAY
+        last_version["results_count"] = len(last_version["results"])
+        tmp_file = last_version_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(last_version, f, indent = 4)
+        os.replace(tmp_file, last_version_file)
 
 
     def _get_data_path(file: str,
@@ -330,72 +896,256 @@ class VersionManager():
         return str(DATA_DIR / list_name / file)
 
 
-    def compare_versions(new_data: dict,
-                         extractor,
-                         remove_deprecated: bool = True,
-                         input_graph_values: dict = dict()):
+    def _load_versions(filename: str | Path) -> dict:
         """
-        Load, compare and save data dict for version management.
-        Add a Deprecated relation on removed entities.
-        Add to_merge True to new entities.
-        Add a latest modification date on new entities, old entities
-        and modified entities.
-        Update content of modified entities.
+        Load the data dict of a version file (the batches saved
+        by a VersionStream, merged).
 
         Args:
-            new_data: the newly extracted data dictionary
-            extractor: the extractor used to extract the new_data dict
+            filename: the version's pickle file
         """
-        if not new_data:
-            return
-        # First download
-        filename = VersionManager.VERSION_MANAGER / (extractor.NAMESPACE + ".pkl")
-        old_data = None
+        data = dict()
+        with open(filename, 'rb') as file:
+            while True:
+                try:
+                    data.update(pickle.load(file))
+                except EOFError:
+                    break
+        return data
 
-        if input_graph_values:
-            old_data = input_graph_values
 
-        if os.path.exists(filename):
+class VersionStream():
+    """
+    Version management of the entities of an extractor given by batches
+    as they are extracted (Extractor.iter_extract). Set a modification date
+    on the entities (today for the added and modified ones), get the added,
+    removed and modified entities' identifiers (changes), and keep the
+    removed ones with a deprecated value if remove_deprecated is False.
+    Entities are compared with their content hash, saved next to the version.
+    Every batch is compared with the previous version and appended to the
+    new version file, so that the whole data is not needed in memory:
+
+        versions = VersionStream(extractor)
+        for batch in extractor.iter_extract():
+            versions.add(batch)
+        deprecated = versions.close()
+
+    The removed entities are only known when the stream is closed.
+    """
+
+    def __init__(self,
+                 extractor,
+                 remove_deprecated: bool = True,
+                 input_graph_values: dict = dict()):
+        """
+        Args:
+            extractor: the extractor of the entities
+            remove_deprecated: if False, the removed entities are kept
+                               with a deprecated value (see close).
+            input_graph_values: previous version of the entities
+                                if there is no version file.
+        """
+        self.filename = VersionManager.VERSION_MANAGER / (extractor.NAMESPACE + ".pkl")
+        self.hashes_filename = VersionManager.VERSION_MANAGER / (extractor.NAMESPACE + ".hashes.json")
+        self.remove_deprecated = remove_deprecated
+        self.changes = {"added": set(), "removed": set(), "modified": set()}
+        self.hashes = dict() # Content hashes of the new version
+        self._file = None
+
+        self._old_data = None
+        old_hashes = None
+        if input_graph_values:
+            self._old_data = input_graph_values
+        if os.path.exists(self.filename):
             try:
-                with open(filename, 'rb') as file:
-                    old_data = pickle.load(file)
+                self._old_data = VersionManager._load_versions(self.filename)
             except:
-                logging.error("Error while decoding", filename)
-                print(f"Error while decoding {filename}")
-                old_data = None
+                logging.error("Error while decoding", self.filename)
+                print(f"Error while decoding {self.filename}")
+                self._old_data = None
+            if self._old_data and os.path.exists(self.hashes_filename):
+                with open(self.hashes_filename, 'r', encoding = 'utf-8') as file:
+                    old_hashes = json.load(file)
+        if self._old_data and (old_hashes is None or old_hashes.keys() != self._old_data.keys()):
+            old_hashes = VersionManager.content_hashes(self._old_data)
+        self._old_hashes = old_hashes
+        # Hash of the previous version, then of the new version once closed
+        self.state = VersionManager.versions_hash(old_hashes)
 
-        if not old_data:
-            for value in new_data.values():
-                value["modified"] = VersionManager._TODAY
-        else:
-            deleted = old_data.keys() - new_data.keys()
-            added = new_data.keys() - old_data.keys()
-            updated = set(new_data.keys()).intersection(old_data.keys())
-            for uri in added:
-                new_data[uri]["modified"] = VersionManager._TODAY
-                # Change with created?
+
+    def add(self,
+            batch: dict):
+        """
+        Compare a batch of entities with the previous version, set their
+        modification date and save them. An identifier that was already
+        added replaces the previous entity.
+
+        Args:
+            batch: the entities {identifier: features}
+        """
+        for uri, features in batch.items():
+            self.changes["added"].discard(uri)
+            self.changes["modified"].discard(uri)
+            self.hashes[uri] = VersionManager.content_hash(features)
+            if not self._old_data or uri not in self._old_data:
+                features["modified"] = VersionManager._TODAY
+                self.changes["added"].add(uri)
+            elif (self._old_hashes[uri] != self.hashes[uri] or
+                  "deprecated" in self._old_data[uri]):
+                # Changed, or deprecated by a previous run and extracted again
+                features["modified"] = VersionManager._TODAY
+                self.changes["modified"].add(uri)
+            elif not features.get("modified"):
+                # No difference, keep old modified date or set to today's date
+                features["modified"] = self._old_data[uri].get("modified", VersionManager._TODAY)
+        self._save(batch)
+
+
+    def close(self) -> dict:
+        """
+        Get the removed entities and replace the version files.
+        Return the removed entities with a deprecated value if they
+        are kept (remove_deprecated is False), to add them too.
+        """
+        deprecated = dict()
+        if self._file is None:
+            return deprecated # Nothing was extracted
+        deleted = self._old_data.keys() - self.hashes.keys() if self._old_data else set()
+        self.changes["removed"] = {uri for uri in deleted
+                                   if "deprecated" not in self._old_data[uri]}
+        if not self.remove_deprecated:
             for uri in deleted:
-                if not remove_deprecated:
-                    new_data[uri] = old_data[uri]
-                    new_data[uri]["deprecated"] = ":__"
-                    # TODO try to use ivoasem:useInstead <#ICRS>
-                else:
-                    if uri in new_data:
-                        new_data.pop(uri)
-            # Check for updated content
-            for uri in updated:
-                for key in set(new_data[uri].keys()).union(old_data[uri].keys()) - {"modified"}:
-                    if (key != "modified" and (key not in old_data[uri] or
-                        key not in new_data[uri] or
-                        old_data[uri][key] != new_data[uri][key])):
-                        new_data[uri]["modified"] = VersionManager._TODAY
-                        break # modified
-            for uri in new_data.keys():
-                if not new_data[uri].get("modified"):
-                    # No difference, keep old modified date or set to today's date
-                    new_data[uri]["modified"] = old_data[uri].get("modified", VersionManager._TODAY)
-        with open(filename, 'wb') as file:
-            pickle.dump(new_data, file) # Replace version
+                features = self._old_data[uri]
+                features["deprecated"] = ":__"
+                # TODO try to use ivoasem:useInstead <#ICRS>
+                if not features.get("modified"):
+                    features["modified"] = VersionManager._TODAY
+                self.hashes[uri] = VersionManager.content_hash(features)
+                deprecated[uri] = features
+            self._save(deprecated)
+        self._old_data = None
+        self._file.close()
+        os.replace(self._file.name, self.filename) # Replace version
+        with open(self.hashes_filename, 'w', encoding = 'utf-8') as file:
+            json.dump(self.hashes, file)
+        self.state = VersionManager.versions_hash(self.hashes)
+        return deprecated
+
+
+    def saved(self):
+        """
+        Iterate over the batches of the new version file, once closed.
+        """
+        with open(self.filename, 'rb') as file:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    break
+
+
+    def _save(self,
+              batch: dict):
+        """
+        Append a batch to the new version file (<version file>.tmp).
+        """
+        if self._file is None:
+            self._file = open(str(self.filename) + ".tmp", 'wb')
+        pickle.dump(batch, self._file)
+
+
+class VersionJournal():
+    """
+    Buffered VersionManager.refresh. The refreshed versions are kept in
+    memory and appended to a journal (<version file>.journal) every
+    batch_size URIs or interval seconds. The journal is merged into the
+    version file when the context exits, or before the version file is
+    read again if the extraction was killed. Therefore, a crash loses at
+    most the versions in memory, which will be refreshed at the next run.
+    """
+
+    JOURNAL_SUFFIX = ".journal"
+
+    def __init__(self,
+                 last_version_file: str,
+                 batch_size: int = VERSION_REFRESH_BATCH_SIZE,
+                 interval: float = VERSION_REFRESH_INTERVAL):
+        """
+        Args:
+            last_version_file: path of the json file containing last versions for each uri
+            batch_size: number of URIs kept in memory before they are saved
+            interval: seconds before the URIs in memory are saved
+        """
+        self.filename = last_version_file
+        self.batch_size = batch_size
+        self.interval = interval
+        self._buffer = dict()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def __enter__(self):
+        VersionJournal.compact(self.filename)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        VersionJournal.compact(self.filename)
+
+
+    def refresh(self,
+                new_version: dict):
+        """
+        Replace URIs that are in new_version dict in the version file.
+
+        Args:
+            new_version: a dict of format {uri: {last-modified, name}}
+        """
+        with self._lock:
+            self._buffer.update(new_version)
+            flush = (len(self._buffer) >= self.batch_size or
+                     time.monotonic() - self._last_flush >= self.interval)
+        if flush:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Append the URIs in memory to the journal, as one json line.
+        """
+        with self._lock:
+            if self._buffer:
+                with open(self.filename + self.JOURNAL_SUFFIX, "a") as f:
+                    f.write(json.dumps(self._buffer) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._buffer = dict()
+            self._last_flush = time.monotonic()
+
+
+    @staticmethod
+    def compact(last_version_file: str):
+        """
+        Merge the journal of a version file into it and remove the journal.
+        A line that was not completely written (crash) is ignored.
+
+        Args:
+            last_version_file: path of the json file containing last versions for each uri
+        """
+        journal = last_version_file + VersionJournal.JOURNAL_SUFFIX
+        if not os.path.exists(journal):
+            return
+        new_version = dict()
+        with open(journal, "r") as f:
+            for line in f:
+                try:
+                    new_version.update(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        if new_version:
+            VersionManager._merge_versions(last_version_file, new_version)
+        os.remove(journal)
 
 
 if __name__ == "__main__":
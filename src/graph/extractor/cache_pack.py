@@ -0,0 +1,244 @@
+"""
+Packed cache backend: the cached pages of all the lists in a single
+SQLite file instead of one file per page, to copy the cache between
+machines and to avoid the file-open latency of network filesystems.
+
+A page is looked up by its key, the path of its file in the cache folder
+(relative to CACHE_DIR, ex: NSSDC/https_nssdc_gsfc_nasa_gov_...). The
+bodies are stored as they are in the files (compressed), with their
+compression suffix and their metadata.
+
+Every thread (and process) opens its own connection. The database is in
+WAL mode, so that the extractors' threads can read while a page is saved.
+
+Usage (from the src folder):
+    python -m graph.extractor.cache_pack import
+    python -m graph.extractor.cache_pack export
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import json
+import os
+import sqlite3
+import threading
+
+from argparse import ArgumentParser
+from pathlib import Path
+from utils.sqlite_utilities import thread_connection
+
+
+class CachePack():
+
+    # Compression suffixes of the page files
+    SUFFIXES = [".zst", ".gz"]
+    METADATA_SUFFIX = ".meta.json"
+
+    def __init__(self,
+                 filename: str | Path):
+        """
+        Args:
+            filename: the SQLite file. It is created if it does not exist.
+        """
+        self.filename = Path(filename)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Connection of the current thread (see sqlite_utilities.thread_connection).
+        """
+        return thread_connection(self._local,
+                                 self.filename,
+                                 ["""CREATE TABLE IF NOT EXISTS pages (
+                                         key TEXT PRIMARY KEY,
+                                         body BLOB NOT NULL,
+                                         suffix TEXT NOT NULL,
+                                         metadata TEXT NOT NULL)"""])
+
+
+    def get(self,
+            key: str) -> tuple[bytes, str, dict] | None:
+        """
+        Get the body, compression suffix and metadata of a page,
+        or None if the page is not in the pack.
+
+        Args:
+            key: the page's key
+        """
+        row = self._connection().execute(
+            "SELECT body, suffix, metadata FROM pages WHERE key = ?",
+            (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+
+    def __contains__(self,
+                     key: str) -> bool:
+        return self._connection().execute(
+            "SELECT 1 FROM pages WHERE key = ?",
+            (key,)).fetchone() is not None
+
+
+    def put(self,
+            key: str,
+            body: bytes,
+            suffix: str,
+            metadata: dict = None):
+        """
+        Save a page. Its metadata are kept if metadata is None.
+
+        Args:
+            key: the page's key
+            body: the page's content (compressed)
+            suffix: the compression suffix (.gz, .zst or "")
+            metadata: the response's metadata
+        """
+        with self._write_lock:
+            if metadata is None:
+                previous = self.get(key)
+                metadata = previous[2] if previous else dict()
+            self._connection().execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                (key, body, suffix, json.dumps(metadata)))
+
+
+    def put_metadata(self,
+                     key: str,
+                     metadata: dict):
+        """
+        Replace the metadata of a page.
+
+        Args:
+            key: the page's key
+            metadata: the response's metadata
+        """
+        with self._write_lock:
+            self._connection().execute(
+                "UPDATE pages SET metadata = ? WHERE key = ?",
+                (json.dumps(metadata), key))
+
+
+    def size(self,
+             prefix: str = "") -> tuple[int, int]:
+        """
+        Number of pages and bytes of the bodies whose key starts with prefix.
+
+        Args:
+            prefix: ex: the list's folder (NSSDC/)
+        """
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        count, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM pages WHERE key LIKE ? ESCAPE '\\'",
+            (pattern,)).fetchone()
+        return count, size
+
+
+    def keys(self) -> list[str]:
+        return [row[0] for row in self._connection().execute("SELECT key FROM pages ORDER BY key")]
+
+
+    def import_files(self,
+                     cache_dir: str | Path,
+                     list_names: list[str]) -> int:
+        """
+        Add the pages of the file layout to the pack. Return the
+        number of imported pages. Git repositories are ignored.
+
+        Args:
+            cache_dir: the cache folder (CACHE_DIR)
+            list_names: the lists' folders to import (extractor.CACHE)
+        """
+        cache_dir = Path(cache_dir)
+        count = 0
+        connection = self._connection()
+        with self._write_lock:
+            connection.execute("BEGIN")
+            for list_name in list_names:
+                for root, dirs, files in os.walk(cache_dir / list_name):
+                    if ".git" in dirs:
+                        dirs.clear() # git repository (ex: SPASE)
+                        continue
+                    for filename in files:
+                        if filename.endswith(self.METADATA_SUFFIX):
+                            continue
+                        path = Path(root) / filename
+                        suffix = path.suffix if path.suffix in self.SUFFIXES else ""
+                        page = str(path)[:len(str(path)) - len(suffix)]
+                        metadata = dict()
+                        if os.path.exists(page + self.METADATA_SUFFIX):
+                            with open(page + self.METADATA_SUFFIX, "r", encoding = "utf-8") as file:
+                                metadata = json.load(file)
+                        metadata.setdefault("fetched", path.stat().st_mtime)
+                        with open(path, "rb") as file:
+                            body = file.read()
+                        key = Path(page).relative_to(cache_dir).as_posix()
+                        connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                                           (key, body, suffix, json.dumps(metadata)))
+                        count += 1
+            connection.execute("COMMIT")
+        return count
+
+
+    def export_files(self,
+                     cache_dir: str | Path) -> int:
+        """
+        Write the pages of the pack in the file layout. Return the
+        number of exported pages.
+
+        Args:
+            cache_dir: the cache folder (CACHE_DIR)
+        """
+        cache_dir = Path(cache_dir)
+        count = 0
+        for key, body, suffix, metadata in self._connection().execute(
+                "SELECT key, body, suffix, metadata FROM pages"):
+            page = cache_dir / key
+            page.parent.mkdir(parents = True, exist_ok = True)
+            with open(str(page) + suffix, "wb") as file:
+                file.write(body)
+            with open(str(page) + self.METADATA_SUFFIX, "w", encoding = "utf-8") as file:
+                file.write(metadata)
+            count += 1
+        return count
+
+
+def main(command: str,
+         pack_file: str,
+         lists: list[str]):
+    from config import CACHE_DIR, CACHE_PACK_FILE # type: ignore
+    pack = CachePack(pack_file or CACHE_PACK_FILE)
+    if command == "import":
+        if not lists:
+            from graph.extractor.extractor_lists import ExtractorLists
+            lists = [extractor.CACHE.strip("/") for extractor in ExtractorLists.AVAILABLE_EXTRACTORS]
+        count = pack.import_files(CACHE_DIR, lists)
+        print(f"Imported {count} pages from {CACHE_DIR} into {pack.filename}.")
+    else:
+        count = pack.export_files(CACHE_DIR)
+        print(f"Exported {count} pages from {pack.filename} into {CACHE_DIR}.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog = "cache_pack",
+                            description = "Import or export the cached pages between the cache folder and a SQLite pack.")
+    parser.add_argument("command",
+                        choices = ["import", "export"],
+                        help = "import: from the cache folder into the pack. export: from the pack into the cache folder.")
+    parser.add_argument("-p",
+                        "--pack",
+                        dest = "pack_file",
+                        default = None,
+                        help = "SQLite pack file. Default is config.CACHE_PACK_FILE.")
+    parser.add_argument("-l",
+                        "--lists",
+                        dest = "lists",
+                        nargs = "*",
+                        default = [],
+                        help = "Cache folders to import (ex: NSSDC PDS). Default is every extractor's folder.")
+    args = parser.parse_args()
+    main(args.command,
+         args.pack_file,
+         args.lists)
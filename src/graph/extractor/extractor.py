@@ -2,10 +2,17 @@
 Define the superclass Extractor.
 Each extractor has its own namespace.
 
+An extractor implements extract, that returns all of its entities in a
+dictionary {identifier: data}, or iter_extract, that yields them by
+batches as they are extracted (streaming extractor). The updater only
+uses iter_extract: extractors that only implement extract are adapted
+and yield their whole dictionary as one batch.
+
 Author:
     Liza Fretel (liza.fretel@obspm.fr)
 """
 
+from typing import Iterator
 from graph import entity_types
 
 
@@ -35,4 +42,37 @@ class Extractor():
 
 
     def __str__(self):
-        return self.NAMESPACE
\ No newline at end of file
+        return self.NAMESPACE
+
+
+    def extract(self,
+                from_cache: bool = True) -> dict:
+        """
+        Extract all the entities into a dictionary {identifier: data}.
+        Streaming extractors do not need to implement it: their batches
+        are merged, an identifier yielded again replacing the previous one.
+
+        Args:
+            from_cache: whether to get the pages from cache if they exist.
+        """
+        if type(self).iter_extract is Extractor.iter_extract:
+            raise NotImplementedError(f"{type(self).__name__} must implement extract or iter_extract.")
+        result = dict()
+        for batch in self.iter_extract(from_cache = from_cache):
+            result.update(batch)
+        return result
+
+
+    def iter_extract(self,
+                     from_cache: bool = True) -> Iterator[dict]:
+        """
+        Yield the entities by batches {identifier: data} as they are
+        extracted, so that they are added to the graph during the
+        extraction (see Updater.add_stream). An identifier yielded again
+        replaces the previous entity.
+        Adapter for the extractors that only implement extract.
+
+        Args:
+            from_cache: whether to get the pages from cache if they exist.
+        """
+        yield self.extract(from_cache = from_cache)
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Pooled HTTP connections used by the CacheManager to download pages.
+
+Requests are sent with keep-alive sessions (one per thread), with a
+maximum of concurrent requests and a token bucket rate limit per host.
+Requests that failed with a 429 or 5xx status code are retried with an
+exponential backoff (or after the Retry-After delay sent by the server).
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import email.utils
+import threading
+import time
+import requests
+
+from collections import defaultdict
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+import config
+
+
+class TokenBucket():
+    """
+    Token bucket rate limiter. Tokens are added at a constant rate up
+    to the bucket's capacity, and a request consumes one token.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 capacity: float = 1.):
+        """
+        Args:
+            rate: tokens added per second. -1 for no limit.
+            capacity: maximum number of tokens (burst size).
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        """
+        Take a token, waiting for it if the bucket is empty.
+        """
+        if self.rate < 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class HttpPool():
+    """
+    Keep-alive sessions with per-host concurrency and rate limits.
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self,
+                 max_connections: int = config.HTTP_MAX_CONNECTIONS_PER_HOST,
+                 requests_per_second: float = config.HTTP_REQUESTS_PER_SECOND,
+                 retries: int = config.HTTP_RETRIES,
+                 backoff: float = config.HTTP_BACKOFF,
+                 timeout: float = config.HTTP_TIMEOUT,
+                 host_limits: dict = config.HTTP_HOST_LIMITS,
+                 headers: dict = None):
+        """
+        Args:
+            max_connections: maximum concurrent requests to a host.
+            requests_per_second: maximum request rate to a host. -1 for no limit.
+            retries: number of retries on 429 and 5xx status codes.
+            backoff: first retry delay in seconds, doubled at every retry.
+            timeout: timeout of a request in seconds.
+            host_limits: {host: (max_connections, requests_per_second)} to
+                         override the default limits for some hosts.
+            headers: headers sent with every request.
+        """
+        self.max_connections = max_connections
+        self.requests_per_second = requests_per_second
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.host_limits = host_limits or dict()
+        self.headers = headers or dict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._semaphores = dict()
+        self._buckets = dict()
+        self._stats = defaultdict(lambda: {"requests": 0,
+                                           "retries": 0,
+                                           "errors": 0})
+
+
+    def _session(self) -> requests.Session:
+        """
+        Keep-alive session of the current thread.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            adapter = HTTPAdapter(pool_maxsize = self.max_connections)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+
+    def _limits(self,
+                host: str) -> tuple[threading.Semaphore, TokenBucket]:
+        """
+        Concurrency limit and rate limiter of a host.
+        """
+        with self._lock:
+            if host not in self._semaphores:
+                max_connections, rate = self.host_limits.get(
+                    host,
+                    (self.max_connections, self.requests_per_second))
+                self._semaphores[host] = threading.BoundedSemaphore(max_connections)
+                self._buckets[host] = TokenBucket(rate,
+                                                  capacity = max(1, max_connections))
+            return self._semaphores[host], self._buckets[host]
+
+
+    def _retry_delay(self,
+                     response: requests.Response,
+                     attempt: int) -> float:
+        """
+        Delay before the next attempt: the server's Retry-After if
+        it was sent and valid, else an exponential backoff.
+        """
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            if retry_after.isdigit():
+                return float(retry_after)
+            try:
+                date = email.utils.parsedate_to_datetime(retry_after)
+                return max(0., date.timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass # Invalid date
+        return self.backoff * 2 ** attempt
+
+
+    def request(self,
+                method: str,
+                url: str,
+                **kwargs) -> requests.Response:
+        """
+        Send a request. Requests that failed with a 429 or 5xx
+        status code are retried. Return the last response.
+        Connection errors are raised (requests.RequestException).
+
+        Args:
+            method: GET or POST
+            url: the url to request
+            kwargs: arguments of requests.Session.request (params, data...)
+        """
+        host = urlsplit(url).netloc
+        semaphore, bucket = self._limits(host)
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            with semaphore:
+                try:
+                    response = self._session().request(method, url, **kwargs)
+                except requests.RequestException:
+                    with self._lock:
+                        self._stats[host]["errors"] += 1
+                    raise
+            with self._lock:
+                self._stats[host]["requests"] += 1
+            if response.status_code not in self.RETRY_STATUS or attempt >= self.retries:
+                return response
+            delay = self._retry_delay(response, attempt)
+            with self._lock:
+                self._stats[host]["retries"] += 1
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+
+    def stats(self) -> dict:
+        """
+        Requests, retries and connection errors per host.
+        """
+        with self._lock:
+            return {host: dict(stats) for host, stats in self._stats.items()}
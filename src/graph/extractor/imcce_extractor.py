@@ -9,6 +9,7 @@ Author:
     Liza Fretel (liza.fretel@obspm.fr)
 """
 
+import config
 from graph import entity_types
 from graph.extractor.cache import CacheManager
 from graph.extractor.extractor import Extractor
@@ -19,6 +20,11 @@ import json
 class ImcceExtractor(Extractor):
     URL = "https://api.ssodnet.imcce.fr/quaero/1/sso/search?"
 
+    # Search API (on config.IMCCE_HOST), at most LIMIT results per page
+    _API_PATH = "/quaero/1/sso/search"
+    QUERY = "type:Spacecraft"
+    LIMIT = 100
+
     # URI to save this source as an entity
     URI = "imcce_list"
 
@@ -59,28 +65,9 @@ class ImcceExtractor(Extractor):
         """
         Extract the page content into a dictionary.
         """
-        params = {
-            "q": "type:Spacecraft",
-            "limit": 100,
-            "offset": 0
-        }
-
         results = []
-
-        while True:
-            data_str =  params["q"] + '_' + str(params["offset"]) + '-' + str(params["offset"] + params["limit"])
-            response = CacheManager.get_page(self.URL,
-                                             from_cache = from_cache,
-                                             list_name = self.CACHE,
-                                             params = params,
-                                             data_str = data_str)#url=self.URL, params=params
-            if not response:
-                break # last page
-            response = json.loads(response)
-            if len(response) == 0:
-                break # last page
-            results.extend(response["data"])
-            params["offset"] += params["limit"]
+        for page in self._get_pages(from_cache = from_cache):
+            results.extend(page["data"])
 
             # if parent == "Neptune":
             #   ignore (because Neptune is default)
@@ -112,4 +99,77 @@ class ImcceExtractor(Extractor):
                 if key in self.ATTRS:
                     data[self.ATTRS[key]] = value
             result[data["label"]] = data
-        return result
\ No newline at end of file
+        return result
+
+
+    def _get_pages(self,
+                   from_cache: bool = True) -> list[dict]:
+        """
+        Get the pages of results of the search, in the order of their offsets.
+        The first page gives the total number of results: the offsets
+        of the next pages are computed from it and the pages are
+        downloaded at the same time. Without a total, the pages are
+        requested one after the other until an empty page.
+
+        Args:
+            from_cache: whether to get the pages from cache if they exist.
+        """
+        pages = []
+        page = self._get_page(0, from_cache = from_cache)
+        if page and "total" in page:
+            pages.append(page)
+            # Prefetch the next pages
+            queries = [self._query(offset)
+                       for offset in range(self.LIMIT, page["total"], self.LIMIT)]
+            contents = CacheManager.get_pages(queries,
+                                              self.CACHE,
+                                              from_cache = from_cache)
+            for content in contents:
+                page = json.loads(content) if content else dict()
+                if not page.get("data"):
+                    break # last page
+                pages.append(page)
+            return pages
+        offset = 0
+        while page.get("data"):
+            pages.append(page)
+            offset += self.LIMIT
+            page = self._get_page(offset, from_cache = from_cache)
+        return pages
+
+
+    def _get_page(self,
+                  offset: int,
+                  from_cache: bool = True) -> dict:
+        """
+        Get the page of results starting at offset,
+        or an empty dictionary if it could not be downloaded.
+
+        Args:
+            offset: index of the page's first result.
+            from_cache: whether to get the page from cache if it exists.
+        """
+        content = CacheManager.get_page(list_name = self.CACHE,
+                                        from_cache = from_cache,
+                                        **self._query(offset))
+        if not content:
+            return dict()
+        return json.loads(content)
+
+
+    def _query(self,
+               offset: int) -> dict:
+        """
+        Arguments of CacheManager.get_page to request the page
+        of results starting at offset.
+
+        Args:
+            offset: index of the page's first result.
+        """
+        params = {"q": self.QUERY,
+                  "limit": self.LIMIT,
+                  "offset": offset}
+        data_str = params["q"] + '_' + str(offset) + '-' + str(offset + self.LIMIT)
+        return {"url": config.IMCCE_HOST + self._API_PATH,
+                "params": params,
+                "data_str": data_str}
\ No newline at end of file
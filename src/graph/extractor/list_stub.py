@@ -0,0 +1,201 @@
+"""
+Local stand-in for the paged lists' websites (IMCCE and NSSDC), to run,
+test and benchmark their extractors offline. It implements the part of
+the websites used by ImcceExtractor and NssdcExtractor: the SsODNet.quaero
+search API (/quaero/1/sso/search?q=&limit=&offset=), the NSSDC spacecraft
+query (POST /nmc/spacecraft/query) and the NSSDC spacecraft pages
+(/nmc/spacecraft/display.action?id=).
+
+Responses are replayed from a fixtures folder:
+    <fixtures>/imcce.json: the list of the search's results (quaero's data).
+    <fixtures>/nssdc/disciplines.json: the spacecraft ids of each
+        discipline ({discipline: [id]}).
+    <fixtures>/nssdc/<id>.html: the spacecraft pages.
+
+Usage (from the src folder):
+    python -m graph.extractor.list_stub --port 8282 --fixtures list_fixtures
+    export IMCCE_HOST="http://localhost:8282"
+    export NSSDC_HOST="http://localhost:8282"
+    python update.py -l imcce nssdc
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import json
+import threading
+import time
+
+from argparse import ArgumentParser
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+
+# Maximum number of results of a quaero search page
+MAX_LIMIT = 100
+
+
+class ListStub(ThreadingHTTPServer):
+    """
+    HTTP server answering like the IMCCE API and the NSSDC website.
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 fixtures_dir: str | Path,
+                 host: str = "localhost",
+                 port: int = 8282,
+                 latency: float = 0.):
+        """
+        Args:
+            fixtures_dir: folder of the recorded responses
+            host: host to listen on
+            port: port to listen on. 0 to pick a free port.
+            latency: seconds to wait before answering a request
+        """
+        super().__init__((host, port), _ListStubHandler)
+        self.fixtures_dir = Path(fixtures_dir)
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.requests_count = 0
+
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def wait(self):
+        with self._lock:
+            self.requests_count += 1
+        time.sleep(self.latency)
+
+
+    def read_fixture(self,
+                     path: str) -> str:
+        """
+        Get the content of a fixture, or None if it is not recorded.
+
+        Args:
+            path: path of the fixture in the fixtures folder
+        """
+        fixture = self.fixtures_dir / path
+        if not fixture.is_file():
+            return None
+        with open(fixture, "r", encoding = "utf-8") as file:
+            return file.read()
+
+
+class _ListStubHandler(BaseHTTPRequestHandler):
+
+    server: ListStub
+
+    def log_message(self, format, *args):
+        pass # Do not print every request
+
+
+    def _send(self,
+              status: int,
+              body: str,
+              content_type: str = "text/html"):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _send_json(self,
+                   status: int,
+                   data: dict):
+        self._send(status, json.dumps(data), "application/json")
+
+
+    def do_GET(self):
+        self.server.wait()
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/quaero/1/sso/search":
+            self._search(query)
+        elif url.path == "/nmc/spacecraft/display.action" and "id" in query:
+            page = self.server.read_fixture(f"nssdc/{query['id']}.html")
+            if page is None:
+                self._send(404, "<html><body>Not found</body></html>")
+            else:
+                self._send(200, page)
+        else:
+            self._send_json(404, {"error": f"unknown endpoint {url.path}"})
+
+
+    def do_POST(self):
+        self.server.wait()
+        length = int(self.headers.get("Content-Length", 0))
+        form = {key: values[0] for key, values
+                in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+        if urlparse(self.path).path != "/nmc/spacecraft/query":
+            self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+            return
+        disciplines = json.loads(self.server.read_fixture("nssdc/disciplines.json") or "{}")
+        rows = "".join(f'<tr><td><a href="/nmc/spacecraft/display.action?id={escape(spacecraft_id)}">' +
+                       f'{escape(spacecraft_id)}</a></td></tr>'
+                       for spacecraft_id in disciplines.get(form.get("discipline"), []))
+        self._send(200, f"<html><body><table>{rows}</table></body></html>")
+
+
+    def _search(self,
+                query: dict):
+        results = json.loads(self.server.read_fixture("imcce.json") or "[]")
+        limit = min(int(query.get("limit", MAX_LIMIT)), MAX_LIMIT)
+        offset = int(query.get("offset", 0))
+        if offset >= len(results) and offset > 0:
+            self._send_json(404, {"message": "No result"})
+            return
+        self._send_json(200, {"data": results[offset:offset + limit],
+                              "total": len(results),
+                              "links": {"self": self.path}})
+
+
+def main(port: int,
+         fixtures_dir: str,
+         latency: float):
+    server = ListStub(fixtures_dir,
+                      port = port,
+                      latency = latency)
+    print(f"List stub listening on {server.url}. " +
+          f"Use export IMCCE_HOST=\"{server.url}\" NSSDC_HOST=\"{server.url}\" to target it.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{server.requests_count} requests.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog = "list_stub",
+                            description = "Local stand-in for the IMCCE and NSSDC websites, for offline runs and tests.")
+    parser.add_argument("-p",
+                        "--port",
+                        dest = "port",
+                        type = int,
+                        default = 8282,
+                        help = "Port to listen on. Default is 8282.")
+    parser.add_argument("-f",
+                        "--fixtures",
+                        dest = "fixtures_dir",
+                        required = True,
+                        help = "Folder of the recorded responses (imcce.json, nssdc/).")
+    parser.add_argument("--latency",
+                        dest = "latency",
+                        type = float,
+                        default = 0.,
+                        help = "Seconds to wait before answering a request.")
+    args = parser.parse_args()
+    main(args.port,
+         args.fixtures_dir,
+         args.latency)
@@ -8,10 +8,13 @@ Author:
     Liza Fretel (liza.fretel@obspm.fr)
 """
 
+import config
 from bs4 import BeautifulSoup
+from config import EXTRACT_BATCH_SIZE
 from graph import entity_types
 from graph.extractor.cache import CacheManager
 from graph.extractor.extractor import Extractor
+from typing import Iterator
 from utils.string_utilities import clean_string
 
 
@@ -20,6 +23,10 @@ class NssdcExtractor(Extractor):
     # Base URL for queries
     URL = "https://nssdc.gsfc.nasa.gov/nmc/spacecraft/query"
 
+    # Entities' url (their pages are downloaded from config.NSSDC_HOST)
+    HOST = "https://nssdc.gsfc.nasa.gov"
+    _QUERY_PATH = "/nmc/spacecraft/query"
+
     # URI to save this source as an entity
     URI = "nssdc_list"
 
@@ -68,35 +75,34 @@ class NssdcExtractor(Extractor):
                       #"nominal power": "nominal_power" # watts (maximum power required by a facility)
                       }
 
-    def extract(self,
-                from_cache: bool = True) -> dict:
+    def iter_extract(self,
+                     from_cache: bool = True) -> Iterator[dict]:
         """
-        Extract the page content into a dictionary.
+        Extract the pages' content into dictionaries,
+        by batches of EXTRACT_BATCH_SIZE pages.
         """
-        result = dict()
-
         # 1. Get the entities' URL pages
-        entities_url = set()
+        entities_url = self._get_entities_url(from_cache = from_cache)
 
-        for discipline in self.DISCIPLINES.keys():
-            content = CacheManager.get_page(NssdcExtractor.URL,
-                                            self.CACHE,
-                                            from_cache = from_cache,
-                                            data = {"name": "",
-                                                    "discipline": discipline,
-                                                    "launch": ""},
-                                            data_str = discipline)
+        # 2. Extract pages data
+        for i in range(0, len(entities_url), EXTRACT_BATCH_SIZE):
+            yield self._extract_pages(entities_url[i:i + EXTRACT_BATCH_SIZE])
 
-            soup = BeautifulSoup(content, "html.parser")
-            table = soup.find('table')
-            for a_tag in table.find_all('a', href=True):
-                entities_url.add(a_tag['href'])
+    def _extract_pages(self,
+                       entities_url: list[str]) -> dict:
+        """
+        Download the entities' pages and extract them into a dictionary.
 
-        # 2. Extract pages data
-        for entity_url in entities_url:
-            entity_url = "https://nssdc.gsfc.nasa.gov" + entity_url
-            content = CacheManager.get_page(entity_url,
-                                            self.CACHE)
+        Args:
+            entities_url: the paths of the entities' pages.
+        """
+        result = dict()
+        contents = CacheManager.get_many([config.NSSDC_HOST + entity_url
+                                          for entity_url in entities_url],
+                                         self.CACHE)
+        entities_url = [self.HOST + entity_url
+                        for entity_url in entities_url]
+        for entity_url, content in zip(entities_url, contents):
             soup = BeautifulSoup(content, "html.parser")
             maindiv = soup.find("div", {"class": "twocol"})
             left = maindiv.find("div", {"class": "urone"})
@@ -126,6 +132,31 @@ class NssdcExtractor(Extractor):
             result[label] = data
         return result
 
+    def _get_entities_url(self,
+                          from_cache: bool = True) -> list[str]:
+        """
+        Get the sorted paths of the entities' pages of the disciplines.
+        The disciplines are queried at the same time.
+
+        Args:
+            from_cache: whether to get the queries' results from cache.
+        """
+        queries = [{"url": config.NSSDC_HOST + self._QUERY_PATH,
+                    "data": {"name": "",
+                             "discipline": discipline,
+                             "launch": ""},
+                    "data_str": discipline}
+                   for discipline in self.DISCIPLINES.keys()]
+        entities_url = set()
+        for content in CacheManager.get_pages(queries,
+                                              self.CACHE,
+                                              from_cache = from_cache):
+            soup = BeautifulSoup(content, "html.parser")
+            table = soup.find('table')
+            for a_tag in table.find_all('a', href=True):
+                entities_url.add(a_tag['href'])
+        return sorted(entities_url)
+
     def _to_dict(self,
                  div) -> dict:
         """
@@ -158,7 +189,7 @@ class NssdcExtractor(Extractor):
                     if d2.name == "li":
                         a = d2.find("a")
                         if a:
-                            href = "https://nssdc.gsfc.nasa.gov" + a["href"]
+                            href = self.HOST + a["href"]
                             elements.append(href)
                         else:
                             value = d2.get_text().replace('\xa0', ' ')
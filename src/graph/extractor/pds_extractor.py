@@ -9,8 +9,14 @@ Data errors:
 Author:
     Liza Fretel (liza.fretel@obspm.fr)
 """
+import io
+import multiprocessing
 import re
 from bs4 import BeautifulSoup
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from config import HTTP_WORKERS, PARSE_WORKERS
 from graph import entity_types
 from graph.extractor.cache import CacheManager
 from graph.extractor.extractor import Extractor
@@ -101,170 +107,14 @@ class PdsExtractor(Extractor):
         """
         result = dict()
 
-        # Dictionary to save the internal references and replace
-        # them by our ontology's ID in the result dict
-        # (used with hasPart & isPartOf)
-        pds_references_by_id = dict()
-
-        for context_type in PdsExtractor.CONTEXT_TYPES:
-            url = PdsExtractor.URL + context_type
-
-            links = self._get_links_pds(url,
-                                        from_cache = from_cache)
-
-            links = [link for link in links
-                     if link.endswith(".xml") and not link.startswith("Collection")]
-
-            links = self._last_versions(links)
-
-            #namespace = "http://pds.nasa.gov/pds4/pds/v1"
-
-            #namespaces = {'pds': 'http://pds.nasa.gov/pds4/pds/v1'}
-
-            for href in links:
-                data = dict()
-
-                # cat (type)
-                cat = href.split('.')[0]
-                if "all" in PdsExtractor.CONTEXT_TYPES[context_type]:
-                    # keep all subtypes from this type
-                    cat = context_type
-                elif cat not in PdsExtractor.CONTEXT_TYPES[context_type]:
-                    # ignore this subtype (ex: laboratory, individual, other_investigation...)
-                    continue
-
-                # Download XML file for href
-                resource_url = PdsExtractor.URL + context_type + '/' + href
-                content = CacheManager.get_page(resource_url,
-                                                from_cache = from_cache,
-                                                list_name = self.CACHE)
-
-                # Remove default namespace for lookup
-                content = re.sub(r'xmlns="[^"]+"', '', content)
-
-                # Parse XML file
-                root = ET.fromstring(content.encode("utf-8"))#, etree.XMLParser())
-
-                # Internal references part_of / is_part_of
-                has_part = []
-                is_part_of = []
-                internal_references = root.findall(f".//Internal_Reference")
-                for internal_reference in internal_references:
-                    lid_reference = internal_reference.find("lid_reference")
-                    if lid_reference is None or not lid_reference.text:
-                        continue
-                    # lid_reference = lid_reference.text.split(':')[-1]
-                    reference_type = internal_reference.find("reference_type")
-                    if reference_type.text in [
-                            "investigation_to_instrument_host",
-                            "instrument_host_to_instrument",
-                            "investigation_to_instrument",
-                            "facility_to_telescope"]:
-                        has_part.append(lid_reference.text)
-                    elif reference_type.text in [
-                            "instrument_host_to_investigation",
-                            "instrument_to_instrument_host",
-                            "instrument_to_investigation",
-                            "telescope_to_facility"]:
-                        is_part_of.append(lid_reference.text)
-                    elif reference_type.text.endswith("to_destination"):
-                        data["destination"] = lid_reference.text
-                if has_part:
-                    data["has_part"] = has_part
-                if is_part_of:
-                    data["is_part_of"] = is_part_of
-
-
-                # Facility's tags
-                facility = root.find(f".//{cat.title()}") # ex: ".//Facility"
-                if facility is None:
-                    facility = root.findall('*')[-1] # last div is the facility
-                tags = facility.findall('*')
-                for tag in tags:
-                    if tag.text is None: # or tag.text not in self.FACILITY_ATTRS:
-                        continue # empty tag
-                    tag_str = tag.tag
-                    tag_text = tag.text.strip()
-                    if tag_text in ["NULL", "Unknown"]:
-                        continue
-                    tag_str = PdsExtractor.FACILITY_ATTRS.get(tag_str, tag_str)
-                    tag_text = re.sub("[\n ]+", " ", tag_text)
-                    if tag_str == "aperture":
-                        unit = tag.attrib["unit"]
-                        tag_text = tag_text + unit
-                        # Convert to meters
-                        if unit != 'm':
-                            _, tag_text = get_aperture(tag_text)
-                             # get_aperture returns a set
-                            tag_text = list(tag_text)[0]
-                    #elif tag_str == "country":
-                    #    if tag_text == "USA":
-                    #        tag_text = "United States"
-                    if tag_str == "label":
-                        data["label"] = tag_text
-                    elif tag_str in data:
-                        data[tag_str].add(tag_text)
-                    else:
-                        data[tag_str] = {tag_text}
-
-                # Again but for Identification_Area
-                facility = (root.find(f".//Alias_List"))
-                if facility:
-                    tags = facility.findall('*')
-                    for tag in facility.iter():
-                        if tag.text is None or tag.tag not in self.FACILITY_ATTRS:
-                            # Descriptions in Identification_Area are modification descriptions
-                            continue
-                        tag_str = tag.tag
-                        tag_text = tag.text.strip()
-                        if tag_text in ["NULL", "Unknown"]:
-                            continue
-                        tag_str = PdsExtractor.FACILITY_ATTRS.get(tag_str, tag_str)
-                        tag_text = re.sub("[\n ]+", " ", tag_text)
-                        if tag_str == "label":
-                            data["label"] = tag_text
-                            continue
-                        if tag_str in data:
-                            data[tag_str].add(tag_text)
-                        else:
-                            data[tag_str] = {tag_text}
-
-                data["url"] = resource_url
-
-                # label
-                label = root.find(".//title")
-                # label = root.xpath("//title")
-                if label is not None:
-                    label = label.text.strip()
-                    if "label" not in data:
-                        data["label"] = label
-
-                # code
-                logical_identifier = root.find(".//logical_identifier")
-                if logical_identifier is not None:
-                    code = logical_identifier.text.strip()
-                    data["code"] = code
-                    pds_references_by_id[code] = label
-
-                # We already know the type (no need to disambiguate with LLM)
-                # /!\ do not move this line earlier in the code as
-                # it overwrites the page's type
-                data["type"] = PdsExtractor.TYPES[cat]
-                data["type_confidence"] = 1
-                label = data["label"]
-                if data["type"] == entity_types.GROUND_OBSERVATORY:
-                    # Only refresh certain types that are "generic" in PDS
-                    for name, new_cat in PdsExtractor.NAME_CONTAINS.items():
-                        if name in label.lower():
-                            data["type"] = new_cat
-                            break
-
-                # result[data["label"] + '-' + data["type"]] = data
-                if data["code"] in result:
-                    merge_into(result[data["code"]], data)
-                    # Merge entities with the same label
-                else:
-                    result[data["code"]] = data
+        for data in self._iter_labels(self._resources(from_cache),
+                                      from_cache = from_cache):
+            # result[data["label"] + '-' + data["type"]] = data
+            if data["code"] in result:
+                merge_into(result[data["code"]], data)
+                # Merge entities with the same label
+            else:
+                result[data["code"]] = data
 
         # If the PDS identifier does not exists in the
         # extracted data, create a new entity with this
@@ -312,6 +162,81 @@ class PdsExtractor(Extractor):
         return result
 
 
+    def _resources(self,
+                   from_cache: bool = True) -> list[tuple[str, str]]:
+        """
+        List the XML files of the context types to extract
+        (last versions only).
+
+        Args:
+            from_cache: use the cached listing pages
+        """
+        all_resources = []
+        for context_type in PdsExtractor.CONTEXT_TYPES:
+            url = PdsExtractor.URL + context_type
+
+            links = self._get_links_pds(url,
+                                        from_cache = from_cache)
+
+            links = [link for link in links
+                     if link.endswith(".xml") and not link.startswith("Collection")]
+
+            links = self._last_versions(links)
+
+            #namespace = "http://pds.nasa.gov/pds4/pds/v1"
+
+            #namespaces = {'pds': 'http://pds.nasa.gov/pds4/pds/v1'}
+
+            resources = []
+            for href in links:
+                # cat (type)
+                cat = href.split('.')[0]
+                if "all" in PdsExtractor.CONTEXT_TYPES[context_type]:
+                    # keep all subtypes from this type
+                    cat = context_type
+                elif cat not in PdsExtractor.CONTEXT_TYPES[context_type]:
+                    # ignore this subtype (ex: laboratory, individual, other_investigation...)
+                    continue
+                resources.append((cat, PdsExtractor.URL + context_type + '/' + href))
+
+            all_resources.extend(resources)
+        return all_resources
+
+
+    def _iter_labels(self,
+                     resources: list[tuple[str, str]],
+                     from_cache: bool = True) -> Iterator[dict]:
+        """
+        Download the XML files with a bounded pool of threads and parse
+        them in a pool of processes as soon as they are downloaded.
+        Yield the entities' data as their parsing completes, in the
+        resources' order (so that merging them is deterministic).
+        The processes are started by a forkserver, as forking a process
+        that already runs the download threads can deadlock it.
+
+        Args:
+            resources: (cat, url) of the XML files
+            from_cache: use the cached XML files
+        """
+        with (ThreadPoolExecutor(max_workers = HTTP_WORKERS) as downloads,
+              ProcessPoolExecutor(max_workers = PARSE_WORKERS,
+                                  mp_context = multiprocessing.get_context("forkserver")) as parsers):
+            contents = downloads.map(lambda resource: CacheManager.get_page(resource[1],
+                                                                            list_name = self.CACHE,
+                                                                            from_cache = from_cache),
+                                     resources)
+            parsing = deque()
+            for (cat, resource_url), content in zip(resources, contents):
+                if not content:
+                    print(f"Could not download {resource_url}.")
+                    continue
+                parsing.append(parsers.submit(parse_label, content, cat, resource_url))
+                while parsing and parsing[0].done():
+                    yield parsing.popleft().result()
+            while parsing:
+                yield parsing.popleft().result()
+
+
     def _create_entity_from_missing_id(self,
                                        identifier: str) -> dict:
         """
@@ -408,5 +333,150 @@ class PdsExtractor(Extractor):
         return new_list
 
 
+def parse_label(content: str,
+                cat: str,
+                resource_url: str) -> dict:
+    """
+    Parse the XML file of a PDS context product into a data dictionary.
+    The file is read in a single pass with iterparse that only picks the
+    needed elements (internal references, facility, aliases, title and
+    logical identifier), instead of searching the whole tree for each of
+    them. The internal references, that make most of the large files, are
+    cleared once read. The other elements are kept, as the facility's
+    element is only known at the end of the file (the root's last child
+    if there is no facility tag). Module-level so that it can run in a
+    pool of processes.
+
+    Args:
+        content: the XML file
+        cat: the entity's PDS type (ex: telescope, spacecraft)
+        resource_url: URL of the XML file
+    """
+    facility_tag = cat.title() # ex: "Facility"
+    wanted = {"Internal_Reference", facility_tag, "Alias_List",
+              "title", "logical_identifier"}
+    first = dict() # First element of each wanted tag
+    internal_references = [] # (lid_reference, reference_type)
+
+    # Remove default namespace for lookup
+    content = re.sub(r'xmlns="[^"]+"', '', content)
+    elements = ET.iterparse(io.BytesIO(content.encode("utf-8")),
+                            events = ("end",))
+    for _, element in elements:
+        tag = element.tag
+        if tag not in wanted:
+            continue
+        if tag == "Internal_Reference":
+            lid_reference = element.find("lid_reference")
+            reference_type = element.find("reference_type")
+            internal_references.append((None if lid_reference is None else lid_reference.text,
+                                        None if reference_type is None else reference_type.text))
+            element.clear()
+        elif tag not in first:
+            first[tag] = element
+    root = elements.root
+    # Only look into the root's descendants
+    first = {tag: element for tag, element in first.items() if element is not root}
+
+    data = dict()
+
+    # Internal references part_of / is_part_of
+    has_part = []
+    is_part_of = []
+    for lid_reference, reference_type in internal_references:
+        if not lid_reference:
+            continue
+        if reference_type in ["investigation_to_instrument_host",
+                              "instrument_host_to_instrument",
+                              "investigation_to_instrument",
+                              "facility_to_telescope"]:
+            has_part.append(lid_reference)
+        elif reference_type in ["instrument_host_to_investigation",
+                                "instrument_to_instrument_host",
+                                "instrument_to_investigation",
+                                "telescope_to_facility"]:
+            is_part_of.append(lid_reference)
+        elif reference_type.endswith("to_destination"):
+            data["destination"] = lid_reference
+    if has_part:
+        data["has_part"] = has_part
+    if is_part_of:
+        data["is_part_of"] = is_part_of
+
+    # Facility's tags
+    facility = first.get(facility_tag)
+    if facility is None:
+        facility = root[-1] # last div is the facility
+    for tag in facility:
+        if tag.text is None:
+            continue # empty tag
+        tag_str = tag.tag
+        tag_text = tag.text.strip()
+        if tag_text in ["NULL", "Unknown"]:
+            continue
+        tag_str = PdsExtractor.FACILITY_ATTRS.get(tag_str, tag_str)
+        tag_text = re.sub("[\n ]+", " ", tag_text)
+        if tag_str == "aperture":
+            unit = tag.attrib["unit"]
+            tag_text = tag_text + unit
+            # Convert to meters
+            if unit != 'm':
+                _, tag_text = get_aperture(tag_text)
+                # get_aperture returns a set
+                tag_text = list(tag_text)[0]
+        if tag_str == "label":
+            data["label"] = tag_text
+        elif tag_str in data:
+            data[tag_str].add(tag_text)
+        else:
+            data[tag_str] = {tag_text}
+
+    # Again but for Identification_Area
+    aliases = first.get("Alias_List")
+    for tag in aliases.iter() if aliases is not None and len(aliases) else []:
+        if tag.text is None or tag.tag not in PdsExtractor.FACILITY_ATTRS:
+            # Descriptions in Identification_Area are modification descriptions
+            continue
+        tag_str = tag.tag
+        tag_text = tag.text.strip()
+        if tag_text in ["NULL", "Unknown"]:
+            continue
+        tag_str = PdsExtractor.FACILITY_ATTRS.get(tag_str, tag_str)
+        tag_text = re.sub("[\n ]+", " ", tag_text)
+        if tag_str == "label":
+            data["label"] = tag_text
+            continue
+        if tag_str in data:
+            data[tag_str].add(tag_text)
+        else:
+            data[tag_str] = {tag_text}
+
+    data["url"] = resource_url
+
+    # label
+    if "title" in first:
+        label = first["title"].text.strip()
+        if "label" not in data:
+            data["label"] = label
+
+    # code
+    if "logical_identifier" in first:
+        data["code"] = first["logical_identifier"].text.strip()
+
+    # We already know the type (no need to disambiguate with LLM)
+    # /!\ do not move this line earlier in the code as
+    # it overwrites the page's type
+    data["type"] = PdsExtractor.TYPES[cat]
+    data["type_confidence"] = 1
+    label = data["label"]
+    if data["type"] == entity_types.GROUND_OBSERVATORY:
+        # Only refresh certain types that are "generic" in PDS
+        for name, new_cat in PdsExtractor.NAME_CONTAINS.items():
+            if name in label.lower():
+                data["type"] = new_cat
+                break
+    return data
+
+
 if __name__ == "__main__":
     pass
\ No newline at end of file
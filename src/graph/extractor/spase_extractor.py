@@ -16,7 +16,10 @@ from graph.extractor import data_fixer
 from utils.string_utilities import clean_string, has_cospar_nssdc_id, standardize_uri, cut_acronyms, get_suffix_number
 from utils.dict_utilities import merge_into, UnionFind, majority_voting_merge
 from utils.location_utilities import distance
+import copy
+import hashlib
 import json
+import pickle
 import re
 import os
 
@@ -96,6 +99,9 @@ class SpaseExtractor(Extractor):
                       "InstrumentType": "instrument_type",
                       "InvestigationName": "investigation_name"}
 
+    # Parsed files, by blob hash
+    _PARSED_FILES_FILE = CACHE_DIR / "SPASE" / "parsed_files.pickle"
+
 
     def __init__(self):
         pass
@@ -110,118 +116,179 @@ class SpaseExtractor(Extractor):
         """
         Extract the github content into a dictionary.
         """
+        result = self._extract_files(from_cache)
+        data_fixer.fix(result, self)
+        self._self_merge(result)
+        self._restore_self_ref(result)
+        self._self_merge_instruments(result)
+        self._restore_self_ref_part(result)
+        self._remove_reflexive_parts(result)
+        return result
+
+
+    def _extract_files(self,
+                       from_cache: bool = True) -> dict:
+        """
+        Pull the github repository and extract its files into a
+        dictionary (before fixing and merging the entities).
+        Only the files changed since the last extraction are parsed.
+
+        Args:
+            from_cache: False to parse all the files again
+        """
         # pull if not exist
         CacheManager.git_pull(self.URL,
                               self.GIT_REPO,
                               list_name = self.CACHE)
 
-        # get files from the git repo that are Observatory .json
-        files = self._list_files(str(CACHE_DIR / self.CACHE / self.GIT_REPO))
+        repo = str(CACHE_DIR / self.CACHE / self.GIT_REPO)
+        parsed = SpaseExtractor._parsed_files(from_cache)
+        commit = CacheManager.git_head(self.GIT_REPO,
+                                       list_name = self.CACHE)
+        changes = None
+        if parsed["commit"] and commit:
+            changes = CacheManager.git_diff(self.GIT_REPO,
+                                            self.CACHE,
+                                            parsed["commit"],
+                                            commit)
+
+        # Blob hash of the files to extract (None: to read)
+        if changes is None:
+            # Unknown history: walk the whole repository
+            blobs = dict.fromkeys(self._list_files(repo))
+        else:
+            # Only read the files added or modified since the last commit
+            blobs = {str(Path(repo) / path): blob
+                     for path, blob in parsed["files"].items()}
+            for status, path in changes:
+                file = str(Path(repo) / path)
+                if status == "D":
+                    blobs.pop(file, None)
+                elif self._keep_file(file):
+                    blobs[file] = None
 
         result = dict()
 
-        for file in files:
+        for file in sorted(blobs):
+            if blobs[file] is None:
+                with open(file, "rb") as f:
+                    content = f.read()
+                blobs[file] = blob_hash(content)
+                if blobs[file] not in parsed["data"]:
+                    parsed["data"][blobs[file]] = self._parse_file(content.decode("utf-8"))
 
-            with open(file, "r") as f:
-                content = f.read()
+            data = parsed["data"][blobs[file]]
+            if data is None:
+                continue # Empty file
+            data = copy.deepcopy(data) # The cached data must not be merged
 
-            if not content:
-                continue
+            # url
+            href = self.URL + "/tree/master" + file.split(self.GIT_REPO)[1]
+            data["url"] = {href}
 
-            dict_content = json.loads(content)
+            # type
+            self._get_type(data)
 
-            data = dict() # Dict to add to the result dict
+            assert "label" in data
+            assert "type" in data
 
-            alt_labels = set()
+            term = file.split(self.GIT_REPO)[1]
+            term = term.removesuffix(".json")
+            result[term] = data
 
-            launch_year = ""
+        # Next extraction starts from this commit
+        parsed["commit"] = commit
+        parsed["files"] = {os.path.relpath(file, repo): blob
+                           for file, blob in blobs.items()}
+        SpaseExtractor._save_parsed_files()
+        return result
 
-            label = ""
 
-            for rel, values in extract_items(dict_content):
-                if rel not in self.FACILITY_ATTRS:
-                    continue
+    def _parse_file(self,
+                    content: str) -> dict | None:
+        """
+        Parse the content of a SPASE json file into a data dictionary
+        (without the file's url). None if the file is empty.
 
-                key = self.FACILITY_ATTRS.get(rel)
+        Args:
+            content: the file's content
+        """
+        if not content:
+            return None
 
-                if type(values) == str:
-                    values = {values}
-                for value in values:
-                    value = clean_string(value)
-                    if value == "None" or value == "-":
-                        continue
-                    elif "PriorID" in rel:
-                        if "\n" in value or len(value) > 150:
-                            key = self.FACILITY_ATTRS["Description"]
-                        else:
-                            value.removesuffix('.') # Remove final '.'
-                            prior_id = value
-                    elif key == "longitude":
-                        # Remove final 'E' (East) to have a valid float value
-                        if value[-1] == 'E':
-                            value = value[:-1]
-                        value = float(value)
-                    elif key == "latitude":
-                        value = float(value)
-                    elif key == "description":
-                        if value.startswith("includes observatory/station name,"):
-                            continue # Ignore this description
-                    elif key in ("start_date", "end_date"):
-                        if value.startswith("2000-01-01"):
-                            continue # Default date, ignore
-                    elif key == "investigation_name":
-                        if value == "None Identified":
-                            continue # For instruments
-                    # Add to the data dict
-                    if key == "label":
-                        assert len(values) == 1
-                        label = value
-                        assert "label" not in data
-                        data[key] = value
-                    elif key == "alt_label":
-                        ok, nssdc_id, launch_date = has_cospar_nssdc_id(value)
-                        if ok:
-                            data["NSSDCA_ID"] = nssdc_id
-                            data["COSPAR_ID"] = nssdc_id
-                            launch_year = launch_date
-                        else:
-                            value = value.replace("Observatory Station Code: ", "")
-                            alt_labels.add(value)
-                    elif key in data:
-                        data[key].add(value)
-                    else:
-                        data[key] = {value}
+        dict_content = json.loads(content)
 
-            # alt labels
-            if alt_labels:
-                data["alt_label"] = alt_labels
+        data = dict() # Dict to add to the result dict
 
-            # launch date
-            if launch_year and "launch_date" not in data:
-                data["launch_date"] = launch_year
+        alt_labels = set()
 
+        launch_year = ""
 
-            # url
-            href = self.URL + "/tree/master" + file.split(self.GIT_REPO)[1]
-            data["url"] = {href}
+        label = ""
 
-            # type
-            self._get_type(data)
+        for rel, values in extract_items(dict_content):
+            if rel not in self.FACILITY_ATTRS:
+                continue
 
-            assert "label" in data
-            assert "type" in data
+            key = self.FACILITY_ATTRS.get(rel)
 
-            term = file.split(self.GIT_REPO)[1]
-            term = term.removesuffix(".json")
-            result[term] = data
+            if type(values) == str:
+                values = {values}
+            for value in values:
+                value = clean_string(value)
+                if value == "None" or value == "-":
+                    continue
+                elif "PriorID" in rel:
+                    if "\n" in value or len(value) > 150:
+                        key = self.FACILITY_ATTRS["Description"]
+                    else:
+                        value.removesuffix('.') # Remove final '.'
+                        prior_id = value
+                elif key == "longitude":
+                    # Remove final 'E' (East) to have a valid float value
+                    if value[-1] == 'E':
+                        value = value[:-1]
+                    value = float(value)
+                elif key == "latitude":
+                    value = float(value)
+                elif key == "description":
+                    if value.startswith("includes observatory/station name,"):
+                        continue # Ignore this description
+                elif key in ("start_date", "end_date"):
+                    if value.startswith("2000-01-01"):
+                        continue # Default date, ignore
+                elif key == "investigation_name":
+                    if value == "None Identified":
+                        continue # For instruments
+                # Add to the data dict
+                if key == "label":
+                    assert len(values) == 1
+                    label = value
+                    assert "label" not in data
+                    data[key] = value
+                elif key == "alt_label":
+                    ok, nssdc_id, launch_date = has_cospar_nssdc_id(value)
+                    if ok:
+                        data["NSSDCA_ID"] = nssdc_id
+                        data["COSPAR_ID"] = nssdc_id
+                        launch_year = launch_date
+                    else:
+                        value = value.replace("Observatory Station Code: ", "")
+                        alt_labels.add(value)
+                elif key in data:
+                    data[key].add(value)
+                else:
+                    data[key] = {value}
 
-        data_fixer.fix(result, self)
-        self._self_merge(result)
-        self._restore_self_ref(result)
-        self._self_merge_instruments(result)
-        self._restore_self_ref_part(result)
-        self._remove_reflexive_parts(result)
-        return result
+        # alt labels
+        if alt_labels:
+            data["alt_label"] = alt_labels
+
+        # launch date
+        if launch_year and "launch_date" not in data:
+            data["launch_date"] = launch_year
+
+        return data
 
 
     def _create_entity_from_missing_id(self,
@@ -245,33 +312,80 @@ class SpaseExtractor(Extractor):
 
 
     def _list_files(self,
-                    folder: str,
-                    visited_folders: Set = None) -> Set:
+                    folder: str) -> Set:
         """
         Get the list of paths recursively in the folder.
         Only return .json files located in any Observatory folder.
 
         Args:
             folder: the root folder
-            visited_folders: prevent looping in the tree
         """
         result = set()
-        if visited_folders is None:
-            visited_folders = set()
         for root, dirs, files in os.walk(folder):
+            if ".git" in dirs:
+                dirs.remove(".git")
             for file in files:
-                for FOLDER in self.KEEP_FOLDERS:
-                    if f"/{FOLDER}/" in folder + "/" and file.endswith(".json"):
-                        result.add(str(Path(root) /  file))
-            for dir in dirs:
-                dir = str(Path(root) / dir)
-                if dir not in visited_folders:
-                    visited_folders.add(dir)
-                    result.update(self._list_files(dir,
-                                  visited_folders = visited_folders))
+                file = str(Path(root) / file)
+                if self._keep_file(file):
+                    result.add(file)
         return result
 
 
+    def _keep_file(self,
+                   file: str) -> bool:
+        """
+        Whether a file of the repository is extracted: .json files
+        located in any of the KEEP_FOLDERS (or their subfolders).
+
+        Args:
+            file: the file's path
+        """
+        if not file.endswith(".json"):
+            return False
+        folder = os.path.dirname(file) + "/"
+        return any(f"/{FOLDER}/" in folder for FOLDER in self.KEEP_FOLDERS)
+
+
+    # Parsed files {"commit": last extracted commit,
+    #               "files": {path in the repository: blob hash},
+    #               "data": {blob hash: data dictionary}},
+    # loaded from _PARSED_FILES_FILE
+    PARSED_FILES = None
+
+    def _parsed_files(from_cache: bool = True) -> dict:
+        """
+        Get the parsed files. They are loaded from their file at the
+        first call, and saved at the end of the extraction (not when the
+        program exits, as the extractor can run in a pool of processes).
+
+        Args:
+            from_cache: False to parse all the files again
+        """
+        if SpaseExtractor.PARSED_FILES is None or not from_cache:
+            parsed = {"commit": None, "files": dict(), "data": dict()}
+            if from_cache and os.path.exists(SpaseExtractor._PARSED_FILES_FILE):
+                with open(SpaseExtractor._PARSED_FILES_FILE, "rb") as file:
+                    parsed = pickle.load(file)
+            SpaseExtractor.PARSED_FILES = parsed
+        return SpaseExtractor.PARSED_FILES
+
+
+    def _save_parsed_files():
+        parsed = SpaseExtractor.PARSED_FILES
+        if parsed is None:
+            return
+        # Forget the files that are not in the repository anymore
+        blobs = set(parsed["files"].values())
+        parsed["data"] = {blob: data for blob, data in parsed["data"].items()
+                          if blob in blobs}
+        SpaseExtractor._PARSED_FILES_FILE.parent.mkdir(parents = True,
+                                                       exist_ok = True)
+        tmp = str(SpaseExtractor._PARSED_FILES_FILE) + ".tmp"
+        with open(tmp, "wb") as file:
+            pickle.dump(parsed, file)
+        os.replace(tmp, SpaseExtractor._PARSED_FILES_FILE)
+
+
     def _get_type(self,
                   data: dict):
         """
@@ -367,20 +481,38 @@ class SpaseExtractor(Extractor):
         uf = UnionFind()
         groups = defaultdict(set)
         items = sorted(result.items()) # Make sure to always get the same uris
+        items = [(uri, data) for uri, data in items
+                 if data.get("type") != entity_types.INSTRUMENT]
+
+        # Normalized forms, computed once per entity
+        numbers = {uri: get_suffix_number(uri) for uri, _ in items}
+        identifiers = dict()
+        first_words = dict() # Updated when a label is added to the alt labels
+        for uri, data in items:
+            identifiers[uri] = {value for attr in ["NSSDCA_ID", "prior_id", "code"]
+                                for value in data.get(attr, [])}
+            first_words[uri] = {_first_word(label)
+                                for label in data.get("alt_label", set()) | {data["label"]}
+                                if label}
+        candidates = self._self_merge_candidates(items, identifiers)
+        cut_labels = dict()
+        def cut(label: str) -> str:
+            if label not in cut_labels:
+                cut_labels[label] = cut_acronyms(label)[0]
+            return cut_labels[label]
+
         for uri1, data1 in items:
-            if data1.get("type") == entity_types.INSTRUMENT:
-                continue
             label1 = data1["label"]
             labels1 = data1.get("alt_label", set())
             labels1.add(label1)
-            first_words1 = {label.replace('-', ' ').replace('.', ' ').split(' ')[0] for label in labels1 if label}
+            first_words1 = set(first_words[uri1])
 
             # description1 = data1.get("description", "")
-            num1 = get_suffix_number(uri1)
+            num1 = numbers[uri1]
             # word1 = label1.replace('-', ' ').split(' ')[0].lower() # .replace('/', ' ')
-            for uri2, data2 in items:
-                if uri1 >= uri2:
-                    continue
+            # Only compare the entities that share a blocking key
+            for uri2 in candidates[uri1]:
+                data2 = result[uri2]
                 # Filter on type
                 if data1.get("type") != data2.get("type"):
                     continue
@@ -406,20 +538,12 @@ class SpaseExtractor(Extractor):
                 """
 
                 # Merge on identifiers
-                to_check = ["NSSDCA_ID", "prior_id", "code"]
-                v1 = []
-                v2 = []
-                for attr in to_check:
-                    if attr in data1:
-                        v1.extend(data1[attr])
-                    if attr in data2:
-                        v2.extend(data2[attr])
-                if set(v1) & set(v2):
+                if identifiers[uri1] & identifiers[uri2]:
                     uf.union(uri1, uri2)
                     continue
 
                 # Solution: use the longest label as pref label
-                num2 = get_suffix_number(uri2)
+                num2 = numbers[uri2]
                 if num1 != num2:
                     # Prevent Cluster, Cluster 1 and Cluster 2 to map together
                     # Problem: Cluster-Rumba is the same as Cluster 1.
@@ -428,7 +552,7 @@ class SpaseExtractor(Extractor):
                 label2 = data2["label"]
                 labels2 = data2.get("alt_label", set())
                 labels2.add(label2)
-                first_words2 = {label.replace('-', ' ').replace('.', ' ').split(' ')[0] for label in labels2 if label}
+                first_words2 = first_words[uri2]
                 # Merge on first words
                 # word2 = label2.replace('-', ' ').split(' ')[0].lower() # .replace('/', ' ')
                 # Filter out incompatible entries
@@ -471,10 +595,13 @@ class SpaseExtractor(Extractor):
                         continue
                 alt_labels1 = data1.get("alt_label", set())
                 alt_labels2 = data2.get("alt_label", set())
-                label1, acr1 = cut_acronyms(label1)
-                label2, acr2 = cut_acronyms(label2)
+                label1 = cut(label1)
+                label2 = cut(label2)
                 alt_labels1.add(label1)
                 alt_labels2.add(label2)
+                for uri, data, label in [(uri1, data1, label1), (uri2, data2, label2)]:
+                    if "alt_label" in data and label:
+                        first_words[uri].add(_first_word(label))
                 alt_labels1 = {l.replace('-', ' ').lower() for l in alt_labels1}
                 alt_labels2 = {l.replace('-', ' ').lower() for l in alt_labels2}
                 if any(l.startswith("iaga") for l in alt_labels1):
@@ -515,6 +642,37 @@ class SpaseExtractor(Extractor):
         return replacement_labels
 
 
+    def _self_merge_candidates(self,
+                               items: list[tuple[str, dict]],
+                               identifiers: dict[str, set]) -> dict[str, list[str]]:
+        """
+        Blocking index of _self_merge: two entities are only compared
+        if they have the same type and share an identifier (NSSDCA ID,
+        prior ID, code) or a first word of their labels. The first word
+        of the label without acronyms (added to the alt labels while
+        comparing) is a key too, so that every pair that _self_merge
+        could merge is compared.
+
+        Returns:
+            the candidates of each uri (the next uris in sorted order)
+
+        Args:
+            items: the sorted (uri, data) of the entities to merge
+            identifiers: the identifiers of each uri
+        """
+        keys = dict()
+        blocks = defaultdict(list)
+        for uri, data in items:
+            labels = data.get("alt_label", set()) | {data["label"], cut_acronyms(data["label"])[0]}
+            keys[uri] = ({(data.get("type"), "id", value) for value in identifiers[uri]} |
+                         {(data.get("type"), "word", _first_word(label)) for label in labels if label})
+            for key in keys[uri]:
+                blocks[key].append(uri)
+        return {uri: sorted({candidate for key in keys[uri] for candidate in blocks[key]
+                             if candidate > uri})
+                for uri, _ in items}
+
+
     def _self_merge_instruments(self,
                                 result: dict):
         """
@@ -527,66 +685,31 @@ class SpaseExtractor(Extractor):
         """
         uf = UnionFind()
         all_instruments = set()
+        keys = dict() # Blocking keys of each instrument
         for _, data in sorted(result.items()):
             # has_part
             has_part = sorted(data.get("has_part", []))
             # SWARM -> SWARM-A, SWARM-B, SWARM-C (bug)
             if len(has_part) <= 1:
                 continue
-            for instrument1 in has_part:
-                data1 = result[instrument1]
-                if data1["type"] != entity_types.INSTRUMENT:
-                    continue
-                for instrument2 in has_part:
-                    if instrument1 >= instrument2:
-                        continue
-                    data2 = result[instrument2]
-
-                    if data2["type"] != entity_types.INSTRUMENT:
-                        continue
-
-                    # If same label
-                    alt_labels1 = data1.get("alt_label", set())
-                    alt_labels2 = data2.get("alt_label", set())
-                    # TODO try to use alt labels here (as in _self_merge)
-                    label1 = data1["label"]
-                    label2 = data2["label"]
-                    alt_labels1.add(label1)
-                    alt_labels2.add(label2)
-                    # if label1.lower() == label2.lower():
-                    if alt_labels1 & alt_labels2:
-                        uf.union(instrument1, instrument2)
-                        all_instruments.update([instrument1, instrument2])
-                        continue
-
-                    # If same filename
-                    urls1 = data1["url"]
-                    urls2 = data2["url"]
-                    if type(urls1) == str:
-                        urls1 = [urls1]
-                    if type(urls2) == str:
-                        urls2  = [urls2]
-                    urls1 = [f1.split('/')[-1] for f1 in urls1 if f1]
-                    urls2 = [f2.split('/')[-1] for f2 in urls2 if f2]
-                    if set(urls1) & set(urls2):
-                        uf.union(instrument1, instrument2)
-                        all_instruments.update([instrument1, instrument2])
-                        continue
-                    # If same identifier / prior id / NSSDCA ID
-                    """
-                    to_check = ["NSSDCA_ID", "prior_id", "code"]
-                    v1 = []
-                    v2 = []
-                    for attr in to_check:
-                        if attr in data1:
-                            v1.extend(data1[attr])
-                        if attr in data2:
-                            v2.extend(data2[attr])
-                    if set(v1) & set(v2):
-                        uf.union(instrument1, instrument2)
-                        all_instruments.update([instrument1, instrument2])
-                        continue
-                    """
+            instruments = [instrument for instrument in has_part
+                           if result[instrument]["type"] == entity_types.INSTRUMENT]
+            if len(instruments) <= 1:
+                continue
+            # Instruments that have a label or a filename in common
+            blocks = defaultdict(list)
+            for instrument in instruments:
+                if instrument not in keys:
+                    keys[instrument] = self._instrument_keys(result[instrument])
+                for key in keys[instrument]:
+                    blocks[key].append(instrument)
+            for instrument1 in instruments:
+                # TODO try to use alt labels here (as in _self_merge)
+                for instrument2 in sorted({instrument2 for key in keys[instrument1]
+                                           for instrument2 in blocks[key]
+                                           if instrument2 > instrument1}):
+                    uf.union(instrument1, instrument2)
+                    all_instruments.update([instrument1, instrument2])
         for instrument2 in all_instruments:
             instrument1 = uf.find(instrument2)
             if instrument1 == instrument2:
@@ -597,6 +720,27 @@ class SpaseExtractor(Extractor):
             del result[instrument2]
 
 
+    def _instrument_keys(self,
+                         data: dict) -> set[tuple[str, str]]:
+        """
+        Blocking keys of an instrument in _self_merge_instruments:
+        its labels and the filenames of its urls. Two instruments of the
+        same host are merged if they share a key.
+
+        Args:
+            data: the instrument's data
+        """
+        # If same label
+        alt_labels = data.get("alt_label", set())
+        alt_labels.add(data["label"])
+        # If same filename
+        urls = data.get("url", [])
+        if type(urls) == str:
+            urls = [urls]
+        return ({("label", label) for label in alt_labels} |
+                {("filename", url.split('/')[-1]) for url in urls if url})
+
+
     def _restore_self_ref(self,
                           result: dict):
         """
@@ -674,6 +818,23 @@ class SpaseExtractor(Extractor):
                     parts.remove(key)
 
 
+def _first_word(label: str) -> str:
+    """
+    First word of a label, to compare the entities in _self_merge.
+    """
+    return label.replace('-', ' ').replace('.', ' ').split(' ')[0]
+
+
+def blob_hash(content: bytes) -> str:
+    """
+    Hash of a file's content, as computed by git (git hash-object).
+
+    Args:
+        content: the file's content
+    """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
 def extract_items(d: dict,
                   parent: str = "") -> list[tuple]:
     """
@@ -10,11 +10,14 @@ Author:
     Liza Fretel (liza.fretel@obspm.fr)
 """
 
+import atexit
+import config
 import json
 import os
 import ssl
 import sys
 import re
+import time
 
 from __version__ import __version__
 from SPARQLWrapper import SPARQLWrapper, JSON
@@ -22,14 +25,16 @@ from graph import entity_types
 from graph.extractor.cache import VersionManager, CacheManager
 from graph.extractor.extractor import Extractor
 from graph.extractor.data_fixer import fix
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from datetime import UTC, datetime
 from bs4 import BeautifulSoup
+from urllib.parse import unquote
 from utils.string_utilities import has_cospar_nssdc_id, get_aperture
 from utils.dict_utilities import merge_into
 
-from config import DATA_DIR # type: ignore
+from config import CACHE_DIR, DATA_DIR, HTTP_WORKERS # type: ignore
 
 
 class WikidataExtractor(Extractor):
@@ -69,6 +74,27 @@ class WikidataExtractor(Extractor):
     # File to save the controls for wikidata entities
     _CONTROL_FILE = "wikidata_entities_control_file_latest.json"
 
+    # wbgetentities API (on config.WIKIDATA_HOST), at most 50 ids per request
+    _API_PATH = "/w/api.php"
+    _BATCH_SIZE = 50
+
+    # Entities requested and parsed at the same time (kept in memory)
+    _CHUNK_SIZE = 500
+
+    # Parts of the entities used by _properties_to_dict
+    _ENTITY_PROPS = "labels|aliases|descriptions|claims|sitelinks/urls"
+
+    # Labels of the referenced items (classes, parts, units), saved between runs
+    _LABELS_FILE = CACHE_DIR / "Wikidata" / "wikidata_labels.json"
+
+    # Wikipedia API (config.WIKIPEDIA_HOST): at most 20 intros and 50 titles per request
+    _WIKIPEDIA_BATCH_SIZE = 20
+    _WIKIPEDIA_INFO_BATCH_SIZE = 50
+
+    # Wikipedia intros by page and revision, saved between runs
+    _INTROS_FILE = CACHE_DIR / "Wikidata" / "wikipedia_intros.json"
+    INTRO_BY_PAGE = None
+
     #_USER_AGENT = "semantics@ivoa.net - PADC/Observatoire de Paris - Python/%s.%s" % (
     #    sys.version_info[0], sys.version_info[1])
     _USER_AGENT = (f"FacilityList/{__version__} bot (https://observatoiredeparis.psl.eu/; semantics@ivoa.net) Python/{sys.version_info[0]}.{sys.version_info[1]}")
@@ -247,6 +273,41 @@ class WikidataExtractor(Extractor):
     }
     """
 
+    # Wikidata properties kept in the entities' data dicts
+    _PROPERTY_IDS = {
+        "P31": "source_type", # "instance_of"
+        "P247": "COSPAR_ID", # similar to NSSDCA_ID
+        "P8913": "NSSDCA_ID", # similar to COSPAR_ID
+        "P2956": "NAIF_ID",
+        "P717": "MPC_ID", #P5736: for astronomical body
+        "P527": "has_part",
+        #"P1202": "has_part" # carries scientific instrument
+        "P361": "is_part_of",
+        "P137": "funding_agency", #operator (also in NSSDC extractor, SPASE extractor)
+        #"P17": "country", # can be found using coordinate_location
+        #"P276": "location", # same
+        "P625": "coordinate_location",
+        "P1619": "start_date", # date of official opening
+        "P571": "start_date", # time when an entity begins to exist. Not same as P1619.
+        "P2044": "altitude", # elevation above see level
+        "P619": "launch_date", # UTC date of spacecraft launch
+        "P1427": "launch_place", # start point
+        "P856": "url", # official website
+        "P131": "state", # located in the administrative territorial entity
+        "P17": "country", # country
+        #"P397": "orbites", # parent astronomical body
+        #"P1096": "orbital_eccentricity", # orbital eccentricity
+        #"P2045": "orbital_inclination", # orbital inclination
+        #"P2146": "orbital_period", # orbital period
+        #"P2233": "semimajor_axis_of_orbit", # semi-major axis of an orbit
+        #"P2243": "apoapsis",
+        #"P2244": "periapsis",
+        "P2151": "focal_length",
+        "P2386": "aperture", # diameter
+        "P2067": "mass",
+        #"P2144": "frequency", # frequency
+    }
+
     # Query to get control pages (by type)
     _QUERY_CONTROL = lambda type: WikidataExtractor._QUERY_PREFIX + WikidataExtractor._SELECT_MAIN_SIMPLE + WikidataExtractor._WHERE_SIMPLE + WikidataExtractor._QUERY_TYPES[type] + WikidataExtractor._MINUS
 
@@ -295,33 +356,32 @@ class WikidataExtractor(Extractor):
                                                                        new_version = controls,
                                                                        list_name = self.CACHE)
             print(f"Ready to update {len(latest)} entities for {ent_type}.")
-            for wikidata_uri in tqdm(latest):
-                data = self._extract_entity(wikidata_uri,
-                                            from_cache = from_cache)
-                if data:
-                    # Downloaded page successfully.
-                    # Refresh the version at each loop to keep track of what
-                    # has worked in case of crash.
-                    VersionManager.refresh(last_version_file = self._CONTROL_FILE,
-                                           new_version = {wikidata_uri: controls["results"][wikidata_uri]},
-                                           list_name = self.CACHE)
-                    # Get a description from Wikipedia
-                    self._get_wikipedia_intro(data)
-
-                    if "type" not in data:
-                        data["type"] = [ent_type]
-                    else:
-                        data["type"].append(ent_type)
-                    data["type_confidence"] = 1
-                    if data["label"] in result: # Already found with another query (more than 1 type)
-                        old_types = result[data["label"]]["type"]
-                        data["type"].extend(old_types)
+            with VersionManager.buffered_refresh(last_version_file = self._CONTROL_FILE,
+                                                 list_name = self.CACHE) as versions:
+                for wikidata_uri, data in tqdm(self._iter_entities(latest,
+                                                                   from_cache = from_cache,
+                                                                   with_intro = True),
+                                               total = len(latest)):
+                    if data:
+                        # Downloaded page successfully.
+                        # Refresh the version at each loop to keep track of what
+                        # has worked in case of crash (saved by batches).
+                        versions.refresh({wikidata_uri: controls["results"][wikidata_uri]})
+
+                        if "type" not in data:
+                            data["type"] = [ent_type]
+                        else:
+                            data["type"].append(ent_type)
+                        data["type_confidence"] = 1
+                        if data["label"] in result: # Already found with another query (more than 1 type)
+                            old_types = result[data["label"]]["type"]
+                            data["type"].extend(old_types)
 
-                        # Remove ground types if any space type is in type
-                        if any([t in entity_types.SPACE_TYPES for t in data["type"]]):
-                            if entity_types.GROUND_OBSERVATORY in data["type"]:
-                                data["type"].remove(entity_types.GROUND_OBSERVATORY)
-                    result[data["label"]] = data
+                            # Remove ground types if any space type is in type
+                            if any([t in entity_types.SPACE_TYPES for t in data["type"]]):
+                                if entity_types.GROUND_OBSERVATORY in data["type"]:
+                                    data["type"].remove(entity_types.GROUND_OBSERVATORY)
+                        result[data["label"]] = data
 
 
             # Also get versions that were not refreshed
@@ -336,44 +396,37 @@ class WikidataExtractor(Extractor):
                 result[data["label"]] = data
             return result
             """
-            # Paralellize entity extraction if the cache already has .json files
-            # for most wikidata_uri.
-            # FIXME this may crash if there is a control_file_latest.json
-            # but there are no cached json files (too many requests). It should not
-            # be executed with a multithread in this case.
-            with ThreadPoolExecutor() as executor:
-                futures = {executor.submit(self._extract_entity,
-                                           wikidata_uri,
-                                           from_cache = True):
-                        wikidata_uri for wikidata_uri in older}
-                for future in tqdm(as_completed(futures), total = len(futures)):
-                    data = future.result()
-
-                    # Get a description from Wikipedia
-                    self._get_wikipedia_intro(data)
-
-                    if "type" not in data:
-                        data["type"] = [ent_type]
-                    else:
-                        data["type"].append(ent_type)
-                    data["type_confidence"] = 1
-                    if data["label"] in result: # Already found with another query (more than one type)
-                        if "type" in result[data["label"]]:
-                            prev_types = result[data["label"]]["type"]
-                            data["type"].extend(prev_types)
+            # Entities missing from the cache are requested by batches.
+            for wikidata_uri, data in tqdm(self._iter_entities(older,
+                                                               from_cache = True,
+                                                               with_intro = True),
+                                           total = len(older)):
+
+                if "type" not in data:
+                    data["type"] = [ent_type]
+                else:
+                    data["type"].append(ent_type)
+                data["type_confidence"] = 1
+                if data["label"] in result: # Already found with another query (more than one type)
+                    if "type" in result[data["label"]]:
+                        prev_types = result[data["label"]]["type"]
+                        data["type"].extend(prev_types)
 
-                            # Remove ground types if any space type is in type
-                            if any([t in entity_types.SPACE_TYPES for t in data["type"]]):
-                                if entity_types.GROUND_OBSERVATORY in data["type"]:
-                                    data["type"].remove(entity_types.GROUND_OBSERVATORY)
-                    if data["label"] not in result:
-                        result[data["label"]] = data
-                    else:
-                        merge_into(result[data["label"]], data)
+                        # Remove ground types if any space type is in type
+                        if any([t in entity_types.SPACE_TYPES for t in data["type"]]):
+                            if entity_types.GROUND_OBSERVATORY in data["type"]:
+                                data["type"].remove(entity_types.GROUND_OBSERVATORY)
+                if data["label"] not in result:
+                    result[data["label"]] = data
+                else:
+                    merge_into(result[data["label"]], data)
 
         # Fix errors in source
         fix(result, self)
 
+        WikidataExtractor._save_labels()
+        WikidataExtractor._save_intros()
+
         return result
 
 
@@ -399,7 +452,6 @@ class WikidataExtractor(Extractor):
         """
         Send a SPARQL query to Wikidata using requests instead of SPARQLWrapper.
         """
-        import requests
         endpoint = self._ENDPOINT_URL  # https://query.wikidata.org/sparql
 
         headers = {
@@ -412,7 +464,8 @@ class WikidataExtractor(Extractor):
             "format": "json",
         }
 
-        resp = requests.get(endpoint, headers=headers, params=params, timeout=60)
+        # Rate limited and retried on 429 by the CacheManager's pool
+        resp = CacheManager.POOL.request("GET", endpoint, headers=headers, params=params)
         resp.raise_for_status()  # lèvera une HTTPError si 403/429/5xx
 
         return resp.json()
@@ -441,7 +494,7 @@ class WikidataExtractor(Extractor):
 
 
     def _properties_to_dict(self,
-                            entity_response: str) -> dict:
+                            entity_response: str | dict) -> dict:
         """
         Transform the response of a request for a Wikidata entity
         into a dictionary compatible with the ontology merger.
@@ -451,12 +504,13 @@ class WikidataExtractor(Extractor):
         (like: sub_class_of, has_part, is_part_of, unit)
 
         Args:
-            entity_response: json string of the wikidata response of an entity
+            entity_response: json string (or dict) of the wikidata response of an entity
         """
         if not entity_response:
             return dict()
-        entities = json.loads(entity_response)
-        entities = entities["entities"]
+        if isinstance(entity_response, str):
+            entity_response = json.loads(entity_response)
+        entities = entity_response["entities"]
 
         data = dict()
         for key, value in entities.items():
@@ -497,44 +551,10 @@ class WikidataExtractor(Extractor):
 
             # Other properties
             property_items = value["claims"]
-            property_ids = {
-                "P31": "source_type", # "instance_of"
-                "P247": "COSPAR_ID", # similar to NSSDCA_ID
-                "P8913": "NSSDCA_ID", # similar to COSPAR_ID
-                "P2956": "NAIF_ID",
-                "P717": "MPC_ID", #P5736: for astronomical body
-                "P527": "has_part",
-                #"P1202": "has_part" # carries scientific instrument
-                "P361": "is_part_of",
-                "P137": "funding_agency", #operator (also in NSSDC extractor, SPASE extractor)
-                #"P17": "country", # can be found using coordinate_location
-                #"P276": "location", # same
-                "P625": "coordinate_location",
-                "P1619": "start_date", # date of official opening
-                "P571": "start_date", # time when an entity begins to exist. Not same as P1619.
-                "P2044": "altitude", # elevation above see level
-                "P619": "launch_date", # UTC date of spacecraft launch
-                "P1427": "launch_place", # start point
-                "P856": "url", # official website
-                "P131": "state", # located in the administrative territorial entity
-                "P17": "country", # country
-                #"P397": "orbites", # parent astronomical body
-                #"P1096": "orbital_eccentricity", # orbital eccentricity
-                #"P2045": "orbital_inclination", # orbital inclination
-                #"P2146": "orbital_period", # orbital period
-                #"P2233": "semimajor_axis_of_orbit", # semi-major axis of an orbit
-                #"P2243": "apoapsis",
-                #"P2244": "periapsis",
-                "P2151": "focal_length",
-                "P2386": "aperture", # diameter
-                "P2067": "mass",
-                #"P2144": "frequency", # frequency
-            }
-
             for property_id in property_items.keys():
-                if property_id in property_ids.keys():
+                if property_id in self._PROPERTY_IDS.keys():
                     # Only keep the ids mentioned above
-                    property_name = property_ids[property_id]
+                    property_name = self._PROPERTY_IDS[property_id]
                     property_data = property_items[property_id]
                     for prop in property_data:
                         property_value = ""
@@ -604,67 +624,294 @@ class WikidataExtractor(Extractor):
         return data
 
 
-    LABEL_BY_WIKIDATA_ITEM = dict()
+    # Label cache {Qxxxxxxx: label}, loaded from _LABELS_FILE
+    LABEL_BY_WIKIDATA_ITEM = None
+
+    def _labels() -> dict:
+        """
+        Get the label cache. It is loaded from its file at the first
+        call, and saved when the program exits.
+        """
+        if WikidataExtractor.LABEL_BY_WIKIDATA_ITEM is None:
+            labels = dict()
+            if os.path.exists(WikidataExtractor._LABELS_FILE):
+                with open(WikidataExtractor._LABELS_FILE, 'r', encoding = 'utf-8') as file:
+                    labels = json.load(file)
+            WikidataExtractor.LABEL_BY_WIKIDATA_ITEM = labels
+            atexit.register(WikidataExtractor._save_labels)
+        return WikidataExtractor.LABEL_BY_WIKIDATA_ITEM
+
+
+    def _save_labels():
+        if WikidataExtractor.LABEL_BY_WIKIDATA_ITEM is None:
+            return
+        WikidataExtractor._LABELS_FILE.parent.mkdir(parents = True,
+                                                    exist_ok = True)
+        with open(WikidataExtractor._LABELS_FILE, 'w', encoding = 'utf-8') as file:
+            json.dump(WikidataExtractor.LABEL_BY_WIKIDATA_ITEM, file)
+
+
+    def _item(wikidata_item: str) -> str:
+        """
+        Get the Qxxxxxxx identifier from a Wikidata item or URI,
+        or None if it is not an item (ex: unit "1").
+        """
+        items = re.findall(r"Q\d+", wikidata_item)
+        return items[0] if items else None
+
+
+    def _entity_data_url(wikidata_item: str) -> str:
+        """
+        URL of the Special:EntityData page of an item, used as its cache key.
+        """
+        return f"https://www.wikidata.org/wiki/Special:EntityData/{wikidata_item}.json"
+
+
+    def _label_from_entity(entity: dict) -> str:
+        """
+        English label of an entity json, or its first label in
+        another language if it has no English label.
+        """
+        alt_labels = []
+        for language in entity.get("labels", {}).values():
+            if language["language"] == "en":
+                return language["value"]
+            alt_labels.append(language["value"])
+        return alt_labels[0] if alt_labels else ""
+
+
     def _get_label(self,
                    wikidata_item: str) -> str:
         """
         Returns the label of a Wikidata entity or relation.
+        Use _get_labels first to get the labels of many items at once.
 
         Args:
             wikidata_item: the URI of the Wikidata entity (Qxxxxxxx)
         """
-        label = ""
-        if wikidata_item in self.LABEL_BY_WIKIDATA_ITEM:
-            label = self.LABEL_BY_WIKIDATA_ITEM[wikidata_item]
-            return label # the dict for this data is already in result dict
-        else:
-            if "wikidata" in wikidata_item:
-                wikidata_item = re.findall(r"Q\d+", wikidata_item)[0]
-            wikidata_url_json = f"https://www.wikidata.org/wiki/Special:EntityData/{wikidata_item}.json"
-            content = CacheManager.get_page(wikidata_url_json,
-                                            list_name = self.CACHE,
-                                            from_cache = True)
-            if not content:
-                return None
-            entities = json.loads(content)
-
-            entities = entities["entities"]
-
-            alt_labels = []
-            for key, value in entities.items():
-                if label:
-                    break
-                # Label & alt labels
-                labels = value["labels"]
-                for language in labels.values():
-                    lab = language["value"]
-                    lan = language["language"]
-                    if lan == "en":
-                        label = lab
-                        break
-                    else:
-                        alt_labels.append(lab)
-            if not label and alt_labels:
-                # If no English label, return the first other label.
-                label = alt_labels[0]
-
-        # Prevent requesting wikidata multiple time for
-        # the same item
-        self.LABEL_BY_WIKIDATA_ITEM[wikidata_item] = label
-
-        # Add the entity into result dict (used for classes, hasPart & isPartOf)
-        """
-        if result is not None:
-            result[label] = {"label": label,
-                             "code": wikidata_item,
-                             "url": f"https://wikidata.org/wiki/{wikidata_item}"}
-        """
-        # TODO also add the latitude & longitude.
-        # Impossible to add a type ?
-        # if spacecraft isPartOf => mission
-        # if anything else isPartOf => ground obs
-        # or if there are lat/long, then ground obs, else mission.
-        return label
+        item = WikidataExtractor._item(wikidata_item)
+        if item is None:
+            return None
+        labels = WikidataExtractor._labels()
+        if item not in labels:
+            self._get_labels([item])
+        # None if the item could not be downloaded
+        return labels.get(item)
+
+
+    def _get_labels(self,
+                    wikidata_items: list[str]):
+        """
+        Get the labels of Wikidata items into the label cache.
+        The labels are read from the items' cached pages if they exist,
+        else requested with wbgetentities (labels only) by batches.
+
+        Args:
+            wikidata_items: the Wikidata items or URIs (Qxxxxxxx)
+        """
+        labels = WikidataExtractor._labels()
+        items = {WikidataExtractor._item(item) for item in wikidata_items if item}
+        missing = []
+        for item in sorted(items - labels.keys() - {None}):
+            content = CacheManager.get_cached(WikidataExtractor._entity_data_url(item),
+                                              self.CACHE)
+            if content:
+                entities = json.loads(content)["entities"]
+                labels[item] = WikidataExtractor._label_from_entity(next(iter(entities.values()), dict()))
+            else:
+                missing.append(item)
+        for item, entity in self._get_entities(missing, props = "labels").items():
+            labels[item] = WikidataExtractor._label_from_entity(entity)
+
+
+    def _referenced_items(self,
+                          entity_response: dict) -> set[str]:
+        """
+        Items referenced by the kept properties of an entity
+        (classes, parts, units...), whose labels are needed.
+
+        Args:
+            entity_response: the wikidata response of an entity
+        """
+        items = set()
+        for entity in entity_response["entities"].values():
+            for property_id, property_data in entity.get("claims", dict()).items():
+                if property_id not in self._PROPERTY_IDS:
+                    continue
+                for prop in property_data:
+                    value = prop.get("mainsnak", dict()).get("datavalue", dict()).get("value")
+                    if isinstance(value, dict):
+                        if "id" in value:
+                            items.add(value["id"])
+                        if "unit" in value:
+                            items.add(value["unit"])
+        return items
+
+
+    def _get_entities(self,
+                      wikidata_items: list[str],
+                      props: str) -> dict[str, dict]:
+        """
+        Request Wikidata items with the wbgetentities API, _BATCH_SIZE
+        items per request. Return {item: entity json}. Items that do
+        not exist are not in the returned dict.
+
+        Args:
+            wikidata_items: the Wikidata items (Qxxxxxxx)
+            props: the parts of the entities to get (ex: labels|claims)
+        """
+        items = sorted(set(wikidata_items))
+        batches = [items[i:i + self._BATCH_SIZE]
+                   for i in range(0, len(items), self._BATCH_SIZE)]
+        entities = dict()
+        if not batches:
+            return entities
+        with ThreadPoolExecutor(max_workers = min(HTTP_WORKERS, len(batches))) as executor:
+            for batch_entities in executor.map(lambda batch: self._get_entities_batch(batch, props),
+                                               batches):
+                entities.update(batch_entities)
+        return entities
+
+
+    def _get_entities_batch(self,
+                            wikidata_items: list[str],
+                            props: str) -> dict[str, dict]:
+        """
+        Send one wbgetentities request. If an id makes the whole batch fail
+        (error with the id, ex: no-such-entity), the batch is requested
+        again without it. If the error does not name an id, the items are
+        requested one by one. Failed requests (429 and 5xx status codes)
+        are retried with a backoff by the HTTP pool (CacheManager.POOL),
+        then the batch is given up.
+
+        Args:
+            wikidata_items: at most _BATCH_SIZE Wikidata items (Qxxxxxxx)
+            props: the parts of the entities to get (ex: labels|claims)
+        """
+        url = config.WIKIDATA_HOST + self._API_PATH
+        response = CacheManager._request("GET",
+                                         url,
+                                         params = {"action": "wbgetentities",
+                                                   "ids": "|".join(wikidata_items),
+                                                   "props": props,
+                                                   "format": "json"},
+                                         headers = {"User-Agent": self._USER_AGENT})
+        content = CacheManager._response_text(url, response)
+        try:
+            response_data = json.loads(content) if content else dict()
+        except json.JSONDecodeError:
+            response_data = dict()
+        if "entities" not in response_data:
+            CacheManager._count(self.CACHE, "failures")
+            error = response_data.get("error")
+            if not error:
+                # Not an API error: the pool already retried the request
+                print(f"{len(wikidata_items)} Wikidata items could not be downloaded: " +
+                      f"status code {response.status_code}")
+                return dict()
+            invalid_item = error.get("id")
+            if invalid_item in wikidata_items:
+                print(f"Wikidata item {invalid_item} could not be downloaded: {error.get('info')}")
+                others = [item for item in wikidata_items if item != invalid_item]
+                return self._get_entities_batch(others, props) if others else dict()
+            if len(wikidata_items) == 1:
+                print(f"Wikidata item {wikidata_items[0]} could not be downloaded: {error.get('info')}")
+                return dict()
+            entities = dict()
+            for item in wikidata_items:
+                entities.update(self._get_entities_batch([item], props))
+            return entities
+        CacheManager._count(self.CACHE, "downloads")
+        CacheManager._count(self.CACHE, "bytes_downloaded", len(response.content))
+        entities = dict()
+        for key, entity in response_data["entities"].items():
+            if "missing" in entity:
+                continue
+            # Redirected items are returned with their new id
+            entities[entity.get("redirects", dict()).get("from", key)] = entity
+        return entities
+
+
+    def _get_entity_pages(self,
+                          wikidata_items: list[str],
+                          from_cache: bool) -> dict[str, dict]:
+        """
+        Get the wikidata responses of items, like the Special:EntityData
+        endpoint: {item: {"entities": {id: entity json}}}. The items that
+        are not in cache are requested by batches, and saved in cache
+        one by one (as Special:EntityData pages).
+
+        Args:
+            wikidata_items: the Wikidata items (Qxxxxxxx)
+            from_cache: whether to retrieve entities from cache
+        """
+        def cached(item: str) -> str:
+            if not from_cache:
+                return ""
+            return CacheManager.get_cached(WikidataExtractor._entity_data_url(item),
+                                           self.CACHE)
+        with ThreadPoolExecutor(max_workers = HTTP_WORKERS) as executor:
+            contents = dict(zip(wikidata_items, executor.map(cached, wikidata_items)))
+        pages = {item: json.loads(content) for item, content in contents.items() if content}
+        missing = [item for item in wikidata_items if item not in pages]
+        for item, entity in self._get_entities(missing, props = self._ENTITY_PROPS).items():
+            page = {"entities": {entity["id"]: entity}}
+            url = WikidataExtractor._entity_data_url(item)
+            CacheManager.save_cache(json.dumps(page),
+                                    CacheManager._get_cache_path(url, self.CACHE),
+                                    metadata = {"url": url,
+                                                "fetched": time.time()})
+            pages[item] = page
+        return pages
+
+
+    def _extract_entities(self,
+                          wikidata_uris: list[str],
+                          from_cache: bool,
+                          with_intro: bool = False) -> dict[str, dict]:
+        """
+        Get the data dicts of Wikidata entities {wikidata_uri: data}.
+        The entities are requested first, then the labels of all the
+        items they reference, so that both are requested by batches.
+
+        Args:
+            wikidata_uris: Wikidata URIs (or Qxxxxxxx) to retrieve
+            from_cache: whether to retrieve entities from cache
+            with_intro: also get the entities' description from Wikipedia
+        """
+        items = {wikidata_uri: wikidata_uri.split('/')[-1] for wikidata_uri in wikidata_uris}
+        pages = self._get_entity_pages(list(items.values()),
+                                       from_cache = from_cache)
+        referenced = set()
+        for page in pages.values():
+            referenced |= self._referenced_items(page)
+        self._get_labels(referenced)
+        entities = {wikidata_uri: self._properties_to_dict(pages.get(item))
+                    for wikidata_uri, item in items.items()}
+        if with_intro:
+            self._get_wikipedia_intros(entities.values(),
+                                       from_cache = from_cache)
+        return entities
+
+
+    def _iter_entities(self,
+                       wikidata_uris: list[str] | set[str],
+                       from_cache: bool,
+                       with_intro: bool = False):
+        """
+        Yield (wikidata_uri, data) for Wikidata entities, extracted
+        by chunks of _CHUNK_SIZE entities (see _extract_entities).
+
+        Args:
+            wikidata_uris: Wikidata URIs (or Qxxxxxxx) to retrieve
+            from_cache: whether to retrieve entities from cache
+            with_intro: also get the entities' description from Wikipedia
+        """
+        wikidata_uris = list(wikidata_uris)
+        for start in range(0, len(wikidata_uris), self._CHUNK_SIZE):
+            yield from self._extract_entities(wikidata_uris[start:start + self._CHUNK_SIZE],
+                                              from_cache = from_cache,
+                                              with_intro = with_intro).items()
 
 
     def _get_controls(self,
@@ -753,6 +1000,15 @@ class WikidataExtractor(Extractor):
             "P8324": "funding_agency", # funder ~= P137 (operator)
         }
         entity_prefix = "http://www.wikidata.org/entity/"
+
+        # Get the hosts' and values' labels and the instruments' entities by batches
+        self._get_labels([binding["host"]["value"] for binding in bindings] +
+                         [binding["value"]["value"] for binding in bindings
+                          if binding["value"]["value"].startswith(entity_prefix)])
+        instances = {binding["value"]["value"] for binding in bindings
+                     if binding["value"]["value"].startswith(entity_prefix) and
+                     property_ids.get(binding["property"]["value"].split("/")[-1]) == "source_type|uri"}
+        instances = dict(self._iter_entities(instances, from_cache = from_cache))
         for binding in bindings:
             data = dict()
             uri = binding["itemURI"]["value"]
@@ -766,7 +1022,7 @@ class WikidataExtractor(Extractor):
             property = property_ids.get(property.split("/")[-1], None)
             if property == "source_type|uri":
                 if value.startswith(entity_prefix):
-                    entity_dict = self._extract_entity(value.split("/")[-1], from_cache = from_cache)
+                    entity_dict = instances[value]
                     if entity_dict:
                         if "is_part_of" in entity_dict:
                             # Instance of an instrument
@@ -802,48 +1058,58 @@ class WikidataExtractor(Extractor):
                         wikidata_uri: str,
                         from_cache: bool) -> dict:
         """
-        Connect to the https://www.wikidata.org/wiki/Special:EntityData endpoint
-        to get the JSON response from the Wikidata item.
-        Returns None if the request failed.
+        Get the data dict of a Wikidata entity (see _extract_entities).
+        Returns an empty dict if the request failed.
 
         Args:
             wikidata_uri: Wikidata URI (Qxxxxxxx) to retrieve
             from_cache: whether to retrieve entities from cache
         """
-        wikidata_item = wikidata_uri.split('/')[-1]
-        wikidata_url_json = f"https://www.wikidata.org/wiki/Special:EntityData/{wikidata_item}.json"
-        content = CacheManager.get_page(wikidata_url_json,
-                                        list_name = self.CACHE,
-                                        from_cache = from_cache)
-        # CacheManager.save_cache(content, wikidata_url_json)
+        return self._extract_entities([wikidata_uri],
+                                      from_cache = from_cache)[wikidata_uri]
 
-        # Save cache for latest versions.
-        # Cache will be used when we want to merge with wikidata but
-        # there is no new version to download.
-        # Select the wikidata properties to keep and organize
-        # them in the data dict.
-        return self._properties_to_dict(content)
 
-
-    def _get_wikipedia_intro(self,
-                             data: dict) -> str:
+    def _intros() -> dict:
         """
-        Get the Wikipedia's first paragraph that describes an entity.
-        Save it in the data's description.
+        Get the Wikipedia intro cache {lang: {title: {"revid", "intro"}}}.
+        It is loaded from its file at the first call, and saved when
+        the program exits.
+        """
+        if WikidataExtractor.INTRO_BY_PAGE is None:
+            intros = dict()
+            if os.path.exists(WikidataExtractor._INTROS_FILE):
+                with open(WikidataExtractor._INTROS_FILE, 'r', encoding = 'utf-8') as file:
+                    intros = json.load(file)
+            WikidataExtractor.INTRO_BY_PAGE = intros
+            atexit.register(WikidataExtractor._save_intros)
+        return WikidataExtractor.INTRO_BY_PAGE
+
+
+    def _save_intros():
+        if WikidataExtractor.INTRO_BY_PAGE is None:
+            return
+        WikidataExtractor._INTROS_FILE.parent.mkdir(parents = True,
+                                                    exist_ok = True)
+        with open(WikidataExtractor._INTROS_FILE, 'w', encoding = 'utf-8') as file:
+            json.dump(WikidataExtractor.INTRO_BY_PAGE, file)
+
+
+    def _wikipedia_page(url: str) -> tuple[str, str]:
+        """
+        Get the language and the title of a Wikipedia page from its URL,
+        or None if it is not a Wikipedia page.
+        """
+        match = re.match(r"https?://([\w-]+)\.wikipedia\.org/wiki/([^?#]+)", url)
+        if not match:
+            return None
+        return match.group(1), unquote(match.group(2)).replace("_", " ")
 
-        Args:
-            url: the Wikidata page full url.
-        """
-        if "ext_ref" not in data:
-            return ""
-        url = data["ext_ref"]
-        if "description" in data:
-            return data["description"]
-        content = CacheManager.get_page(url,
-                                        self.CACHE)
-        if not content:
-            return ""
-        soup = BeautifulSoup(content,
+
+    def _first_paragraph(html: str) -> str:
+        """
+        Get the first non-empty paragraph of a Wikipedia page's HTML.
+        """
+        soup = BeautifulSoup(html,
                              "html.parser")
         ps = soup.find_all('p')
         for i, p in enumerate(ps):
@@ -854,11 +1120,153 @@ class WikidataExtractor(Extractor):
             if not p:
                 continue
             # Return the first non-empty paragraph
-            data["description"] = p
             return p
         return ""
 
 
+    def _query_wikipedia(self,
+                         lang: str,
+                         titles: list[str],
+                         params: dict) -> dict[str, dict]:
+        """
+        Send a query to the Wikipedia API of a language, following its
+        continuations. Return the pages' json by requested title.
+        Missing pages are not in the returned dict.
+
+        Args:
+            lang: the Wikipedia's language (ex: en)
+            titles: the pages' titles
+            params: the query's parameters (ex: {"prop": "info"})
+        """
+        url = config.WIKIPEDIA_HOST.format(lang = lang) + "/w/api.php"
+        params = {"action": "query",
+                  "titles": "|".join(titles),
+                  "redirects": 1,
+                  "format": "json",
+                  "formatversion": 2} | params
+        pages = dict()
+        targets = dict() # Normalized and redirected titles
+        while True:
+            response = CacheManager._request("GET",
+                                             url,
+                                             params = params,
+                                             headers = {"User-Agent": self._USER_AGENT})
+            content = CacheManager._response_text(url, response)
+            if not content:
+                CacheManager._count(self.CACHE, "failures")
+                break
+            CacheManager._count(self.CACHE, "downloads")
+            CacheManager._count(self.CACHE, "bytes_downloaded", len(response.content))
+            response_data = json.loads(content)
+            query = response_data.get("query", dict())
+            for target in query.get("normalized", []) + query.get("redirects", []):
+                targets[target["from"]] = target["to"]
+            for page in query.get("pages", []):
+                pages.setdefault(page["title"], dict()).update(page)
+            if "continue" not in response_data:
+                break
+            params = params | response_data["continue"]
+        result = dict()
+        for title in titles:
+            target = title
+            for _ in range(3): # Normalized, then redirected
+                target = targets.get(target, target)
+            page = pages.get(target)
+            if page and not page.get("missing") and not page.get("invalid"):
+                result[title] = page
+        return result
+
+
+    def _query_wikipedia_batches(self,
+                                 lang: str,
+                                 titles: list[str],
+                                 params: dict,
+                                 batch_size: int) -> dict[str, dict]:
+        """
+        Send _query_wikipedia by batches of titles, at the same time.
+        """
+        batches = [titles[i:i + batch_size]
+                   for i in range(0, len(titles), batch_size)]
+        pages = dict()
+        if not batches:
+            return pages
+        with ThreadPoolExecutor(max_workers = min(HTTP_WORKERS, len(batches))) as executor:
+            for batch_pages in executor.map(lambda batch: self._query_wikipedia(lang, batch, params),
+                                            batches):
+                pages.update(batch_pages)
+        return pages
+
+
+    def _get_wikipedia_intros(self,
+                              entities: list[dict],
+                              from_cache: bool = True):
+        """
+        Get the Wikipedia's first paragraph that describes entities
+        (from their ext_ref page), and save it in their description.
+        The intros are cached by language, title and revision: the
+        latest revisions of the pages are requested by batches of
+        _WIKIPEDIA_INFO_BATCH_SIZE titles, then the intros of the new and
+        modified pages by batches of _WIKIPEDIA_BATCH_SIZE titles.
+
+        Args:
+            entities: the entities' data dicts
+            from_cache: use the cached intros without checking the
+                        pages' revisions
+        """
+        intros = WikidataExtractor._intros()
+        entities_by_page = defaultdict(lambda: defaultdict(list))
+        for data in entities:
+            if "ext_ref" not in data or "description" in data:
+                continue
+            page = WikidataExtractor._wikipedia_page(data["ext_ref"])
+            if page:
+                lang, title = page
+                entities_by_page[lang][title].append(data)
+
+        for lang, entities_by_title in entities_by_page.items():
+            cached = intros.setdefault(lang, dict())
+            titles = sorted(title for title in entities_by_title
+                            if not from_cache or title not in cached)
+            # Latest revisions
+            revisions = {title: page.get("lastrevid")
+                         for title, page in self._query_wikipedia_batches(lang,
+                                                                          titles,
+                                                                          {"prop": "info"},
+                                                                          self._WIKIPEDIA_INFO_BATCH_SIZE).items()}
+            # Intros of the new and modified pages
+            modified = sorted(title for title, revid in revisions.items()
+                              if cached.get(title, dict()).get("revid") != revid)
+            pages = self._query_wikipedia_batches(lang,
+                                                  modified,
+                                                  {"prop": "extracts|info",
+                                                   "exintro": 1,
+                                                   "exlimit": self._WIKIPEDIA_BATCH_SIZE},
+                                                  self._WIKIPEDIA_BATCH_SIZE)
+            for title, page in pages.items():
+                cached[title] = {"revid": page.get("lastrevid"),
+                                 "intro": WikidataExtractor._first_paragraph(page.get("extract", ""))}
+
+            for title, entities_of_page in entities_by_title.items():
+                intro = cached.get(title, dict()).get("intro")
+                if intro:
+                    for data in entities_of_page:
+                        data["description"] = intro
+
+
+    def _get_wikipedia_intro(self,
+                             data: dict) -> str:
+        """
+        Get the Wikipedia's first paragraph that describes an entity.
+        Save it in the data's description. Use _get_wikipedia_intros
+        for many entities.
+
+        Args:
+            data: the entity's data dict
+        """
+        self._get_wikipedia_intros([data])
+        return data.get("description", "")
+
+
     def __init__(self):
         pass
 
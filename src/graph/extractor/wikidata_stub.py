@@ -0,0 +1,321 @@
+"""
+Local stand-in for the Wikidata and Wikipedia APIs, to run and test the
+Wikidata extractor offline. It implements the part of the APIs used by
+WikidataExtractor: wbgetentities (/w/api.php?action=wbgetentities),
+Special:EntityData (/wiki/Special:EntityData/Qxxxxxxx.json) and the
+Wikipedia pages' intros and revisions (/<lang>/w/api.php?action=query).
+
+Entities are replayed from a fixtures folder of recorded responses,
+one Special:EntityData response per entity (<fixtures>/Qxxxxxxx.json),
+and the Wikipedia pages from <fixtures>/wikipedia/<lang>.json
+({title: {"lastrevid": int, "extract": html}}).
+Entities that are not recorded are missing, unless an upstream server
+is set: they are then downloaded from it and recorded.
+
+Usage (from the src folder):
+    python -m graph.extractor.wikidata_stub --port 8181 --fixtures wikidata_fixtures
+    export WIKIDATA_HOST="http://localhost:8181"
+    export WIKIPEDIA_HOST="http://localhost:8181/{lang}"
+    python update.py -l wikidata
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import json
+import re
+import threading
+import time
+import requests
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+
+# Maximum number of ids of a wbgetentities request
+# and of titles of a query request (for bots)
+MAX_IDS = 50
+
+# Maximum number of intros of a query request (exlimit)
+MAX_EXTRACTS = 20
+
+
+def filter_entity(entity: dict,
+                  props: list[str],
+                  languages: list[str] = None) -> dict:
+    """
+    Keep the parts of an entity's json requested with wbgetentities.
+
+    Args:
+        entity: the entity's json (as in Special:EntityData)
+        props: the requested parts (labels, aliases, descriptions, claims,
+               sitelinks, sitelinks/urls)
+        languages: only keep the labels, aliases and descriptions
+                   in those languages. None to keep all of them.
+    """
+    result = {"type": entity.get("type", "item"),
+              "id": entity["id"]}
+    for prop in props:
+        if prop in ("labels", "aliases", "descriptions"):
+            values = entity.get(prop, dict())
+            if languages is not None:
+                values = {lang: value for lang, value in values.items()
+                          if lang in languages}
+            result[prop] = values
+        elif prop == "claims":
+            result["claims"] = entity.get("claims", dict())
+        elif prop in ("sitelinks", "sitelinks/urls"):
+            sitelinks = entity.get("sitelinks", dict())
+            if prop == "sitelinks":
+                sitelinks = {site: {k: v for k, v in sitelink.items() if k != "url"}
+                             for site, sitelink in sitelinks.items()}
+            result["sitelinks"] = sitelinks
+    return result
+
+
+class WikidataStub(ThreadingHTTPServer):
+    """
+    HTTP server answering like the Wikidata and Wikipedia APIs.
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 fixtures_dir: str | Path,
+                 host: str = "localhost",
+                 port: int = 8181,
+                 latency: float = 0.,
+                 upstream: str = None):
+        """
+        Args:
+            fixtures_dir: folder of the recorded entities (Qxxxxxxx.json)
+            host: host to listen on
+            port: port to listen on. 0 to pick a free port.
+            latency: seconds to wait before answering a request
+            upstream: url of the Wikidata server (https://www.wikidata.org).
+                      Entities that are not recorded are downloaded from it
+                      and saved in the fixtures folder.
+        """
+        super().__init__((host, port), _WikidataStubHandler)
+        self.fixtures_dir = Path(fixtures_dir)
+        self.latency = latency
+        self.upstream = upstream
+        self._lock = threading.Lock()
+        self.requests_count = 0
+        self.entities_count = 0
+
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def wait(self):
+        with self._lock:
+            self.requests_count += 1
+        time.sleep(self.latency)
+
+
+    def get_entity(self,
+                   wikidata_item: str) -> dict:
+        """
+        Get the json of a recorded entity (as in Special:EntityData),
+        or None if it is not recorded.
+
+        Args:
+            wikidata_item: the Wikidata item (Qxxxxxxx)
+        """
+        fixture = self.fixtures_dir / f"{wikidata_item}.json"
+        with self._lock:
+            self.entities_count += 1
+        if fixture.exists():
+            with open(fixture, "r", encoding = "utf-8") as file:
+                return json.load(file)
+        if not self.upstream:
+            return None
+        response = requests.get(f"{self.upstream}/wiki/Special:EntityData/{wikidata_item}.json")
+        if not response.ok:
+            return None
+        self.fixtures_dir.mkdir(parents = True, exist_ok = True)
+        with open(fixture, "w", encoding = "utf-8") as file:
+            file.write(response.text)
+        return response.json()
+
+
+    def get_wikipedia_pages(self,
+                            lang: str) -> dict:
+        """
+        Get the recorded Wikipedia pages of a language
+        {title: {"lastrevid": int, "extract": html}}.
+
+        Args:
+            lang: the Wikipedia's language (ex: en)
+        """
+        fixture = self.fixtures_dir / "wikipedia" / f"{lang}.json"
+        if not fixture.exists():
+            return dict()
+        with open(fixture, "r", encoding = "utf-8") as file:
+            return json.load(file)
+
+
+class _WikidataStubHandler(BaseHTTPRequestHandler):
+
+    server: WikidataStub
+
+    def log_message(self, format, *args):
+        pass # Do not print every request
+
+
+    def _send_json(self,
+                   status: int,
+                   data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _error(self,
+               code: str,
+               info: str,
+               **kwargs):
+        # The API answers errors with a 200 status code
+        self._send_json(200, {"error": {"code": code, "info": info, **kwargs}})
+
+
+    def do_GET(self):
+        self.server.wait()
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        entity_data = re.fullmatch(r"/wiki/Special:EntityData/(Q\d+)\.json", url.path)
+        if entity_data:
+            page = self.server.get_entity(entity_data.group(1))
+            if page is None:
+                self._send_json(404, {"error": f"{entity_data.group(1)} not found"})
+            else:
+                self._send_json(200, page)
+        elif url.path == "/w/api.php" and query.get("action") == "wbgetentities":
+            self._wbgetentities(query)
+        elif re.fullmatch(r"/[\w-]+/w/api\.php", url.path) and query.get("action") == "query":
+            self._query(url.path.split("/")[1], query)
+        else:
+            self._send_json(404, {"error": f"unknown endpoint {url.path}"})
+
+
+    def _wbgetentities(self,
+                       query: dict):
+        ids = query.get("ids", "").split("|")
+        if len(ids) > MAX_IDS:
+            self._error("toomanyvalues", f"Too many values supplied for parameter \"ids\". The limit is {MAX_IDS}.")
+            return
+        for wikidata_item in ids:
+            if not re.fullmatch(r"Q\d+", wikidata_item):
+                self._error("no-such-entity", f"Could not find an entity with the ID \"{wikidata_item}\".",
+                            id = wikidata_item)
+                return
+        props = query.get("props", "info|sitelinks|aliases|labels|descriptions|claims").split("|")
+        languages = query["languages"].split("|") if "languages" in query else None
+        entities = dict()
+        for wikidata_item in ids:
+            page = self.server.get_entity(wikidata_item)
+            if page is None:
+                entities[wikidata_item] = {"id": wikidata_item, "missing": ""}
+                continue
+            for entity in page["entities"].values():
+                entity = filter_entity(entity, props, languages)
+                if entity["id"] != wikidata_item:
+                    entity["redirects"] = {"from": wikidata_item, "to": entity["id"]}
+                entities[entity["id"]] = entity
+        self._send_json(200, {"entities": entities, "success": 1})
+
+
+    def _query(self,
+               lang: str,
+               query: dict):
+        titles = query.get("titles", "").split("|")
+        if len(titles) > MAX_IDS:
+            self._error("toomanyvalues", f"Too many values supplied for parameter \"titles\". The limit is {MAX_IDS}.")
+            return
+        recorded = self.server.get_wikipedia_pages(lang)
+        props = query.get("prop", "").split("|")
+        normalized = [{"from": title, "to": title.replace("_", " ")}
+                      for title in titles if "_" in title]
+        titles = [title.replace("_", " ") for title in titles]
+        # Intros from the excontinue-th page, at most exlimit intros
+        offset = int(query.get("excontinue", 0))
+        limit = min(int(query.get("exlimit", MAX_EXTRACTS)), MAX_EXTRACTS)
+        pages = []
+        extracts = 0
+        for i, title in enumerate(titles):
+            if title not in recorded:
+                pages.append({"ns": 0, "title": title, "missing": True})
+                continue
+            page = {"pageid": i + 1, "ns": 0, "title": title}
+            if "info" in props:
+                page["lastrevid"] = recorded[title]["lastrevid"]
+            if "extracts" in props and i >= offset and extracts < limit:
+                page["extract"] = recorded[title]["extract"]
+                extracts += 1
+            pages.append(page)
+        response = {"batchcomplete": True,
+                    "query": {"pages": pages}}
+        if normalized:
+            response["query"]["normalized"] = normalized
+        if "extracts" in props and offset + extracts < len(titles) and extracts == limit:
+            response["continue"] = {"excontinue": offset + extracts, "continue": "||"}
+            del response["batchcomplete"]
+        self._send_json(200, response)
+
+
+def main(port: int,
+         fixtures_dir: str,
+         latency: float,
+         upstream: str):
+    server = WikidataStub(fixtures_dir,
+                          port = port,
+                          latency = latency,
+                          upstream = upstream)
+    print(f"Wikidata stub listening on {server.url}. " +
+          f"Use export WIKIDATA_HOST=\"{server.url}\" to target it.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{server.requests_count} requests, {server.entities_count} entities.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog = "wikidata_stub",
+                            description = "Local stand-in for the Wikidata API, for offline runs and tests.")
+    parser.add_argument("-p",
+                        "--port",
+                        dest = "port",
+                        type = int,
+                        default = 8181,
+                        help = "Port to listen on. Default is 8181.")
+    parser.add_argument("-f",
+                        "--fixtures",
+                        dest = "fixtures_dir",
+                        required = True,
+                        help = "Folder of the recorded entities (Qxxxxxxx.json).")
+    parser.add_argument("--latency",
+                        dest = "latency",
+                        type = float,
+                        default = 0.,
+                        help = "Seconds to wait before answering a request.")
+    parser.add_argument("-u",
+                        "--upstream",
+                        dest = "upstream",
+                        default = None,
+                        help = "Wikidata server to record the missing entities from (https://www.wikidata.org).")
+    args = parser.parse_args()
+    main(args.port,
+         args.fixtures_dir,
+         args.latency,
+         args.upstream)
@@ -11,7 +11,7 @@ import inspect
 import builtins
 
 from pathlib import PosixPath
-from typing import Iterator, List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 from rdflib import Graph as G, Literal, Namespace, URIRef, XSD
 from rdflib.namespace import SKOS, DCTERMS, OWL, RDF, RDFS, PROV
 from graph import entity_types
@@ -71,6 +71,10 @@ class Graph(G):
             return
 
         self._graph = G() # instanciate rdflib.Graph
+        # Subjects by namespace, to remove a source's entities
+        # without scanning the whole graph (remove_namespace)
+        self._subjects_by_namespace = defaultdict(set)
+        self._namespaces = dict() # Bound sources' namespaces
         if filename:
             self.parse(filename)
 
@@ -118,6 +122,8 @@ class Graph(G):
         for filename in filenames:
             if os.path.exists(filename):
                 self.graph.parse(filename)
+                for subj in self.graph.subjects(unique = True):
+                    self._index_subject(subj)
                 for prefix, namespace in self.graph.namespaces():
                     if prefix in ExtractorLists.AVAILABLE_NAMESPACES:
                         input_ontology_namespaces.append(prefix)
@@ -127,6 +133,65 @@ class Graph(G):
         self._available_namespaces = input_ontology_namespaces
 
 
+    def _index_subject(self,
+                       subj: URIRef):
+        """
+        Save the subject in the index of its namespace
+        (the part of the URI before the #).
+        """
+        namespace, sep, _ = str(subj).partition('#')
+        if sep:
+            self._subjects_by_namespace[namespace + sep].add(subj)
+
+
+    def remove_namespace(self,
+                         namespace_uri: str | Namespace) -> int:
+        """
+        Remove the triples of all the subjects of a namespace
+        (ex: the entities of a source before it is updated).
+        Use the subjects' index, so that the cost is proportional
+        to the number of triples of the namespace.
+        Return the number of removed triples.
+
+        Args:
+            namespace_uri: the namespace's URI (ending with #)
+        """
+        return self.remove_subjects(self._subjects_by_namespace.pop(str(namespace_uri), set()))
+
+
+    def namespace_subjects(self,
+                           namespace_uri: str | Namespace) -> set[URIRef]:
+        """
+        Get the subjects of a namespace (ex: the entities of a source).
+
+        Args:
+            namespace_uri: the namespace's URI (ending with #)
+        """
+        return set(self._subjects_by_namespace.get(str(namespace_uri), set()))
+
+
+    def remove_subjects(self,
+                        subjects: Iterable[URIRef]) -> int:
+        """
+        Remove all the triples of the subjects (ex: the changed entities
+        of a source before they are added again).
+        Return the number of removed triples.
+
+        Args:
+            subjects: the subjects' URIs
+        """
+        removed = 0
+        for subj in subjects:
+            triples = list(self.graph.triples((subj, None, None)))
+            for triple in triples:
+                self.graph.remove(triple)
+            removed += len(triples)
+            namespace, sep, _ = str(subj).partition('#')
+            if sep:
+                self._subjects_by_namespace.get(namespace + sep, set()).discard(subj)
+        return removed
+
+
     def reset(self):
         """
         Remove the Graph in place. Allow to parse a new Graph.
@@ -409,9 +474,12 @@ class Graph(G):
             return self.WB # IVOA Messenger (WaveBand)
         elif namespace == "IVOASEM":
             return self.IVOASEM
+        if namespace in self._namespaces:
+            return self._namespaces[namespace]
         namespace_uri = Namespace(str(self.PROPERTIES.OBS)[:-1] + "/" + namespace + "#")
         # Bind namespace if not binded yet (override = False)
         self.graph.bind(namespace, namespace_uri, override = False)
+        self._namespaces[namespace] = namespace_uri
         return namespace_uri
 
 
@@ -468,6 +536,67 @@ class Graph(G):
         """
         Add a RDF triple to the graph.
         Override rdflib's Graph.add() method.
+        See _convert_triples for the conversion of the triple.
+
+        Args:
+            params: a tuple (subj, predicate, obj)
+            extractor: the extractor of the added triple (ex: AasExtractor)
+        """
+        for triple in self._convert_triples(params, extractor = extractor):
+            self.graph.add(triple)
+
+
+    def add_many(self,
+                 entities: dict[str | URIRef, dict],
+                 extractor: Extractor = None):
+        """
+        Add the data of many entities to the graph at once, like
+        {"uri1": {"label": "a", "code": "b", ...}}. The triples are
+        converted like in add(), and added with a single addN.
+
+        Args:
+            entities: the entities' data dicts by subject
+            extractor: the extractor of the added entities (ex: AasExtractor)
+        """
+        triples = set()
+        for subj, features in entities.items():
+            for predicate, obj in features.items():
+                triples.update(self._convert_triples((subj, predicate, obj),
+                                                     extractor = extractor))
+        self.graph.addN((s, p, o, self.graph) for s, p, o in triples)
+
+
+    def subject_uri(self,
+                    subj: str | URIRef,
+                    extractor: Extractor = None) -> URIRef:
+        """
+        Get the URI of an entity from its identifier in the extracted data.
+
+        Args:
+            subj: the identifier of the entity (str) or its URI
+            extractor: the extractor of the entity (ex: AasExtractor)
+        """
+        # Get the namespace of the subject
+        if extractor:
+            namespace_subj = self.get_namespace(extractor.NAMESPACE)
+        else:
+            namespace_subj = self.PROPERTIES.OBS
+
+        if type(subj) == str:
+            # Convert subject to URI with _OBS
+            return namespace_subj[standardize_uri(subj)]
+        elif type(subj) == URIRef:
+            return subj
+        else:
+            raise TypeError(f"Subject ({subj}) can only be a str or an URIRef. "
+                            + f"Got a {type(subj)}.")
+
+
+    def _convert_triples(self,
+                         params: Tuple[str, str, str],
+                         extractor: Extractor = None) -> list[Tuple]:
+        """
+        Convert a (subj, predicate, obj) tuple into the RDF triples to add.
         For conversion from a dictionary, the object type has to be specified,
         as an object can be an ontological reference (URIRef) or a value. If
         the object is a str that converts to a Literal, it will be parsed
@@ -480,6 +609,7 @@ class Graph(G):
                 obj: the object of the triple.
             extractor: the extractor of the added triple (ex: AasExtractor)
         """
+        triples = []
         if len(params) != 3:
             raise ValueError("params must be a tuple of 3 elements:\
                     subj, pred, obj")
@@ -489,22 +619,10 @@ class Graph(G):
 
         if not subj:
             # subj is "" or None
-            return
-
-        # Get the namespace of the subject
-        if extractor:
-            namespace_subj = self.get_namespace(extractor.NAMESPACE)
-        else:
-            namespace_subj = self.PROPERTIES.OBS
+            return triples
 
-        if type(subj) == str:
-            # Convert subject to URI with _OBS
-            subj_uri = namespace_subj[standardize_uri(subj)]
-        elif type(subj) == URIRef:
-            subj_uri = subj
-        else:
-            raise TypeError(f"Subject ({subj}) can only be a str or an URIRef. "
-                            + f"Got a {type(subj)}.")
+        subj_uri = self.subject_uri(subj, extractor = extractor)
+        self._index_subject(subj_uri)
 
         if predicate is None:
             raise ValueError(f"Predicate can not be None.")
@@ -543,9 +661,10 @@ class Graph(G):
                 # uri = properties.OBS["skosxl-" + str(self) + '-' +  str(self.provenance).split('#')[-1]]
                 obj_uri = obj.get_value_node()
                 if obj.provenance:
-                    self.graph.add((obj_uri, self.PROPERTIES.SKOSXL.literalForm, obj.get_literal()))
-                    self.graph.add((obj_uri, RDF.type, self.PROPERTIES.SKOSXL.Label))
-                    self.graph.add((obj_uri, PROV.wasInformedBy, obj.provenance))
+                    self._index_subject(obj_uri)
+                    triples.append((obj_uri, self.PROPERTIES.SKOSXL.literalForm, obj.get_literal()))
+                    triples.append((obj_uri, RDF.type, self.PROPERTIES.SKOSXL.Label))
+                    triples.append((obj_uri, PROV.wasInformedBy, obj.provenance))
             elif type(obj) == URIRef:
                 obj_uri = obj
             # Change object type for certain predicates
@@ -557,12 +676,12 @@ class Graph(G):
                 obj,
                 language = language,
                 extractor = extractor)
-            # Add to the graph
-            self.graph.add((subj_uri, predicate_uri, obj_uri))
+            triples.append((subj_uri, predicate_uri, obj_uri))
 
         if extractor:
             source_uri = self.PROPERTIES.OBS[standardize_uri(extractor.URI)]
-            self.graph.add((subj_uri, self.PROPERTIES.source, source_uri))
+            triples.append((subj_uri, self.PROPERTIES.source, source_uri))
+        return triples
 
 
     def add_metadata(self,
@@ -591,6 +710,35 @@ class Graph(G):
         self.graph.add((OWL.Ontology, DCTERMS.creator, Literal(author)))
 
 
+    def version_states(self) -> dict[str, str]:
+        """
+        Hash of the version of every list's entities in the ontology
+        (VersionStream.state), as {namespace: hash}.
+        """
+        states = dict()
+        for version in self.graph.objects(OWL.Ontology, DCTERMS.hasVersion):
+            namespace, _, state = str(version).partition(" ")
+            states[namespace] = state
+        return states
+
+
+    def set_version_state(self,
+                          namespace: str,
+                          state: str):
+        """
+        Save the hash of the version of a list's entities in the
+        ontology's metadata, to check it at the next incremental update.
+
+        Args:
+            namespace: the list's namespace (extractor.NAMESPACE)
+            state: the hash of the version (VersionStream.state)
+        """
+        for version in list(self.graph.objects(OWL.Ontology, DCTERMS.hasVersion)):
+            if str(version).partition(" ")[0] == namespace:
+                self.graph.remove((OWL.Ontology, DCTERMS.hasVersion, version))
+        self.graph.add((OWL.Ontology, DCTERMS.hasVersion, Literal(f"{namespace} {state}")))
+
+
 
 if __name__ == "__main__":
     pass
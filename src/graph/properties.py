@@ -272,12 +272,12 @@ class Properties():
                 attr: the attribute to convert to a URIRef.
             """
             if type(attr) == str:
-                attr = Properties._MAPPING.get(
-                    attr,
-                    self.OBS[attr])
-                if type(attr) == dict:
-                    attr = attr["pred"]
-                return attr
+                mapped = Properties._MAPPING.get(attr)
+                if mapped is None:
+                    return self.OBS[attr]
+                if type(mapped) == dict:
+                    mapped = mapped["pred"]
+                return mapped
             else:
                 return attr
 
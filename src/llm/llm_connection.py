@@ -8,11 +8,16 @@ import pickle
 import re
 import os
 import requests
+import time
 import config
-from config import OLLAMA_TEMPERATURE, LLM_CATEGORIES_FILE, LLM_EMBEDDINGS_FILE, PROMPT_SAME_DISTINCT, CACHE_DIR
+from config import OLLAMA_TEMPERATURE, LLM_CATEGORIES_FILE, LLM_EMBEDDINGS_FILE, LLM_MODELS_FILE, PROMPT_SAME_DISTINCT, CACHE_DIR
+from config import LLM_EMBEDDING_WORKERS
 from collections import defaultdict
 from graph.entity_types import *
+from graph.extractor.http_pool import HttpPool
 from graph.properties import Properties
+from llm.prompt_builder import PromptBuilder
+from llm.llm_stats import LLMStats
 
 
 class LLMConnection():
@@ -24,30 +29,70 @@ class LLMConnection():
     #_instance = None
     _initialized = False
 
+    _context_length = dict()
+    _llm_categories = dict()
+    _llm_embeddings = dict()
+
     # Singleton
     def __new__(cls, *args, **kwds):
-        #if not cls._instance and not cls._initialized:
-        cls._context_length = dict()
-        cls._llm_categories = dict()
-        cls._llm_embeddings = dict()
+        # Caches are class attributes: they are kept between instantiations.
         cls._initialized = True
-
         return cls # ._instance
 
 
+    @classmethod
+    def _load_llm_models(cls):
+        """
+        Load the models' metadata (context length) from a json file in
+        the cache folder, to prevent calling /api/show in every run.
+        """
+        if not LLM_MODELS_FILE.exists():
+            return dict()
+        with open(LLM_MODELS_FILE, "r", encoding = "utf-8") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return dict()
+
+
+    @classmethod
+    def _save_llm_model(cls,
+                        ollama_model: str,
+                        metadata: dict):
+        """
+        Add or replace a model's metadata in the models' json file.
+
+        Args:
+            ollama_model: the model's key (Ollama host and model name).
+            metadata: the model's metadata (context length, architecture).
+        """
+        models = cls._load_llm_models()
+        models[ollama_model] = metadata
+        LLM_MODELS_FILE.parent.mkdir(parents = True, exist_ok = True)
+        with open(LLM_MODELS_FILE, "w", encoding = "utf-8") as f:
+            json.dump(models, f, indent = 2)
+
+
     @classmethod
     def _get_llm_context_length(cls,
                                 ollama_model: str) -> int:
         """
         Get the context length of a model. A context length is the prompt's
-        maximal length.
+        maximal length in tokens. It is saved in the cache folder, for the
+        model on the current Ollama host (a stub or another server can
+        serve a model with the same name).
 
         Args:
             ollama_model: the model name.
         """
+        model_key = f"{config.OLLAMA_HOST} {ollama_model}"
+        context_length = cls._context_length.get(model_key, 0)
+        if context_length:
+            return context_length
 
-        context_length = cls._context_length.get(ollama_model, 0)
+        context_length = cls._load_llm_models().get(model_key, {}).get("context_length", 0)
         if context_length:
+            cls._context_length[model_key] = context_length
             return context_length
 
         response = requests.post(
@@ -60,7 +105,10 @@ class LLMConnection():
             infos = response.json()['model_info']
             architecture = infos['general.architecture']
             context_length = infos[architecture + '.context_length']
-            cls._context_length[ollama_model] = context_length
+            cls._context_length[model_key] = context_length
+            cls._save_llm_model(model_key,
+                                {"architecture": architecture,
+                                 "context_length": context_length})
         except KeyError:
             print(response.json()['error'])
             print("To download an Ollama model, use 'ollama pull [model_name]'.")
@@ -123,6 +171,14 @@ class LLMConnection():
                 cls._llm_embeddings = dict()
 
 
+    # Instruction prepended to every text to embed
+    _EMBEDDING_PREFIX = "Represent this entity for search: "
+
+    # Batched embedding requests, retried on 429 and 5xx status codes
+    _POOL = HttpPool(max_connections = LLM_EMBEDDING_WORKERS,
+                     requests_per_second = -1,
+                     timeout = None)
+
     @classmethod
     def embed(cls,
               text: str,
@@ -143,8 +199,10 @@ class LLMConnection():
         if (from_cache and cls._llm_embeddings):
             embeddings = cls._llm_embeddings.get(cache_key, None)
             if embeddings:
+                LLMStats.record_cache_hit("embed")
                 return embeddings # if error, re-compute.
-        prompt = "Represent this entity for search: " + text
+        prompt = cls._EMBEDDING_PREFIX + text
+        start = time.perf_counter()
         response = requests.post(
             f"{config.OLLAMA_HOST}/api/embeddings",
             json={
@@ -152,6 +210,8 @@ class LLMConnection():
                 "prompt": prompt
                 }
         )
+        LLMStats.record_call("embed", time.perf_counter() - start, prompt,
+                             error = not response.ok)
         if response.ok:
             embeddings = response.json()["embedding"]
             cls._llm_embeddings[cache_key] = embeddings
@@ -161,7 +221,44 @@ class LLMConnection():
             print(f"Ollama error: {response.text}.\nReturn None for prompt \"{prompt}\"")
             return None
 
- 
+
+    @classmethod
+    def embed_batch(cls,
+                    texts: list[str],
+                    model: str = None) -> list[list[float]]:
+        """
+        Get the embeddings of a batch of texts in a single request.
+        /api/embed accepts a list of inputs and returns one vector
+        per input, in the same order. The request is retried with a
+        backoff on 429 and 5xx status codes (HttpPool).
+
+        Args:
+            texts: the textual representations of entities to embed.
+            model: the model to use. Default is config.OLLAMA_MODEL.
+        """
+        if model is None:
+            model = config.OLLAMA_MODEL
+        inputs = [cls._EMBEDDING_PREFIX + text for text in texts]
+        start = time.perf_counter()
+        response = cls._POOL.request(
+            "POST",
+            f"{config.OLLAMA_HOST}/api/embed",
+            json={
+                "model": model,
+                "input": inputs
+                }
+        )
+        LLMStats.record_call("embed_batch", time.perf_counter() - start,
+                             "\n".join(inputs), error = not response.ok)
+        if response.ok:
+            return response.json()["embeddings"]
+        try:
+            error = response.json()["error"]
+        except (ValueError, KeyError, TypeError):
+            error = response.text # Not an Ollama error (ex: proxy)
+        raise requests.ConnectionError(f"Ollama error (status code {response.status_code}): {error}")
+
+
     # Labels used to classify entities with the model to project's labels
     _categories_by_descriptions = {"ground observatory": GROUND_OBSERVATORY,
                                    "research institute": GROUND_OBSERVATORY,
@@ -218,6 +315,7 @@ class LLMConnection():
             cache_key and cache_key in cls._llm_categories):
             category = cls._llm_categories[cache_key]
             if category != UFO:
+                LLMStats.record_cache_hit("classify")
                 return category # if error, re-compute.
 
         if not choices:
@@ -250,18 +348,19 @@ class LLMConnection():
             prompt += "If you are unsure, always return unknown. "
             prompt += "If you lack information in the text to classify, always return unknown. "
 
-        # Categories
-        prompt += f"Categories : \n-{'\n-'.join(llm_choices)}\n\n"
+        # Categories (sorted to keep the same prefix between calls)
+        prompt += f"Categories : \n-{'\n-'.join(sorted(llm_choices))}\n\n"
 
         # Entity representation
-        prompt += f"Text to classify: {text}"
-
-        context_length = cls._get_llm_context_length(config.OLLAMA_MODEL)
-        if len(prompt) > context_length:
-            prompt = prompt[:context_length]
+        num_predict = 256
+        prompt = PromptBuilder.build("classify",
+                                     instructions = prompt,
+                                     sections = [("Text to classify: ", text)],
+                                     context_length = cls._get_llm_context_length(config.OLLAMA_MODEL),
+                                     reserved_tokens = num_predict)
 
         # Get the category from the LLM
-        cat = cls.generate(prompt, config.OLLAMA_MODEL, from_cache = from_cache, cache_key = cache_key)
+        cat = cls.generate(prompt, config.OLLAMA_MODEL, num_predict = num_predict, from_cache = from_cache, cache_key = cache_key, purpose = "classify")
         cat = cat.lstrip('-').lstrip()
         cat = cat.split("\n")[0] # Some models (such as Gemma) return more than one category
         if cat in cls._categories_by_descriptions:
@@ -440,7 +539,8 @@ Entity:
                  model: str,
                  num_predict: int = 256,
                  from_cache: bool = True,
-                 cache_key: str = None) -> str:
+                 cache_key: str = None,
+                 purpose: str = "generate") -> str:
 
         """
         Send a simple generate query to the Ollama API.
@@ -451,6 +551,7 @@ Entity:
             num_predict: maximum length of the predicted message.
             from_cache: if True, also use a cache_key.
             cache_key: identifier to use to retrieve the response in later runs.
+            purpose: call type, used to group the calls in the LLM report.
         """
         if from_cache:
             if not cache_key:
@@ -458,8 +559,10 @@ Entity:
             cls._load_generation_cache(model)
             response = cls._generation_cache.get(cache_key, None)
             if response:
+                LLMStats.record_cache_hit(purpose)
                 return response
 
+        start = time.perf_counter()
         response = requests.post(
             f'{config.OLLAMA_HOST}/api/generate',
             json={
@@ -470,13 +573,16 @@ Entity:
                 'num_predict': num_predict,
             }
         )
+        latency = time.perf_counter() - start
         if response.ok:
             response = response.json()['response'].strip()
+            LLMStats.record_call(purpose, latency, prompt, response)
             response = cls.remove_tags(response)
             if from_cache:
                 cls._add_to_generation_cache(cache_key, response)
             return response
         else:
+            LLMStats.record_call(purpose, latency, prompt, error = True)
             raise requests.ConnectionError(response.json()["error"])
 
 
@@ -532,7 +638,8 @@ Entity:
         while not res and not justification:
             try:
                 response = cls.generate(prompt,
-                                        model = config.OLLAMA_MODEL)
+                                        model = config.OLLAMA_MODEL,
+                                        purpose = "best_candidate")
                 best, justification = re.findall(regex, response, re.DOTALL | re.IGNORECASE)[0]
                 best = int(best)
                 print(best, justification)
@@ -544,6 +651,7 @@ Entity:
                 "Reformulate it to fit this format:\n" + "\n" + \
                 "match: ...\njustification: ..."
                 ""
+                LLMStats.record_retry("best_candidate")
                 retries -= 1
                 total_retries += 1
         """"
@@ -565,6 +673,10 @@ Entity:
         """
         return response
 
+    # Fields that are not sent to the LLM to validate a candidate pair
+    SAME_DISTINCT_EXCLUDE = ["code", "url", "ext_ref", "uri", "type", "type_confidence", "location_confidence", "modified", "deprecated", "source", "exact_match", "latitude", "longitude", "has_part", "is_part_of", "prior_id"]
+    NARROW_BROAD_EXCLUDE = ["code", "url", "uri", "ext_ref", "type_confidence", "location_confidence", "modified", "deprecated", "source", "exact_match", "latitude", "longitude", "has_part", "is_part_of", "prior_id"]
+
     _cache_same_distinct_loaded = False
     _cache_same_distinct = defaultdict(lambda: defaultdict(tuple[bool, str]))
     @classmethod
@@ -615,16 +727,22 @@ Entity:
                 if entity1.uri in cls._cache_same_distinct[entity2.uri]:
                     return cls._cache_same_distinct[entity2.uri][entity1.uri]
         """
-        to_exclude = ["code", "url", "ext_ref", "uri", "type", "type_confidence", "location_confidence", "modified", "deprecated", "source", "exact_match", "latitude", "longitude", "has_part", "is_part_of", "prior_id"]
-        prompt = PROMPT_SAME_DISTINCT
-        prompt += "\nEntity 1: " + entity1.to_string(exclude = to_exclude, limit = 200)
-        prompt += "\nEntity 2: " + entity2.to_string(exclude = to_exclude, limit = 200)
-        prompt1 = prompt
-        retries = 3
+        cache_key = ' '.join(sorted([entity1.uri, entity2.uri]))
         if from_cache:
-            cache_key = ' '.join(sorted([entity1.uri, entity2.uri]))
             if cache_key in cls._cache_same_distinct:
+                LLMStats.record_cache_hit("same_distinct")
                 return cls._cache_same_distinct[cache_key]
+        to_exclude = cls.SAME_DISTINCT_EXCLUDE
+        num_predict = 256
+        # Keep room for the malformated answer added to the prompt on retry
+        prompt = PromptBuilder.build("same_distinct",
+                                     instructions = PROMPT_SAME_DISTINCT,
+                                     sections = [("\nEntity 1: ", entity1.to_string(exclude = to_exclude, limit = 200)),
+                                                 ("\nEntity 2: ", entity2.to_string(exclude = to_exclude, limit = 200))],
+                                     context_length = cls._get_llm_context_length(config.OLLAMA_MODEL),
+                                     reserved_tokens = 2 * num_predict)
+        prompt1 = prompt
+        retries = 3
         total_retries = 0
         regex = r"(response:)?[\s\n]*(.*)[\s\n]*justification:[\s\n]*(.*)"
         regex = r".*[\s\n]*(same|distinct).*?justification[\s\n\*:]*(.*)"
@@ -665,7 +783,8 @@ Entity:
                 response = cls.generate(prompt1,
                                         model = config.OLLAMA_MODEL,
                                         from_cache = from_cache,
-                                        cache_key = cache_key)
+                                        cache_key = cache_key,
+                                        purpose = "same_distinct")
                 print("response:")
                 print("-----")
                 print(response)
@@ -701,6 +820,7 @@ Entity:
                 ""
                 print(response)
                 print(f"Malformated LLM response. Retry {retries}.")
+                LLMStats.record_retry("same_distinct")
                 retries -= 1
                 total_retries += 1
 
@@ -708,7 +828,8 @@ Entity:
     @classmethod
     def validate_same_distinct_narrow_broad(cls,
                                             entity1,
-                                            entity2) -> tuple[int, str]:
+                                            entity2,
+                                            from_cache: bool = True) -> tuple[int, str]:
         """
         Returns:
             A tuple with an int value corresponding to
@@ -722,8 +843,10 @@ Entity:
         Args:
             entity1: first entity
             entity2: compared entity
+            from_cache: save LLMs responses into a cache.
+                        Use responses from previous calls.
         """
-        to_exclude = ["code", "url", "uri", "ext_ref", "type_confidence", "location_confidence", "modified", "deprecated", "source", "exact_match", "latitude", "longitude", "has_part", "is_part_of", "prior_id"]
+        to_exclude = cls.NARROW_BROAD_EXCLUDE
         languages = ["en", "fr", "ca", "es", "de"]
         prompt = "Say weither those two entities are the same, distinct, broad, narrow.\n" \
         "Examples:\n" \
@@ -734,21 +857,28 @@ Entity:
         "response: distinct. justification: Mauna Kea and Mauna Loa observatories are distinct observatories. The second entity is an infrastructure that is part of the Mauna Loa observatory. Therefore, it is not related to the Mauna Kea observatory.\n" \
         "response: broad. justification:the first entity (APOLLO 1) seems to be part of the second entity (APOLLO program) as APOLLO 1 is described to be the first of three APOLLO missions. therefore, entity2 is the broader entity of entity1.\n" + \
         "response: distinct. justification: entity1 is a telescope that is located at the observatory described in entity2. therefore, they are related but distinct entities.\n" + \
-        "response: same. justification: DEEP SPACE 1, VIKING 2 ORBITER (labels of entity1), are two different names for ds1 (entity2).\n" + \
-        "\nEntity 1: " + entity1.to_string(exclude = to_exclude, languages = languages) + \
-        "\nEntity 2: " + entity2.to_string(exclude = to_exclude, languages = languages)
+        "response: same. justification: DEEP SPACE 1, VIKING 2 ORBITER (labels of entity1), are two different names for ds1 (entity2).\n"
+        num_predict = 256
+        prompt = PromptBuilder.build("same_distinct_narrow_broad",
+                                     instructions = prompt,
+                                     sections = [("\nEntity 1: ", entity1.to_string(exclude = to_exclude, languages = languages)),
+                                                 ("\nEntity 2: ", entity2.to_string(exclude = to_exclude, languages = languages))],
+                                     context_length = cls._get_llm_context_length(config.OLLAMA_MODEL),
+                                     reserved_tokens = 2 * num_predict)
 
         prompt1 = prompt
         regex = r"response:\s*(.*)\s*justification:\s*(.*)"
         retries = 3
         total_retries = 0
-        cache_key = '|'.join(sorted([entity1.uri, entity2.uri]))
+        # Not sorted: the reversed pair is broad instead of narrow
+        cache_key = '|'.join([entity1.uri, entity2.uri])
         while retries > 0:
             try:
                 response = cls.generate(prompt1,
                                         model = config.OLLAMA_MODEL,
-                                        from_cache = True,
-                                        cache_key = cache_key)
+                                        from_cache = from_cache,
+                                        cache_key = cache_key,
+                                        purpose = "same_distinct_narrow_broad")
                 relation, justification = re.findall(regex, response, re.DOTALL | re.IGNORECASE)[0]
                 relation = relation.lower()
                 if "same" in relation:
@@ -771,6 +901,7 @@ Entity:
                 ""
                 print(response)
                 print(f"Malformated LLM response. Retry {retries}.")
+                LLMStats.record_retry("same_distinct_narrow_broad")
                 retries -= 1
                 total_retries += 1
 
@@ -0,0 +1,177 @@
+"""
+Instrumentation of the LLM calls. Every request sent to Ollama is recorded
+with its purpose (classify, same_distinct, label...), so that we know where
+the LLM time goes in a run. The report is saved as a json file next to the
+output ontology.
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import json
+import threading
+import numpy as np
+
+from collections import defaultdict
+from pathlib import Path
+from llm.prompt_builder import count_tokens
+
+
+class LLMStats():
+    """
+    Class-level counters, shared by all the LLMConnection calls of a run.
+    """
+
+    _stats = defaultdict(lambda: {"calls": 0,
+                                  "cache_hits": 0,
+                                  "errors": 0,
+                                  "retries": 0,
+                                  "latencies": [],
+                                  "prompt_chars": 0,
+                                  "prompt_tokens": 0,
+                                  "response_chars": 0})
+
+    # Embeddings are requested from a thread pool
+    _lock = threading.Lock()
+
+
+    @classmethod
+    def record_call(cls,
+                    purpose: str,
+                    latency: float,
+                    prompt: str,
+                    response: str = "",
+                    error: bool = False):
+        """
+        Record a request sent to the LLM.
+
+        Args:
+            purpose: the call type (classify, same_distinct, label...)
+            latency: duration of the request in seconds
+            prompt: the prompt sent to the LLM
+            response: the LLM's response
+            error: True if the LLM returned an error
+        """
+        with cls._lock:
+            stats = cls._stats[purpose]
+            stats["calls"] += 1
+            stats["latencies"].append(latency)
+            stats["prompt_chars"] += len(prompt)
+            stats["prompt_tokens"] += count_tokens(prompt)
+            stats["response_chars"] += len(response)
+            if error:
+                stats["errors"] += 1
+
+
+    @classmethod
+    def record_cache_hit(cls,
+                         purpose: str):
+        """
+        Record a call that was answered from the cache.
+
+        Args:
+            purpose: the call type
+        """
+        with cls._lock:
+            cls._stats[purpose]["cache_hits"] += 1
+
+
+    @classmethod
+    def record_retry(cls,
+                     purpose: str):
+        """
+        Record a retry after a malformated response.
+
+        Args:
+            purpose: the call type
+        """
+        with cls._lock:
+            cls._stats[purpose]["retries"] += 1
+
+
+    @classmethod
+    def calls(cls,
+              purpose: str) -> int:
+        """
+        Number of requests sent to the LLM for a purpose.
+
+        Args:
+            purpose: the call type
+        """
+        with cls._lock:
+            return cls._stats[purpose]["calls"] if purpose in cls._stats else 0
+
+
+    @classmethod
+    def report(cls) -> dict:
+        """
+        Get the statistics per purpose, and for all purposes.
+        Latencies are in seconds, lengths are means per call.
+        """
+        report = dict()
+        with cls._lock:
+            stats_by_purpose = dict(cls._stats)
+            if len(stats_by_purpose) > 1:
+                total = defaultdict(int)
+                total["latencies"] = []
+                for stats in stats_by_purpose.values():
+                    for key, value in stats.items():
+                        total[key] += value
+                stats_by_purpose["total"] = total
+            for purpose, stats in stats_by_purpose.items():
+                calls = stats["calls"]
+                requests = calls + stats["cache_hits"]
+                latencies = stats["latencies"]
+                report[purpose] = {
+                    "calls": calls,
+                    "cache_hits": stats["cache_hits"],
+                    "cache_hit_rate": stats["cache_hits"] / requests if requests else 0,
+                    "retries": stats["retries"],
+                    "errors": stats["errors"],
+                    "latency": {
+                        "total": float(sum(latencies)),
+                        "mean": float(np.mean(latencies)) if latencies else 0,
+                        "p50": float(np.percentile(latencies, 50)) if latencies else 0,
+                        "p90": float(np.percentile(latencies, 90)) if latencies else 0,
+                        "p99": float(np.percentile(latencies, 99)) if latencies else 0,
+                    },
+                    "prompt_chars": stats["prompt_chars"] / calls if calls else 0,
+                    "prompt_tokens": stats["prompt_tokens"] / calls if calls else 0,
+                    "response_chars": stats["response_chars"] / calls if calls else 0,
+                }
+        return report
+
+
+    @classmethod
+    def summary(cls) -> str:
+        """
+        One line summary for the tqdm progress bars.
+        """
+        with cls._lock:
+            calls = sum(s["calls"] for s in cls._stats.values())
+            hits = sum(s["cache_hits"] for s in cls._stats.values())
+            retries = sum(s["retries"] for s in cls._stats.values())
+            latencies = [l for s in cls._stats.values() for l in s["latencies"]]
+        if not calls and not hits:
+            return "llm: no call"
+        p50 = np.percentile(latencies, 50) if latencies else 0
+        return (f"llm: {calls} calls, {hits / (calls + hits):.0%} cached, " +
+                f"p50 {p50:.1f}s, {retries} retries")
+
+
+    @classmethod
+    def write_report(cls,
+                     filename: str | Path):
+        """
+        Save the report as a json file. Nothing is written if
+        there was no LLM call in the run.
+
+        Args:
+            filename: the output json file
+        """
+        report = cls.report()
+        if not report:
+            return
+        Path(filename).parent.mkdir(parents = True, exist_ok = True)
+        with open(filename, "w", encoding = "utf-8") as file:
+            json.dump(report, file, indent = 2)
+        print(f"LLM calls report saved in {filename}.")
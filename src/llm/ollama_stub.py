@@ -0,0 +1,356 @@
+"""
+Local stand-in for the Ollama server, to run and benchmark the pipeline
+without a GPU. It implements the part of the Ollama API used by
+LLMConnection (/api/generate, /api/embeddings, /api/embed, /api/show).
+
+Responses are replayed from a replay file if the prompt was recorded,
+otherwise they are generated deterministically from the prompt. A replay
+file is recorded by running the stub in front of a real Ollama server
+(--upstream). Latency and errors can be injected to measure the
+behaviour of the callers (retries, concurrency, caches).
+
+Usage (from the src folder):
+    python -m llm.ollama_stub --port 11435 --latency 0.5 --error-rate 0.05
+    export OLLAMA_HOST="http://localhost:11435"
+    python map_ontologies.py -i input_ontology.ttl
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import numpy as np
+import requests
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+def prompt_key(model: str,
+               prompt: str) -> str:
+    """
+    Key of a prompt in the replay file.
+
+    Args:
+        model: the model the prompt was sent to
+        prompt: the prompt
+    """
+    return hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def _tokens(text: str) -> set[str]:
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def fake_generation(prompt: str) -> str:
+    """
+    Deterministic response for a prompt that was not recorded.
+    The response follows the format expected by LLMConnection's
+    parsers for every call type, so that the pipeline can run through.
+
+    Args:
+        prompt: the prompt sent to the LLM
+    """
+    digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+
+    # classify
+    if "Categories :" in prompt:
+        categories = re.findall(r"^-(.+)$", prompt, flags = re.MULTILINE)
+        if categories:
+            return categories[digest % len(categories)]
+
+    # validate_same_distinct(_narrow_broad): same if the first lines
+    # of the entities share most of their words.
+    entities = re.findall(r"\nEntity [12]: (.*)", prompt)
+    if len(entities) == 2:
+        tokens1, tokens2 = _tokens(entities[0]), _tokens(entities[1])
+        union = tokens1 | tokens2
+        similarity = len(tokens1 & tokens2) / len(union) if union else 0
+        relation = "same" if similarity >= 0.5 else "distinct"
+        return (f"response: {relation}. justification: the labels have " +
+                f"a similarity of {similarity:.2f}.")
+
+    # choose_best_candidate_and_justify
+    if prompt.startswith("Choose the best candidate"):
+        return "match: -1\njustification: no candidate was recorded."
+
+    # label, definition: the last line of the prompt (end of the entity)
+    lines = [line for line in prompt.split("\n") if line.strip()]
+    return lines[-1].strip()[:200] if lines else ""
+
+
+def fake_embedding(text: str,
+                   dim: int) -> list[float]:
+    """
+    Deterministic unit vector for a text.
+
+    Args:
+        text: the text to embed
+        dim: dimension of the vector
+    """
+    seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class OllamaStub(ThreadingHTTPServer):
+    """
+    HTTP server answering like an Ollama server.
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 host: str = "localhost",
+                 port: int = 11435,
+                 latency: float = 0.,
+                 jitter: float = 0.,
+                 error_rate: float = 0.,
+                 replay_file: str | Path = None,
+                 upstream: str = None,
+                 context_length: int = 8192,
+                 embedding_dim: int = 768,
+                 seed: int = 0):
+        """
+        Args:
+            host: host to listen on
+            port: port to listen on. 0 to pick a free port.
+            latency: seconds to wait before answering a request
+            jitter: maximum random seconds added to the latency
+            error_rate: probability to answer a request with an error (500)
+            replay_file: json file of recorded responses {prompt_key: response}
+            upstream: url of a real Ollama server. Prompts that are not in
+                      the replay file are forwarded to it and recorded.
+            context_length: context length returned by /api/show
+            embedding_dim: dimension of the embeddings
+            seed: seed of the latency jitter and of the injected errors
+        """
+        super().__init__((host, port), _OllamaStubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.upstream = upstream
+        self.context_length = context_length
+        self.embedding_dim = embedding_dim
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.replay_file = Path(replay_file) if replay_file else None
+        self.replay = dict()
+        if self.replay_file and self.replay_file.exists():
+            with open(self.replay_file, "r", encoding = "utf-8") as file:
+                self.replay = json.load(file)
+        self.requests_count = 0
+        self.errors_count = 0
+        self.replayed_count = 0
+
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def wait(self) -> bool:
+        """
+        Sleep for the configured latency. Return True if an
+        error must be injected for this request.
+        """
+        with self._lock:
+            self.requests_count += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            error = self._random.random() < self.error_rate
+            if error:
+                self.errors_count += 1
+        time.sleep(delay)
+        return error
+
+
+    def generate(self,
+                 model: str,
+                 prompt: str,
+                 request: dict) -> str:
+        """
+        Get the response for a prompt: replayed, forwarded
+        to the upstream server, or generated.
+
+        Args:
+            model: the requested model
+            prompt: the prompt
+            request: the request's json, forwarded to the upstream server
+        """
+        key = prompt_key(model, prompt)
+        with self._lock:
+            if key in self.replay:
+                self.replayed_count += 1
+                return self.replay[key]
+        if self.upstream:
+            response = requests.post(f"{self.upstream}/api/generate", json = request)
+            response.raise_for_status()
+            response = response.json()["response"]
+            with self._lock:
+                self.replay[key] = response
+            return response
+        return fake_generation(prompt)
+
+
+    def save_replay(self):
+        """
+        Save the recorded responses in the replay file.
+        """
+        if not self.replay_file or not self.upstream:
+            return
+        self.replay_file.parent.mkdir(parents = True, exist_ok = True)
+        with self._lock:
+            with open(self.replay_file, "w", encoding = "utf-8") as file:
+                json.dump(self.replay, file, indent = 2)
+        print(f"Saved {len(self.replay)} responses in {self.replay_file}.")
+
+
+    def server_close(self):
+        self.save_replay()
+        super().server_close()
+
+
+class _OllamaStubHandler(BaseHTTPRequestHandler):
+
+    server: OllamaStub
+
+    def log_message(self, format, *args):
+        pass # Do not print every request
+
+
+    def _send_json(self,
+                   status: int,
+                   data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+        if self.path in ("/", "/api/version"):
+            self._send_json(200, {"version": "stub"})
+        else:
+            self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+        model = request.get("model", "")
+        if self.path == "/api/show":
+            self._send_json(200, {"model_info": {
+                "general.architecture": "stub",
+                "stub.context_length": self.server.context_length}})
+            return
+        if self.server.wait():
+            self._send_json(500, {"error": "injected error (ollama stub)"})
+            return
+        dim = self.server.embedding_dim
+        if self.path == "/api/generate":
+            prompt = request.get("prompt", "")
+            try:
+                response = self.server.generate(model, prompt, request)
+            except requests.RequestException as e:
+                self._send_json(502, {"error": f"upstream error: {e}"})
+                return
+            self._send_json(200, {"model": model,
+                                  "response": response,
+                                  "done": True})
+        elif self.path == "/api/embeddings":
+            self._send_json(200, {"embedding": fake_embedding(request.get("prompt", ""), dim)})
+        elif self.path == "/api/embed":
+            inputs = request.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._send_json(200, {"model": model,
+                                  "embeddings": [fake_embedding(text, dim) for text in inputs]})
+        else:
+            self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+
+def main(port: int,
+         latency: float,
+         jitter: float,
+         error_rate: float,
+         replay_file: str,
+         upstream: str,
+         context_length: int):
+    server = OllamaStub(port = port,
+                        latency = latency,
+                        jitter = jitter,
+                        error_rate = error_rate,
+                        replay_file = replay_file,
+                        upstream = upstream,
+                        context_length = context_length)
+    print(f"Ollama stub listening on {server.url}. " +
+          f"Use export OLLAMA_HOST=\"{server.url}\" to target it.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{server.requests_count} requests, {server.replayed_count} replayed, " +
+              f"{server.errors_count} injected errors.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog = "ollama_stub",
+                            description = "Local stand-in for the Ollama API, for offline runs and benchmarks.")
+    parser.add_argument("-p",
+                        "--port",
+                        dest = "port",
+                        type = int,
+                        default = 11435,
+                        help = "Port to listen on. Default is 11435.")
+    parser.add_argument("--latency",
+                        dest = "latency",
+                        type = float,
+                        default = 0.,
+                        help = "Seconds to wait before answering a request.")
+    parser.add_argument("--jitter",
+                        dest = "jitter",
+                        type = float,
+                        default = 0.,
+                        help = "Maximum random seconds added to the latency.")
+    parser.add_argument("--error-rate",
+                        dest = "error_rate",
+                        type = float,
+                        default = 0.,
+                        help = "Probability to answer a request with an error.")
+    parser.add_argument("-r",
+                        "--replay-file",
+                        dest = "replay_file",
+                        default = None,
+                        help = "Json file of recorded responses.")
+    parser.add_argument("-u",
+                        "--upstream",
+                        dest = "upstream",
+                        default = None,
+                        help = "Url of an Ollama server to record responses from, into the replay file.")
+    parser.add_argument("--context-length",
+                        dest = "context_length",
+                        type = int,
+                        default = 8192,
+                        help = "Context length returned for every model. Default is 8192.")
+    args = parser.parse_args()
+    main(args.port,
+         args.latency,
+         args.jitter,
+         args.error_rate,
+         args.replay_file,
+         args.upstream,
+         args.context_length)
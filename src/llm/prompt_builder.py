@@ -0,0 +1,137 @@
+"""
+Build prompts that fit in the model's context length.
+Lengths are counted in (approximate) tokens instead of characters, and the
+budget left after the instructions is shared between the entities, so that
+an entity's text is truncated instead of being cut from the prompt.
+
+The instructions are always sent first and never modified, so that the
+prompt prefix is byte-identical between calls and the Ollama server can reuse
+its prompt (KV) cache for it.
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import math
+import re
+from collections import defaultdict
+
+
+# Words (split in chunks of ~4 characters), numbers and punctuation.
+# BPE tokenizers split long words in several tokens and
+# punctuation in single tokens.
+_TOKEN_REGEX = re.compile(r"\w+|[^\w\s]", flags = re.UNICODE)
+_CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate the number of tokens of a text.
+    This over-estimates the count of most tokenizers on English text,
+    which is safer when computing a budget.
+
+    Args:
+        text: the text to count tokens for
+    """
+    return sum(math.ceil(len(piece) / _CHARS_PER_TOKEN)
+               for piece in _TOKEN_REGEX.findall(text))
+
+
+def truncate_to_tokens(text: str,
+                       max_tokens: int) -> str:
+    """
+    Cut a text after max_tokens (approximate) tokens.
+    The text is cut between two tokens.
+
+    Args:
+        text: the text to truncate
+        max_tokens: maximum number of tokens to keep
+    """
+    if max_tokens <= 0:
+        return ""
+    n_tokens = 0
+    for match in _TOKEN_REGEX.finditer(text):
+        n_tokens += math.ceil(len(match.group()) / _CHARS_PER_TOKEN)
+        if n_tokens > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+class PromptBuilder():
+    """
+    Keeps the prompt token counts per purpose (classify, same_distinct...).
+    The entry points that call the LLM print them (print_token_report).
+    """
+
+    # {purpose: {"calls": int, "tokens": int, "max_tokens": int, "truncated": int}}
+    _token_counts = defaultdict(lambda: defaultdict(int))
+
+    @classmethod
+    def build(cls,
+              purpose: str,
+              instructions: str,
+              sections: list[tuple[str, str]],
+              context_length: int,
+              reserved_tokens: int = 256) -> str:
+        """
+        Concatenate the instructions and the sections. Each section is made
+        of a header (ex: "Entity 1: ") that is always kept and of a text that
+        is truncated if the prompt does not fit in the context length.
+        The remaining budget is shared equally between the sections, and what
+        a short section does not use is given to the longer ones.
+
+        Args:
+            purpose: name of the call type (used in the token report)
+            instructions: static prefix of the prompt
+            sections: list of (header, text) to append after the instructions
+            context_length: context length of the model in tokens
+            reserved_tokens: tokens to keep for the response (num_predict)
+        """
+        budget = context_length - reserved_tokens - count_tokens(instructions)
+        budget -= sum(count_tokens(header) for header, _ in sections)
+
+        # Share the budget, smallest sections first
+        lengths = {i: count_tokens(text) for i, (_, text) in enumerate(sections)}
+        allowed = dict()
+        remaining = len(sections)
+        for i in sorted(lengths, key = lambda i: lengths[i]):
+            share = max(budget, 0) // remaining
+            allowed[i] = min(lengths[i], share)
+            budget -= allowed[i]
+            remaining -= 1
+
+        prompt = instructions
+        truncated = False
+        for i, (header, text) in enumerate(sections):
+            if allowed[i] < lengths[i]:
+                text = truncate_to_tokens(text, allowed[i])
+                truncated = True
+            prompt += header + text
+
+        n_tokens = count_tokens(prompt)
+        counts = cls._token_counts[purpose]
+        counts["calls"] += 1
+        counts["tokens"] += n_tokens
+        counts["max_tokens"] = max(counts["max_tokens"], n_tokens)
+        if truncated:
+            counts["truncated"] += 1
+        return prompt
+
+
+    @classmethod
+    def get_token_counts(cls) -> dict:
+        """
+        Prompt token counts per purpose.
+        """
+        return {purpose: dict(counts) for purpose, counts in cls._token_counts.items()}
+
+
+    @classmethod
+    def print_token_report(cls):
+        """
+        Print the prompt token counts per purpose, if prompts were built.
+        """
+        for purpose, counts in sorted(cls._token_counts.items()):
+            mean = counts["tokens"] / counts["calls"]
+            print(f"{purpose}\t\tcalls: {counts['calls']}\t" +
+                  f"prompt tokens (approx.): mean {mean:.0f}, max {counts['max_tokens']}\t" +
+                  f"truncated: {counts['truncated']}")
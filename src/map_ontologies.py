@@ -35,6 +35,11 @@ from data_mapper.attribute_matcher import AttributeMatcher
 from data_mapper.tools.mapping_tools_list import MappingToolsList
 from data_mapper.tools.filters.distance_filter import DistanceFilter
 from data_mapper.hybrid_retriever import HybridRetriever
+from data_mapper.prescreen import PreScreen
+from data_mapper.decision_store import DecisionStore
+from data_mapper.llm_budget import LLMBudget
+from llm.llm_stats import LLMStats
+from llm.prompt_builder import PromptBuilder
 
 
 class OntologyMapper():
@@ -44,12 +49,16 @@ class OntologyMapper():
                  input_ontologies: list[str],
                  output_dir: str = "",
                  human_validation: bool = False,
-                 limit: int = -1):
+                 limit: int = -1,
+                 prescreen: PreScreen = None,
+                 budget: LLMBudget = None):
         """
         Args:
             input_ontologies: list of ontologies to be merged
             output_dir: folder to save the output turtle files
             limit: maximum entities per list (for debug)
+            prescreen: trained pre-screen to reject unlikely pairs before the LLM
+            budget: LLM budget of the run, shared between the strategy lines
         """
         self._mapping_input_file = None
         restored = False
@@ -88,6 +97,9 @@ class OntologyMapper():
         self._strategy = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
         self._strategy_str = ""
         self._human_validation = human_validation
+        self._prescreen = prescreen
+        self._decision_store = None if human_validation else DecisionStore()
+        self._budget = None if human_validation else budget
 
 
     @property
@@ -356,9 +368,13 @@ class OntologyMapper():
 
     def execute_strategy(self):
         """
-        Execute the mapping strategy.
+        Execute the mapping strategy, line after line in the strategy order,
+        as a line can depend on the mappings of the previous lines. With a
+        LLM budget, every line is validated within its share of the budget
+        left, once its candidate pairs are scored.
         """
         atexit.register(self.write)
+        lines = []
         for extractor1 in self.strategy.keys():
             for extractor2 in self.strategy[extractor1].keys():
 
@@ -368,24 +384,53 @@ class OntologyMapper():
                         on_types = [on_types] # On all types at once if types are unknown
                         # If types from both lists are known, process types one by one.
                     for on_type in on_types:
-                        if type(on_type) == frozenset:
-                            on_types_str = ', '.join([str(t) for t in on_type])
-                        else:
-                            on_types_str = str(on_type)
-                        self._description += f"mapping: {extractor1.NAMESPACE}, {extractor2.NAMESPACE}, types: {on_types_str}, tools: {', '.join([s.NAME for s in tools])}\n"
-                        retriever = HybridRetriever()
-                        retriever.process_lists(extractor1(),
-                                                extractor2(),
-                                                on_types = on_type,
-                                                with_tools = list(tools),
-                                                limit = self._limit,
-                                                ignore_deprecated = True,
-                                                human_validation = self._human_validation)
-                        del(retriever)
-
-                        # Save progress for next execution
-                        self._progress[extractor1][extractor2][on_type] = tools
-                        self.write()
+                        lines.append((extractor1, extractor2, on_type, tools))
+        for i, (extractor1, extractor2, on_type, tools) in enumerate(lines):
+            if self._budget is not None and self._budget.exhausted():
+                print(f"LLM budget exhausted. {len(lines) - i} strategy lines left for the next run.")
+                break
+            if type(on_type) == frozenset:
+                on_types_str = ', '.join([str(t) for t in on_type])
+            else:
+                on_types_str = str(on_type)
+            self._description += f"mapping: {extractor1.NAMESPACE}, {extractor2.NAMESPACE}, types: {on_types_str}, tools: {', '.join([s.NAME for s in tools])}\n"
+            retriever = HybridRetriever()
+            steps = retriever.process_lists(extractor1(),
+                                            extractor2(),
+                                            on_types = on_type,
+                                            with_tools = list(tools),
+                                            limit = self._limit,
+                                            ignore_deprecated = True,
+                                            human_validation = self._human_validation,
+                                            prescreen = self._prescreen,
+                                            decision_store = self._decision_store,
+                                            defer_validation = self._budget is not None)
+            if steps is not None:
+                line = f"{extractor1.NAMESPACE}-{extractor2.NAMESPACE} ({on_types_str})"
+                self._budget.run_line(line,
+                                      steps,
+                                      on_done = self._line_done(extractor1, extractor2, on_type, tools),
+                                      lines_left = len(lines) - i)
+            else:
+                self._line_done(extractor1, extractor2, on_type, tools)()
+            del(retriever, steps)
+        if self._budget is not None:
+            self._budget.print_report()
+
+
+    def _line_done(self,
+                   extractor1,
+                   extractor2,
+                   on_type,
+                   tools):
+        """
+        Get the function that saves the progress once a line is done.
+        """
+        def save_progress():
+            # Save progress for next execution
+            self._progress[extractor1][extractor2][on_type] = tools
+            self.write()
+        return save_progress
 
 
     def _restore_progress(self):
@@ -437,6 +482,15 @@ class OntologyMapper():
                                      reviewer = USERNAME if self._human_validation else config.OLLAMA_MODEL_NAME)
         mapping_graph.serialize(output_dir = self._output_dir)
                                 # execution_id = self._execution_id)
+        LLMStats.write_report(output_dir / 'llm_report.json')
+        PromptBuilder.print_token_report()
+        if self._prescreen is not None:
+            self._prescreen.write_report(output_dir / 'prescreen_report.json')
+        if self._budget is not None:
+            self._budget.write_report(output_dir / 'budget_report.json')
+        if self._decision_store is not None:
+            self._decision_store.save()
+            self._decision_store.write_report(output_dir / 'decisions_report.json')
         progress_file = output_dir / 'progress.pkl'
         with open(progress_file, "wb") as file:
             dill.dump(self._progress, file)
@@ -446,12 +500,26 @@ class OntologyMapper():
 def main(input_ontologies: list[str],
          output_dir: str,
          strategy_file: str,
-         human_validation: bool):
-
-
+         human_validation: bool,
+         prescreen_files: list[str] = None,
+         prescreen_threshold: float = 0.02,
+         max_llm_calls: int = -1,
+         max_hours: float = -1):
+
+    prescreen = None
+    if prescreen_files and not human_validation:
+        prescreen = PreScreen(threshold = prescreen_threshold)
+        if not prescreen.fit(prescreen_files):
+            prescreen = None
+    budget = None
+    if max_llm_calls >= 0 or max_hours >= 0:
+        budget = LLMBudget(max_calls = max_llm_calls,
+                           max_seconds = max_hours * 3600 if max_hours >= 0 else -1)
     mapper = OntologyMapper(input_ontologies,
                             output_dir = output_dir,
-                            human_validation = human_validation)
+                            human_validation = human_validation,
+                            prescreen = prescreen,
+                            budget = budget)
     mapper.parse_strategy(strategy_file)
     mapper.merge_identifiers()
     if not human_validation:
@@ -497,6 +565,31 @@ if __name__ == "__main__":
                         required=False,
                         action="store_true",
                         help="If set, will perform validation manually.")
+    parser.add_argument("--prescreen",
+                        dest="prescreen_files",
+                        nargs="+",
+                        required=False,
+                        type=str,
+                        default=None,
+                        help="SSSOM ontologies (mapping.ttl) of previous runs to train a pre-screen that rejects unlikely candidate pairs before the LLM validation.")
+    parser.add_argument("--prescreen-threshold",
+                        dest="prescreen_threshold",
+                        required=False,
+                        type=float,
+                        default=0.02,
+                        help="Candidate pairs with a lower predicted match probability are rejected by the pre-screen. Default is 0.02.")
+    parser.add_argument("--max-llm-calls",
+                        dest="max_llm_calls",
+                        required=False,
+                        type=int,
+                        default=-1,
+                        help="Maximum LLM validations for the run, split between the strategy lines.")
+    parser.add_argument("--max-hours",
+                        dest="max_hours",
+                        required=False,
+                        type=float,
+                        default=-1,
+                        help="Maximum duration of the run in hours. LLM validations stop when it is reached.")
     parser.add_argument("-v",
                         "--version",
                         action="version",
@@ -506,4 +599,8 @@ if __name__ == "__main__":
     main(args.input_ontologies,
          args.output_dir,
          args.strategy_file,
-         args.human_validation)
+         args.human_validation,
+         args.prescreen_files,
+         args.prescreen_threshold,
+         args.max_llm_calls,
+         args.max_hours)
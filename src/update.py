@@ -15,18 +15,26 @@ Author:
 from __version__ import __version__
 
 import atexit
+import json
+import multiprocessing
 import os
+import queue
 import sys
+import threading
+import time
 
 from rdflib import Namespace, PROV, URIRef
-from typing import List
+from typing import Iterable, Iterator, List
 from argparse import ArgumentParser
 from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
 
+from config import EXTRACT_QUEUE_SIZE
+
 from graph.graph import Graph
 from graph import entity_types
-from graph.extractor.cache import VersionManager
+from graph.extractor.cache import CacheManager, VersionStream
 from graph.extractor.extractor import Extractor
 from graph.extractor.extractor_lists import ExtractorLists
 from graph.extractor.aas_extractor import AasExtractor
@@ -39,7 +47,7 @@ from graph.extractor.spase_extractor import SpaseExtractor
 from graph.extractor.wikidata_extractor import WikidataExtractor
 from graph.extractor.n2yo_extractor import N2yoExtractor
 from graph.entity import Entity
-from utils.location_utilities import get_location_info
+from utils.location_utilities import GeocodingQueue
 
 
 class Updater():
@@ -55,6 +63,7 @@ class Updater():
         lists -- lists to extract
         """
         self._graph = Graph(ontology_file)
+        self.geocoding = GeocodingQueue()
         if not ontology_file:
             self.init_graph() # Create basic classes
         self._output_ontology = output_ontology
@@ -91,16 +100,34 @@ class Updater():
         """
         # Remove the old entities for the extractor in order to update the source.
         if extractor:
-            namespace_uri = Namespace(str(self.graph.PROPERTIES.OBS)[:-1] + "/" + extractor.NAMESPACE + "#")
-            for triple in self.graph:
-                if triple[0].startswith(namespace_uri):
-                    self.graph.remove(triple)
+            self.graph.remove_namespace(self._namespace_uri(extractor))
 
         if extractor:
             desc = f"Add {extractor.NAMESPACE} entities to ontology"
         else:
             desc = ""
-        for identifier, features in tqdm(data.items(), desc = desc):
+        self._add_batch(tqdm(data.items(), desc = desc, total = len(data)),
+                        extractor = extractor,
+                        cat = cat)
+
+
+    def _add_batch(self,
+                   items: Iterable[tuple[str, dict]],
+                   extractor: Extractor = None,
+                   cat: str | URIRef = "ufo"):
+        """
+        Add entities to the graph, with their location information.
+        The batch's locations are geocoded at once (self.geocoding).
+
+        Args:
+            items: the entities' (identifier, features)
+            extractor: the extractor of the entities
+            cat: the type of the entities without a type
+        """
+        # Collect the locations of the batch's entities, to geocode
+        # every distinct location once
+        batch = []
+        for identifier, features in items:
             # Get complete location information and add them to the features
             # Only for extracted ground entities
             if extractor:
@@ -117,7 +144,6 @@ class Updater():
                                not is_space_type)):
                     # If the type is not certain or if it is not a space type,
                     # we will try to get location information
-                    location_info = dict()
                     ent_type = features.get("type", None)
                     """
                     part_of = None
@@ -148,38 +174,41 @@ class Updater():
                     if type(ent_type) == str:
                         ent_type = {ent_type}
                     if ent_type is not None:
-                        for cat in ent_type:
-                            if (cat in entity_types.MAY_HAVE_ADDR and (
+                        for ent_cat in ent_type:
+                            if (ent_cat in entity_types.MAY_HAVE_ADDR and (
                                 "latitude" in features and "longitude" in features or
                                 "location" in features or
                                 "address" in features # or
                                 #part_of is not None or
                                 )):
-                                location_info = get_location_info(label = features.get("label", None),
-                                                                  latitude = features.get("latitude", None),
-                                                                  longitude = features.get("longitude", None),
-                                                                  address = features.get("address", None),
-                                                                  country = features.get("country", None),
-                                                                  location = features.get("location", None),
-                                                                  #part_of = part_of,
-                                                                  from_cache = True)
+                                self.geocoding.add(identifier,
+                                                   label = features.get("label", None),
+                                                   latitude = features.get("latitude", None),
+                                                   longitude = features.get("longitude", None),
+                                                   address = features.get("address", None),
+                                                   country = features.get("country", None),
+                                                   location = features.get("location", None),
+                                                   #part_of = part_of,
+                                                   from_cache = True)
                                 break
-                    # Retrieved information are country, continent, address.
-                    # We also set location to Earth or Space, and Ocean if
-                    # the search by latitude and longitude did not retrieve
-                    # anything.
-                    for key, value in location_info.items():
-                        if key == "country":
-                            features[key] = value # Replace USA by United States
-                        if key not in features or not features[key]:
-                            features[key] = value
-
-            # Add triple <subj, pred, obj>
+            batch.append((identifier, features))
+
+        locations = self.geocoding.resolve()
+        entities = dict()
+        for identifier, features in batch:
+            # Retrieved information are country, continent, address.
+            # We also set location to Earth or Space, and Ocean if
+            # the search by latitude and longitude did not retrieve
+            # anything.
+            for key, value in locations.get(identifier, dict()).items():
+                if key == "country":
+                    features[key] = value # Replace USA by United States
+                if key not in features or not features[key]:
+                    features[key] = value
+
+            # Add triples <subj, pred, obj>
             subj = identifier
-
-            for predicate, obj in features.items():
-                self.graph.add((subj, predicate, obj),
-                                extractor = extractor)
+            entities[subj] = features
 
             # Add type on non-typed entities
             if "type" not in features:
@@ -188,8 +217,111 @@ class Updater():
                     not extractor.IS_ONTOLOGICAL):
                     if cat == "ufo" and hasattr(extractor, "DEFAULT_TYPE"):
                         cat = extractor.DEFAULT_TYPE
-                    self.graph.add((subj, "type", cat),
-                                    extractor = extractor)
+                    entities[subj] = features | {"type": cat}
+        self.graph.add_many(entities,
+                            extractor = extractor)
+
+
+    def add_stream(self,
+                   batches: Iterable[dict],
+                   extractor: Extractor,
+                   remove_deprecated: bool = True,
+                   incremental: bool = False) -> dict:
+        """
+        Add the entities of an extractor to the ontology by batches, as they
+        are extracted (Extractor.iter_extract). Every batch is compared with
+        the previous version (VersionStream) and added to the graph before
+        the next one is extracted. The graph is the same as with a
+        VersionStream of the whole data then add_entities.
+        Return the changeset {"added": set, "removed": set, "modified": set}.
+
+        Args:
+            batches: the extracted entities by batches {identifier: features}
+            extractor: the extractor of the entities
+            remove_deprecated: if False, the removed entities are kept
+                               as deprecated entities.
+            incremental: only replace the added, removed and modified
+                         entities. The others keep their triples (and their
+                         location information) from the input ontology.
+                         All the entities are replaced if the previous
+                         version is not the one saved in the ontology.
+        """
+        old_data = dict()
+        for entity, in self.graph.get_entities_from_list(extractor):
+            old_data[entity] = Entity(entity).data
+        versions = VersionStream(extractor,
+                                 remove_deprecated = remove_deprecated,
+                                 input_graph_values = old_data)
+        del old_data
+        namespace_uri = self._namespace_uri(extractor)
+        if incremental and versions.state != self.graph.version_states().get(extractor.NAMESPACE):
+            # The version files are not the ones of the input ontology
+            print(f"{extractor.NAMESPACE}: the version files do not match the input ontology. " +
+                  "Replacing all of its entities.")
+            incremental = False
+        if incremental:
+            in_graph = self.graph.namespace_subjects(namespace_uri)
+        else:
+            self.graph.remove_namespace(namespace_uri)
+            in_graph = set()
+        added = dict() # Identifiers added by URI (identifiers can share the same URI)
+        kept = set() # URIs of the entities that keep their triples
+        late = set() # URIs whose entities are added again at the end
+        progress = tqdm(desc = f"Add {extractor.NAMESPACE} entities to ontology")
+
+        def add(batch: dict):
+            entities = dict()
+            for identifier, features in batch.items():
+                if not features.get("type"):
+                    continue
+                uri = self.graph.subject_uri(identifier, extractor = extractor)
+                if identifier in added.get(uri, ()):
+                    late.add(uri) # Yielded again
+                elif (uri in in_graph and uri not in added and
+                      identifier not in versions.changes["added"] and
+                      identifier not in versions.changes["modified"] and
+                      identifier not in versions.changes["removed"]):
+                    kept.add(uri)
+                    continue
+                if uri in kept and uri not in added:
+                    late.add(uri) # The kept entities of the URI are removed
+                if uri in in_graph and uri not in added:
+                    self.graph.remove_subjects([uri])
+                added.setdefault(uri, set()).add(identifier)
+                entities[identifier] = features
+            self._add_batch(entities.items(),
+                            extractor = extractor)
+            progress.update(len(batch))
+
+        for batch in batches:
+            versions.add(batch)
+            add(batch)
+        add(versions.close()) # Deprecated entities
+        progress.close()
+
+        # Removed entities, and entities that are not in the data anymore
+        removed = {self.graph.subject_uri(identifier, extractor = extractor)
+                   for identifier in versions.changes["removed"]}
+        late |= removed & (kept - added.keys())
+        self.graph.remove_subjects((in_graph - kept - added.keys()) | late)
+        if late:
+            entities = dict()
+            for batch in versions.saved():
+                entities.update({identifier: features for identifier, features in batch.items()
+                                 if features.get("type") and
+                                 self.graph.subject_uri(identifier, extractor = extractor) in late})
+            self._add_batch(entities.items(),
+                            extractor = extractor)
+        self.graph.set_version_state(extractor.NAMESPACE, versions.state)
+        return versions.changes
+
+
+    def _namespace_uri(self,
+                       extractor: Extractor) -> Namespace:
+        """
+        Namespace of the entities of an extractor.
+        """
+        return Namespace(str(self.graph.PROPERTIES.OBS)[:-1] + "/" + extractor.NAMESPACE + "#")
 
 
     # Labels
@@ -267,11 +399,176 @@ class Updater():
         print(f"Ontology saved in {self.output_ontology}")
 
 
+# Extractors that spend most of their time parsing (CPU-bound).
+# They are run in a process pool, the others in a thread pool.
+CPU_BOUND_EXTRACTORS = [PdsExtractor,
+                        SpaseExtractor]
+
+
+class ExtractionStream():
+    """
+    Batches of an extractor (Extractor.iter_extract), timed: seconds
+    is the time spent waiting for the batches, i.e. the extraction time
+    that does not overlap with the insertion in the graph.
+    """
+
+    def __init__(self,
+                 batches: Iterable[dict]):
+        self._batches = iter(batches)
+        self.seconds = 0.
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self) -> dict:
+        start = time.perf_counter()
+        try:
+            return next(self._batches)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+def _extract_in_process(Extractor: type[Extractor],
+                        from_cache: bool,
+                        batches: queue.Queue,
+                        stop) -> dict:
+    """
+    Put the batches of one extractor in a queue (shared with the main
+    process) as they are extracted, then None. Return the extractor's cache
+    statistics as they are not shared with the main process. Must be a
+    module-level function.
+    """
+    try:
+        for batch in Extractor().iter_extract(from_cache = from_cache):
+            if stop.is_set():
+                break
+            batches.put(batch)
+    finally:
+        batches.put(None)
+    return CacheManager.stats().get(Extractor.CACHE.strip("/"), {})
+
+
+def _extract_in_thread(Extractor: type[Extractor],
+                       from_cache: bool,
+                       batches: queue.Queue,
+                       stop: threading.Event):
+    """
+    Put the batches of one extractor in a queue as they are extracted,
+    then None (or the exception that stopped the extraction).
+    """
+    try:
+        for batch in Extractor().iter_extract(from_cache = from_cache):
+            if stop.is_set():
+                break
+            batches.put(batch)
+        batches.put(None)
+    except BaseException as e:
+        batches.put(e)
+        raise
+
+
+def _from_process(Extractor: type[Extractor],
+                  batches: queue.Queue,
+                  future: Future) -> Iterator[dict]:
+    while True:
+        try:
+            batch = batches.get(timeout = 1)
+        except queue.Empty:
+            if future.done():
+                future.result() # The process stopped without its None
+                break
+            continue
+        if batch is None:
+            break
+        yield batch
+    # Raises the exception that stopped the extraction
+    CacheManager.merge_stats({Extractor.CACHE: future.result()})
+
+
+def _from_thread(batches: queue.Queue) -> Iterator[dict]:
+    while (batch := batches.get()) is not None:
+        if isinstance(batch, BaseException):
+            raise batch
+        yield batch
+
+
+def _stop(futures: dict[type[Extractor], Future],
+          queues: dict[type[Extractor], queue.Queue],
+          stops: list):
+    """
+    Stop the extractors when their batches are not consumed anymore
+    (the update stopped): the running extractors are blocked on their
+    full queue until it is emptied.
+    """
+    for stop in stops:
+        stop.set()
+    for Extractor, future in futures.items():
+        future.cancel()
+        while not future.done():
+            try:
+                queues[Extractor].get(timeout = 1)
+            except queue.Empty:
+                pass
+
+
+def extract_all(extractors: list[type[Extractor]],
+                from_cache: bool = True,
+                jobs: int = 1) -> Iterator[tuple[type[Extractor], ExtractionStream]]:
+    """
+    Run the extractors concurrently and yield their batches of entities
+    in the extractors' order, so that the graph is built deterministically.
+    Yield (extractor class, ExtractionStream of its batches). The batches
+    of the streaming extractors are added to the graph while they are
+    extracted: a stream must be consumed before the next one is yielded.
+    An extractor run in parallel extracts at most EXTRACT_QUEUE_SIZE
+    batches in advance.
+
+    Args:
+        extractors: the extractor classes
+        from_cache: use the cached pages
+        jobs: maximum number of extractors run at the same time.
+              1 runs them one after the other.
+    """
+    if jobs <= 1:
+        for Extractor in extractors:
+            yield Extractor, ExtractionStream(Extractor().iter_extract(from_cache = from_cache))
+        return
+    cpu_bound = [e for e in extractors if e in CPU_BOUND_EXTRACTORS]
+    io_bound = [e for e in extractors if e not in CPU_BOUND_EXTRACTORS]
+    futures: dict[type[Extractor], Future] = dict()
+    queues: dict[type[Extractor], queue.Queue] = dict()
+    # Start the processes before the threads
+    with (multiprocessing.Manager() as manager,
+          ProcessPoolExecutor(max_workers = min(jobs, os.cpu_count() or 1, len(cpu_bound) or 1)) as processes,
+          ThreadPoolExecutor(max_workers = min(jobs, len(io_bound) or 1)) as threads):
+        stops = [manager.Event(), threading.Event()]
+        for Extractor in cpu_bound:
+            queues[Extractor] = manager.Queue(maxsize = EXTRACT_QUEUE_SIZE)
+            futures[Extractor] = processes.submit(_extract_in_process, Extractor, from_cache,
+                                                  queues[Extractor], stops[0])
+        for Extractor in io_bound:
+            queues[Extractor] = queue.Queue(maxsize = EXTRACT_QUEUE_SIZE)
+            futures[Extractor] = threads.submit(_extract_in_thread, Extractor, from_cache,
+                                                queues[Extractor], stops[1])
+        try:
+            for Extractor in extractors:
+                if Extractor in cpu_bound:
+                    yield Extractor, ExtractionStream(_from_process(Extractor, queues[Extractor], futures[Extractor]))
+                else:
+                    yield Extractor, ExtractionStream(_from_thread(queues[Extractor]))
+        finally:
+            _stop(futures, queues, stops)
+
+
 def main(lists: List[str],
          input_ontology: str = "",
          output_ontology: str = "output.ttl",
          from_cache: bool = True,
-         remove_deprecated: bool = True):
+         remove_deprecated: bool = True,
+         jobs: int = 1,
+         incremental: bool = False):
     updater = Updater(input_ontology,
                       output_ontology,
                       lists)
@@ -286,16 +583,50 @@ def main(lists: List[str],
             for extractor in ExtractorLists.AVAILABLE_EXTRACTORS:
                 if list_to_extract == extractor.NAMESPACE:
                     extractors.append(extractor)
-    for Extractor in extractors:
+    timings = dict()
+    changes = dict()
+    for Extractor, batches in extract_all(extractors,
+                                          from_cache = from_cache,
+                                          jobs = jobs):
+        start = time.perf_counter()
         extractor = Extractor()
-        data = extractor.extract(from_cache = from_cache)
-        old_entities = updater.graph.get_entities_from_list(extractor)
-        old_data = dict()
-        for entity, in old_entities:
-            old_data[entity] = Entity(entity).data
         rd = remove_deprecated or hasattr(extractor, "MULTI_VERSIONING") and extractor.MULTI_VERSIONING
-        VersionManager.compare_versions(data, extractor, remove_deprecated = rd, input_graph_values = old_data)
-        updater.add_entities(data, extractor = extractor)
+        list_changes = updater.add_stream(batches,
+                                          extractor = extractor,
+                                          remove_deprecated = rd,
+                                          incremental = incremental)
+        changes[extractor.NAMESPACE] = {key: sorted(str(updater.graph.subject_uri(identifier, extractor = extractor))
+                                                    for identifier in identifiers)
+                                        for key, identifiers in list_changes.items()}
+        timings[extractor.NAMESPACE] = (batches.seconds, time.perf_counter() - start - batches.seconds)
+
+    for namespace, (extract_time, add_time) in timings.items():
+        print(f"{namespace}\textraction: {extract_time:.1f}s\tadded in: {add_time:.1f}s")
+    report = updater.geocoding.report()
+    print(f"geocoding\trequests: {report['requests']}\tlocations: {report['locations']}\t" +
+          f"cache hits: {report['hits']}\tmisses: {report['misses']}")
+    CacheManager.write_report(output_ontology.removesuffix(".ttl") + "_cache_report.json")
+    write_changes(changes, output_ontology.removesuffix(".ttl") + "_changes.json")
+
+
+def write_changes(changes: dict,
+                  filename: str):
+    """
+    Save the added, removed and modified entities' URIs of every
+    updated list. Load them with VersionManager.load_changes.
+
+    Args:
+        changes: {namespace: {"added": [uri], "removed": [uri], "modified": [uri]}}
+        filename: the output json file
+    """
+    if not changes:
+        return
+    with open(filename, "w", encoding = "utf-8") as file:
+        json.dump(changes, file, indent = 2)
+    for namespace, list_changes in changes.items():
+        print(f"{namespace}\tadded: {len(list_changes['added'])}\t" +
+              f"removed: {len(list_changes['removed'])}\tmodified: {len(list_changes['modified'])}")
+    print(f"Changes saved in {filename}.")
 
 
 if __name__ == "__main__":
@@ -339,6 +670,23 @@ if __name__ == "__main__":
                         dest = "keep_deprecated",
                         action = "store_true",
                         help = "If set, will keep deprecated entities to the updated ontology.")
+    parser.add_argument("-j",
+                        "--jobs",
+                        dest = "jobs",
+                        default = 1,
+                        type = int,
+                        required = False,
+                        help = "Number of extractors to run at the same time. " +
+                        "Default is 1 (one after the other).")
+    parser.add_argument("-u",
+                        "--incremental",
+                        dest = "incremental",
+                        action = "store_true",
+                        help = "If set, only replace the added, removed and modified " +
+                        "entities of the input ontology (output of the previous update). " +
+                        "Location information is not retrieved again for the others. " +
+                        "A list is fully replaced if the version files are not the ones " +
+                        "of the input ontology.")
     parser.add_argument("-v",
                         "--version",
                         action="version",
@@ -350,4 +698,6 @@ if __name__ == "__main__":
          args.input_ontology,
          args.output_ontology,
          not args.no_cache,
-         not args.keep_deprecated)
+         not args.keep_deprecated,
+         args.jobs,
+         args.incremental)
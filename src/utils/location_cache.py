@@ -0,0 +1,227 @@
+"""
+Cache of the location information (location_utilities.get_location_info)
+in a SQLite file, instead of a JSON file saved at exit: every result is
+saved when it is found, so that it is kept if the update crashes.
+
+The entries are the get_location_info's keys (latlong/<latitude>/<longitude>,
+geocode/<address>, country/<country>, request/...) and their information dict.
+The coordinates' entries have the geohash of their point, indexed to find the
+entries of the points near a point (the same geohash cell).
+
+The previous JSON cache (location_infos.json) is imported when the SQLite
+file is created.
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import json
+import math
+import sqlite3
+import threading
+
+from collections.abc import MutableMapping
+from pathlib import Path
+from utils.sqlite_utilities import thread_connection
+
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(latitude: float,
+            longitude: float,
+            precision: int = 7) -> str:
+    """
+    Geohash of a point: the points of a cell share the geohash's prefix
+    (7 characters: cells of about 150 m by 150 m).
+
+    Args:
+        latitude: the point's latitude
+        longitude: the point's longitude
+        precision: number of characters of the geohash
+    """
+    latitude_range = [-90., 90.]
+    longitude_range = [-180., 180.]
+    result = []
+    bits = 0
+    bits_count = 0
+    even = True
+    while len(result) < precision:
+        value, interval = (longitude, longitude_range) if even else (latitude, latitude_range)
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            interval[0] = middle
+        else:
+            bits = bits * 2
+            interval[1] = middle
+        even = not even
+        bits_count += 1
+        if bits_count == 5:
+            result.append(_BASE32[bits])
+            bits = 0
+            bits_count = 0
+    return "".join(result)
+
+
+def _distance(latitude1: float,
+              longitude1: float,
+              latitude2: float,
+              longitude2: float) -> float:
+    """
+    Haversine distance (km) between two points.
+    """
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = (math.sin((latitude2 - latitude1) / 2) ** 2 +
+         math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2)
+    return 2 * 6371.0088 * math.asin(math.sqrt(a))
+
+
+class LocationCache(MutableMapping):
+    """
+    Location information by key, saved in a SQLite file.
+    """
+
+    def __init__(self,
+                 filename: str | Path,
+                 precision: int = 7):
+        """
+        Args:
+            filename: the SQLite file. It is created if it does not exist.
+            precision: number of characters of the coordinates' geohashes
+        """
+        self.filename = Path(filename)
+        self.precision = precision
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Connection of the current thread (see sqlite_utilities.thread_connection).
+        """
+        return thread_connection(self._local,
+                                 self.filename,
+                                 ["""CREATE TABLE IF NOT EXISTS locations (
+                                         key TEXT PRIMARY KEY,
+                                         geohash TEXT,
+                                         value TEXT NOT NULL)""",
+                                  "CREATE INDEX IF NOT EXISTS locations_geohash ON locations (geohash)"])
+
+
+    def _geohash(self,
+                 key: str) -> str:
+        """
+        Geohash of a latlong/<latitude>/<longitude> key, else None.
+        """
+        if not key.startswith("latlong/"):
+            return None
+        try:
+            _, latitude, longitude = key.split('/')
+            return geohash(float(latitude), float(longitude), self.precision)
+        except ValueError:
+            return None
+
+
+    def __getitem__(self,
+                    key: str) -> dict:
+        row = self._connection().execute(
+            "SELECT value FROM locations WHERE key = ?",
+            (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+
+    def __setitem__(self,
+                    key: str,
+                    value: dict):
+        self.put(key, value, self._geohash(key))
+
+
+    def put(self,
+            key: str,
+            value: dict,
+            cell: str = None):
+        """
+        Save the location information of a key.
+
+        Args:
+            key: the location's key
+            value: the location information
+            cell: the geohash of the location's point, if any
+        """
+        with self._write_lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO locations VALUES (?, ?, ?)",
+                (key, cell, json.dumps(value)))
+
+
+    def __delitem__(self,
+                    key: str):
+        with self._write_lock:
+            cursor = self._connection().execute("DELETE FROM locations WHERE key = ?", (key,))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+
+    def __contains__(self,
+                     key: str) -> bool:
+        return self._connection().execute(
+            "SELECT 1 FROM locations WHERE key = ?",
+            (key,)).fetchone() is not None
+
+
+    def __iter__(self):
+        return iter([row[0] for row in self._connection().execute("SELECT key FROM locations")])
+
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+
+
+    def near(self,
+             latitude: float,
+             longitude: float) -> dict:
+        """
+        Location information of the nearest point of the same geohash cell
+        (latlong/ entries only), or None if there is none.
+
+        Args:
+            latitude: the point's latitude
+            longitude: the point's longitude
+        """
+        rows = self._connection().execute(
+            "SELECT key, value FROM locations WHERE geohash = ? AND key LIKE 'latlong/%'",
+            (geohash(latitude, longitude, self.precision),)).fetchall()
+        nearest = None
+        for key, value in rows:
+            _, point_latitude, point_longitude = key.split('/')
+            point_distance = _distance(latitude, longitude, float(point_latitude), float(point_longitude))
+            if nearest is None or point_distance < nearest[0]:
+                nearest = (point_distance, value)
+        if nearest is None:
+            return None
+        return json.loads(nearest[1])
+
+
+    def import_json(self,
+                    filename: str | Path) -> int:
+        """
+        Add the entries of a JSON cache (location_infos.json) that are not
+        in the SQLite file. Return the number of imported entries.
+
+        Args:
+            filename: the JSON file
+        """
+        with open(filename, "r", encoding = "utf-8") as file:
+            location_infos = json.load(file)
+        connection = self._connection()
+        with self._write_lock:
+            connection.execute("BEGIN")
+            count = 0
+            for key, value in location_infos.items():
+                cursor = connection.execute("INSERT OR IGNORE INTO locations VALUES (?, ?, ?)",
+                                            (key, self._geohash(key), json.dumps(value)))
+                count += cursor.rowcount
+            connection.execute("COMMIT")
+        return count
@@ -1,21 +1,29 @@
 """
 Utilities to get location information from various input data.
-Uses geopy and a local cache to avoid multiple requests for the same location.
-Saves the cache at exit.
+Uses an offline geocoder on a local gazetteer (utils/offline_geocoder.py),
+or geopy's Nominatim (config.GEOCODER), and a local cache to avoid multiple
+requests for the same location. Nominatim is requested when the offline
+geocoder does not find a location (config.GEOCODER_FALLBACK).
+The cache is a SQLite file (utils/location_cache.py) where every result
+is saved when it is found. GeocodingQueue geocodes the locations of many
+entities at once, once per distinct location.
 
 Author:
     Liza Fretel (liza.fretel@obspm.fr)
 """
 import json
-import atexit
 import time
 import pycountry_convert
 import re
 
+from tqdm import tqdm
 from typing import Optional, Tuple
 from utils.performances import timeall
 from utils.string_utilities import remove_parenthesis
-from config import CACHE_DIR
+from utils.location_cache import LocationCache, geohash
+from utils.offline_geocoder import OfflineGeocoder, normalize_place_name
+import config
+from config import CACHE_DIR, GEOHASH_PRECISION, LOCATION_CACHE_FILE
 
 import geopy
 from geopy.geocoders import Nominatim
@@ -23,40 +31,67 @@ from geopy.distance import geodesic
 from geopy.extra.rate_limiter import RateLimiter
 geolocator = Nominatim(user_agent="obspm.fr")
 
-reverse = RateLimiter(
+nominatim_reverse = RateLimiter(
     geolocator.reverse,
     min_delay_seconds=1  # 1 request per second
 )
-geocode = RateLimiter(
+nominatim_geocode = RateLimiter(
     geolocator.geocode,
     min_delay_seconds=1  # 1 request per second
 )
 
 
+def reverse(query: Tuple[float],
+            exactly_one: bool = True,
+            language: str = "en") -> geopy.location.Location:
+    """
+    Get the location of a (latitude, longitude) with the offline geocoder,
+    or with Nominatim if it is not found (or config.GEOCODER is "nominatim").
+    """
+    geocoder = OfflineGeocoder.get() if config.GEOCODER == "offline" else None
+    if geocoder is not None:
+        result = geocoder.reverse(query,
+                                  exactly_one = exactly_one,
+                                  language = language)
+        if result is not None or not config.GEOCODER_FALLBACK:
+            return result
+    return nominatim_reverse(query,
+                             exactly_one = exactly_one,
+                             language = language)
+
+
+def geocode(query: str,
+            exactly_one: bool = True,
+            language: str = "en") -> geopy.location.Location:
+    """
+    Get the location of a place's name or address with the offline geocoder,
+    or with Nominatim if it is not found (or config.GEOCODER is "nominatim").
+    """
+    geocoder = OfflineGeocoder.get() if config.GEOCODER == "offline" else None
+    if geocoder is not None:
+        result = geocoder.geocode(query,
+                                  exactly_one = exactly_one,
+                                  language = language)
+        if result is not None or not config.GEOCODER_FALLBACK:
+            return result
+    return nominatim_geocode(query,
+                             exactly_one = exactly_one,
+                             language = language)
+
+
 # Prevent computing location info multiple times
 # as it requires to request a server.
 location_infos = None # uninitialized
 
-def _save_location_infos_in_cache():
-    global location_infos
-    if location_infos:
-        path = CACHE_DIR
-        path = str(path / "location_infos.json")
-        print(f"dumping {len(location_infos)} elements in {path}.")
-        with open(path, "w", encoding = "utf-8") as f:
-            json.dump(location_infos, f, indent=" ")
-
-
 def load_location_infos_from_cache():
-    atexit.register(_save_location_infos_in_cache)
     global location_infos
-    location_infos = {}
+    created = not LOCATION_CACHE_FILE.exists()
+    location_infos = LocationCache(LOCATION_CACHE_FILE,
+                                   precision = GEOHASH_PRECISION)
     path = CACHE_DIR / "location_infos.json"
-    if not path.exists():
-        return
-    path = str(path)
-    with open(path, "r", encoding = "utf-8") as f:
-        location_infos = json.load(f)
+    if created and path.exists():
+        count = location_infos.import_json(path)
+        print(f"imported {count} elements of {path} in {LOCATION_CACHE_FILE}.")
 
 
 STATES = {'AL' : 'Alabama',
@@ -674,6 +709,9 @@ def _get_location_from_cache(label: Optional[str] = None,
             (latitude != 0 or longitude != 0)):
         saved_in = "latlong/" + str(latitude) + '/' + str(longitude)
         data = location_infos.get(saved_in, None)
+        if data is None and isinstance(location_infos, LocationCache):
+            # A point of the same geohash cell
+            data = location_infos.near(float(latitude), float(longitude))
         if data is not None:
             data["location_confidence"] = 1
             return data
@@ -770,3 +808,119 @@ def _get_location_from_cache(label: Optional[str] = None,
     if latlong_empty and location_empty and address_empty and label_empty and country_empty: # and part_of_empty:
         return {}
     return data
+
+
+class GeocodingQueue():
+    """
+    Geocode the locations of many entities at once. The requests are
+    deduplicated by their normalized arguments (the coordinates of the same
+    geohash cell, the same label, address, country and location), so that
+    every distinct request is resolved once with get_location_info. The
+    results are saved in the cache by request key.
+    The requests that only differ by their label are resolved separately,
+    as the label is geocoded when the other arguments are not found. They
+    share the results found from the coordinates or from the address alone
+    through get_location_info's cache (latlong/ and geocode/ entries).
+    """
+
+    def __init__(self):
+        self._requests = dict() # {request key: (geohash, get_location_info's arguments)}
+        self._identifiers = dict() # {identifier: request key}
+        self.requests_count = 0
+        self.hits = 0 # distinct requests in the cache
+        self.misses = 0 # distinct requests resolved by get_location_info
+
+
+    def request_key(label: Optional[str] = None,
+                    location: Optional[str] = None,
+                    address: Optional[str] = None,
+                    country: Optional[str] = None,
+                    latitude: Optional[float] = None,
+                    longitude: Optional[float] = None) -> tuple[str, str]:
+        """
+        Get the key of a request and the geohash of its coordinates (or None).
+        """
+        def first(value):
+            if isinstance(value, (list, set, tuple)):
+                return list(value)[0] if value else None
+            return value
+        def normalize(value):
+            if not value:
+                return ""
+            if isinstance(value, str):
+                value = [value]
+            return "|".join(sorted(normalize_place_name(str(v)) for v in value if v))
+        latitude, longitude = first(latitude), first(longitude)
+        cell = None
+        if latitude is not None and longitude is not None:
+            latitude, longitude = float(latitude), float(longitude)
+            if latitude != 0 or longitude != 0:
+                longitude = (longitude % 360 + 540) % 360 - 180
+                cell = geohash(latitude, longitude, GEOHASH_PRECISION)
+        if isinstance(location, str):
+            location = [location]
+        location = "|".join(sorted(l.strip() for l in location if l)) if location else ""
+        key = json.dumps([cell, normalize(address), normalize(country), location, normalize(label)],
+                         ensure_ascii = False)
+        return "request/" + key, cell
+
+
+    def add(self,
+            identifier: str,
+            **kwargs):
+        """
+        Add the location of an entity to geocode.
+
+        Args:
+            identifier: the entity's identifier
+            kwargs: get_location_info's arguments (label, location, address,
+                    country, latitude, longitude, from_cache)
+        """
+        key, cell = GeocodingQueue.request_key(**{arg: kwargs.get(arg) for arg in
+                                                  ["label", "location", "address", "country", "latitude", "longitude"]})
+        self.requests_count += 1
+        self._identifiers[identifier] = key
+        self._requests.setdefault(key, (cell, kwargs))
+
+
+    def resolve(self) -> dict[str, dict]:
+        """
+        Geocode the added locations and return their information
+        by identifier. The queue is emptied.
+        """
+        global location_infos
+        if not self._requests:
+            return dict()
+        if location_infos is None:
+            load_location_infos_from_cache()
+        results = dict()
+        for key, (cell, kwargs) in tqdm(self._requests.items(),
+                                        desc = "Geocode locations",
+                                        leave = False,
+                                        disable = len(self._requests) < 100):
+            result = location_infos.get(key, None) if kwargs.get("from_cache", True) else None
+            if result is None:
+                self.misses += 1
+                result = get_location_info(**kwargs)
+                if isinstance(location_infos, LocationCache):
+                    location_infos.put(key, result, cell)
+                else:
+                    location_infos[key] = result
+            else:
+                self.hits += 1
+            results[key] = result
+        locations = {identifier: dict(results[key])
+                     for identifier, key in self._identifiers.items()}
+        self._requests.clear()
+        self._identifiers.clear()
+        return locations
+
+
+    def report(self) -> dict:
+        """
+        Number of requests, of distinct requests, of cache hits and misses.
+        """
+        return {"requests": self.requests_count,
+                "locations": self.hits + self.misses,
+                "hits": self.hits,
+                "misses": self.misses}
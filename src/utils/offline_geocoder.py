@@ -0,0 +1,366 @@
+"""
+Offline geocoder on a local gazetteer, to get location information
+without requesting Nominatim (1 request per second).
+
+The gazetteer is made of GeoNames dumps (https://download.geonames.org/export/dump/)
+saved in config.GAZETTEER_DIR:
+    - places files in the GeoNames format (ex: cities1000.txt, or
+      allCountries.txt filtered on the features to keep, such as
+      observatories S.OBS). Every *.txt file is read, except
+      admin1CodesASCII.txt.
+    - admin1CodesASCII.txt (optional): names of the regions (states).
+
+Reverse geocoding gets the nearest place of a latitude and longitude
+with a BallTree (haversine distance). Forward geocoding looks the
+normalized name up in an index of the places' names and alternate names,
+of the countries and of the continents. The results are geopy Locations
+with a raw dict like Nominatim's, so that get_location_info handles both
+backends the same way (see location_utilities.py).
+
+The built index is saved in the cache (gazetteer.pickle) and built again
+when the gazetteer's files change.
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import csv
+import os
+import pickle
+import re
+import sys
+import numpy as np
+import pycountry_convert
+
+from collections import defaultdict
+from pathlib import Path
+from geopy.location import Location
+from sklearn.neighbors import BallTree
+from unidecode import unidecode
+from config import CACHE_DIR, GAZETTEER_DIR # type: ignore
+
+
+EARTH_RADIUS = 6371.0088 # km
+
+# Country names that pycountry_convert does not know
+COUNTRY_ALIASES = {"usa": "US",
+                   "u s a": "US",
+                   "uk": "GB"}
+
+# Names of the continents (pycountry_convert's continent codes)
+CONTINENTS = {"NA": "North America",
+              "SA": "South America",
+              "AS": "Asia",
+              "AF": "Africa",
+              "OC": "Oceania",
+              "EU": "Europe",
+              "AQ": "Antarctica"}
+
+
+def normalize_place_name(name: str) -> str:
+    """
+    Key of a place name in the index: lowercase ascii words
+    without punctuation (Saint-Étienne -> saint etienne).
+
+    Args:
+        name: the place name
+    """
+    name = unidecode(name).lower()
+    name = re.sub(r"[^a-z0-9]+", ' ', name)
+    return name.strip()
+
+
+def _is_latin(name: str) -> bool:
+    """
+    Keep the alternate names written in the latin alphabet only,
+    the others would not match once normalized.
+    """
+    return all(ord(c) < 0x250 for c in name)
+
+
+def _country_name(country_code: str) -> str:
+    try:
+        return pycountry_convert.country_alpha2_to_country_name(country_code)
+    except KeyError:
+        return country_code
+
+
+class OfflineGeocoder():
+    """
+    Geocoder on the places of a GeoNames gazetteer, with the same
+    reverse and geocode methods as geopy's Nominatim.
+    """
+
+    # Distance (km) of a place to a point for the point to be in the place,
+    # else the point is in the place's region
+    CITY_DISTANCE = 10
+
+    # Distance (km) of the nearest place above which a point is not
+    # located (ex: in the ocean)
+    MAX_DISTANCE = 150
+
+    # Feature classes of the places that are cities (GeoNames)
+    CITY_CLASSES = {"P"}
+
+    # Geocoder on config.GAZETTEER_DIR (see get)
+    _GEOCODER = None
+    _LOADED = False
+    _INDEX_FILE = CACHE_DIR / "gazetteer.pickle"
+
+    def __init__(self,
+                 places: list[dict],
+                 regions: dict[str, str] = dict()):
+        """
+        Args:
+            places: the gazetteer's places, with their name, alternate_names,
+                    latitude, longitude, feature_class, country_code,
+                    admin1_code and population.
+            regions: names of the regions by code (<country code>.<admin1 code>)
+        """
+        self.places = places
+        self.regions = regions
+        coordinates = np.radians([[place["latitude"], place["longitude"]] for place in places])
+        self._tree = BallTree(coordinates, metric = "haversine") if places else None
+        self._names = defaultdict(list)
+        for i, place in enumerate(places):
+            names = {place["name"]} | set(place.get("alternate_names", []))
+            for name in {normalize_place_name(name) for name in names}:
+                if name:
+                    self._names[name].append(i)
+        self._largest_places = dict() # {country code: most populated place}
+        for i, place in enumerate(places):
+            largest = self._largest_places.get(place["country_code"])
+            if largest is None or place["population"] > places[largest]["population"]:
+                self._largest_places[place["country_code"]] = i
+        # Most populated place first
+        for indexes in self._names.values():
+            indexes.sort(key = lambda i: -places[i]["population"])
+        self._names = dict(self._names)
+        self._countries = dict()
+        for country_code in pycountry_convert.map_country_alpha2_to_country_name():
+            self._countries[normalize_place_name(_country_name(country_code))] = country_code
+        for name, country_code in pycountry_convert.map_country_name_to_country_alpha2().items():
+            self._countries.setdefault(normalize_place_name(name), country_code)
+        self._countries.update(COUNTRY_ALIASES)
+
+
+    def get() -> "OfflineGeocoder":
+        """
+        Get the geocoder on the gazetteer of config.GAZETTEER_DIR,
+        or None if the folder has no places file.
+        """
+        if not OfflineGeocoder._LOADED:
+            OfflineGeocoder._LOADED = True
+            OfflineGeocoder._GEOCODER = OfflineGeocoder.load(GAZETTEER_DIR)
+            if OfflineGeocoder._GEOCODER is None:
+                print(f"Warning: no gazetteer in {GAZETTEER_DIR}, the offline geocoder is disabled.",
+                      file = sys.stderr)
+        return OfflineGeocoder._GEOCODER
+
+
+    def load(gazetteer_dir: str | Path) -> "OfflineGeocoder":
+        """
+        Build the geocoder from the GeoNames files of a folder, or load it
+        from the cache if the files did not change. Return None if the
+        folder has no places file.
+
+        Args:
+            gazetteer_dir: folder of the GeoNames files
+        """
+        gazetteer_dir = Path(gazetteer_dir)
+        if not gazetteer_dir.is_dir():
+            return None
+        places_files = sorted(file for file in gazetteer_dir.glob("*.txt")
+                              if file.name != "admin1CodesASCII.txt")
+        if not places_files:
+            return None
+        admin1_file = gazetteer_dir / "admin1CodesASCII.txt"
+        files = places_files + ([admin1_file] if admin1_file.exists() else [])
+        signature = [(str(file), os.path.getmtime(file), os.path.getsize(file))
+                     for file in files]
+        index_file = OfflineGeocoder._INDEX_FILE
+        if index_file.exists():
+            with open(index_file, "rb") as file:
+                saved = pickle.load(file)
+            if saved["signature"] == signature:
+                return saved["geocoder"]
+
+        places = []
+        for places_file in places_files:
+            places.extend(OfflineGeocoder._read_places(places_file))
+        regions = dict()
+        if admin1_file.exists():
+            with open(admin1_file, "r", encoding = "utf-8", newline = "") as file:
+                for row in csv.reader(file, delimiter = "\t", quoting = csv.QUOTE_NONE):
+                    if len(row) >= 2:
+                        regions[row[0]] = row[1]
+        geocoder = OfflineGeocoder(places, regions)
+        index_file.parent.mkdir(parents = True, exist_ok = True)
+        with open(str(index_file) + ".tmp", "wb") as file:
+            pickle.dump({"signature": signature, "geocoder": geocoder}, file)
+        os.replace(str(index_file) + ".tmp", index_file)
+        return geocoder
+
+
+    def _read_places(places_file: Path) -> list[dict]:
+        """
+        Read the places of a file in the GeoNames format
+        (geonameid, name, asciiname, alternatenames, latitude, longitude,
+        feature class, feature code, country code, cc2, admin1 code, ...,
+        population, ...).
+        """
+        places = []
+        with open(places_file, "r", encoding = "utf-8", newline = "") as file:
+            for row in csv.reader(file, delimiter = "\t", quoting = csv.QUOTE_NONE):
+                if len(row) < 15 or row[0].startswith("#"):
+                    continue
+                alternate_names = {row[2]} | {name for name in row[3].split(",")
+                                              if name and _is_latin(name)}
+                alternate_names.discard(row[1])
+                places.append({"name": row[1],
+                               "alternate_names": sorted(alternate_names),
+                               "latitude": float(row[4]),
+                               "longitude": float(row[5]),
+                               "feature_class": row[6],
+                               "country_code": row[8],
+                               "admin1_code": row[10],
+                               "population": int(row[14] or 0)})
+        return places
+
+
+    def reverse(self,
+                query: tuple[float, float],
+                exactly_one: bool = True,
+                language: str = "en") -> Location:
+        """
+        Get the nearest place of a point, or None if no place is
+        nearer than MAX_DISTANCE. A point farther than CITY_DISTANCE
+        from the nearest city is located in its region.
+
+        Args:
+            query: the point's (latitude, longitude)
+            exactly_one: only for compatibility with Nominatim
+            language: only for compatibility with Nominatim
+        """
+        if self._tree is None:
+            return None
+        latitude, longitude = float(query[0]), float(query[1])
+        distances, indexes = self._tree.query(np.radians([[latitude, longitude]]), k = 1)
+        if distances[0][0] * EARTH_RADIUS > self.MAX_DISTANCE:
+            return None
+        place = self.places[indexes[0][0]]
+        if (place["feature_class"] in self.CITY_CLASSES and
+            distances[0][0] * EARTH_RADIUS <= self.CITY_DISTANCE):
+            return self._location(place)
+        # Not in the city: only keep its region and country
+        return self._location(place,
+                              addresstype = "state",
+                              latitude = latitude,
+                              longitude = longitude)
+
+
+    def geocode(self,
+                query: str,
+                exactly_one: bool = True,
+                language: str = "en") -> Location:
+        """
+        Find a continent, a country or a place by its name, or by the
+        first name of an address that is a place ("Pasadena, CA, USA").
+        The most populated place is chosen, in the address' country if
+        it is known. Return None if the name is unknown.
+
+        Args:
+            query: the name or the address
+            exactly_one: only for compatibility with Nominatim
+            language: only for compatibility with Nominatim
+        """
+        name = normalize_place_name(query)
+        if not name:
+            return None
+        for continent in CONTINENTS.values():
+            if name == normalize_place_name(continent):
+                return Location(continent, (0, 0), {"name": continent,
+                                                  "addresstype": "continent",
+                                                  "display_name": continent})
+        if name in self._countries:
+            return self._country_location(self._countries[name])
+        if name in self._names:
+            return self._location(self.places[self._names[name][0]])
+        parts = [normalize_place_name(part) for part in query.split(",")]
+        parts = [part for part in parts if part]
+        if len(parts) < 2:
+            return None
+        country_code = self._countries.get(parts[-1])
+        for part in parts:
+            indexes = self._names.get(part, [])
+            if country_code:
+                indexes = [i for i in indexes if self.places[i]["country_code"] == country_code]
+            # Places in a region of the address first ("Pasadena, CA")
+            indexes = sorted(indexes, key = lambda i: not self._in_regions(self.places[i], parts))
+            if indexes:
+                return self._location(self.places[indexes[0]])
+        if country_code:
+            return self._country_location(country_code)
+        return None
+
+
+    def _in_regions(self,
+                    place: dict,
+                    names: list[str]) -> bool:
+        """
+        Whether the place's region (its code or its name) is one of the names.
+        """
+        region = self.regions.get(f"{place['country_code']}.{place['admin1_code']}", "")
+        return bool({place["admin1_code"].lower(), normalize_place_name(region)} & set(names))
+
+
+    def _country_location(self,
+                          country_code: str) -> Location:
+        """
+        Location of a country, at its most populated place.
+        """
+        country = _country_name(country_code)
+        point = (0, 0)
+        if country_code in self._largest_places:
+            place = self.places[self._largest_places[country_code]]
+            point = (place["latitude"], place["longitude"])
+        return Location(country, point, {"name": country,
+                                         "addresstype": "country",
+                                         "lat": str(point[0]),
+                                         "lon": str(point[1]),
+                                         "display_name": country,
+                                         "address": {"country": country,
+                                                     "country_code": country_code.lower()}})
+
+
+    def _location(self,
+                  place: dict,
+                  addresstype: str = None,
+                  latitude: float = None,
+                  longitude: float = None) -> Location:
+        """
+        Location of a place, with a raw dict like Nominatim's.
+        """
+        if addresstype is None:
+            addresstype = "city" if place["feature_class"] in self.CITY_CLASSES else "man_made"
+        if latitude is None:
+            latitude, longitude = place["latitude"], place["longitude"]
+        country = _country_name(place["country_code"])
+        region = self.regions.get(f"{place['country_code']}.{place['admin1_code']}")
+        address = {"country": country,
+                   "country_code": place["country_code"].lower()}
+        if region:
+            address["state"] = region
+        names = [region, country]
+        if addresstype == "city":
+            address["city"] = place["name"]
+        if addresstype != "state":
+            names.insert(0, place["name"])
+        display_name = ", ".join(name for name in names if name)
+        return Location(display_name,
+                        (latitude, longitude),
+                        {"name": place["name"] if addresstype != "state" else (region or country),
+                         "addresstype": addresstype,
+                         "lat": str(latitude),
+                         "lon": str(longitude),
+                         "display_name": display_name,
+                         "address": address})
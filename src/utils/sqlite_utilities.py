@@ -0,0 +1,41 @@
+"""
+Utilities for the SQLite files shared by threads and processes
+(the packed cache of the pages, the location cache).
+
+Author:
+    Liza Fretel (liza.fretel@obspm.fr)
+"""
+import os
+import sqlite3
+import threading
+
+from pathlib import Path
+
+
+def thread_connection(local: threading.local,
+                      filename: Path,
+                      schema: list[str]) -> sqlite3.Connection:
+    """
+    Connection of the current thread to a SQLite file. A new connection is
+    opened in a forked process, as SQLite connections can not be shared.
+    The database is in WAL mode, so that the threads can read while another
+    one writes, and in autocommit mode.
+
+    Args:
+        local: the thread-local storage of the connections
+        filename: the SQLite file. It is created if it does not exist.
+        schema: the statements creating the tables and indexes if they do not exist
+    """
+    connection = getattr(local, "connection", None)
+    if connection is None or local.pid != os.getpid():
+        filename.parent.mkdir(parents = True, exist_ok = True)
+        connection = sqlite3.connect(filename,
+                                     timeout = 60,
+                                     isolation_level = None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in schema:
+            connection.execute(statement)
+        local.connection = connection
+        local.pid = os.getpid()
+    return connection
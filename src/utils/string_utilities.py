@@ -9,17 +9,21 @@ import roman
 
 from typing import Tuple
 from collections import defaultdict
+from functools import lru_cache
 from urllib.parse import quote
 from utils.acronymous import proba_acronym_of
 from rdflib import URIRef
 from unidecode import unidecode
 
 
+@lru_cache(maxsize = 2**16)
 def standardize_uri(label: str) -> str:
     """
     Creates a valid uri string from a label using lowercase and hyphens
     between words. Also, remove special characters with unidecode (ø -> o etc)
     and remove punctuation.
+    Memoized, as the same labels and types are standardized many times
+    during an update.
 
     Args:
         label: the label of the entity.
@@ -10,11 +10,13 @@ using search through papers to keep the description homogeneous in length)
 reificating them by source of reference (IAUMPC, NSSDC, Wikidata...)
 """
 from argparse import ArgumentParser
+from tqdm import tqdm
 from rdflib import URIRef, Literal, SKOS, DCTERMS
 from graph.graph import Graph
 from graph.entity import Entity
 from graph.properties import Properties
 from llm.llm_connection import LLMConnection
+from llm.llm_stats import LLMStats
 from graph import entity_types
 from collections import defaultdict
 from utils.dict_utilities import majority_voting_merge
@@ -88,12 +90,14 @@ class PostProcess():
         atexit.register(self._save_label_warnings)
         i = 0
         in_scope = set()
-        for uri in self.__iter__():
+        progress = tqdm(self.__iter__(), desc = "Generating labels and definitions")
+        for uri in progress:
             self._remove_attrs_before_gen(uri) # Remove attrs that are generated automatically to prevent generating errors
             self._gen_label(uri) # Must call before _gen_definition
             self._gen_definition(uri)
             self._remove_attrs_after_gen(uri)
             in_scope.add(uri)
+            progress.set_postfix_str(LLMStats.summary(), refresh = False)
             i += 1
         self._remove_out_of_scope_references(in_scope)
         self.replace_uri()
@@ -585,7 +589,8 @@ Entity:
                                          model = config.SUMMARIZE_MODEL,
                                          num_predict = 100,
                                          from_cache = True,
-                                         cache_key = str(entity.uri) + ":label")
+                                         cache_key = str(entity.uri) + ":label",
+                                         purpose = "label")
         new_label = label.split("\n")[0].strip()
         old_labels = entity.get_values_for("label", return_language = True)
         for old_label in old_labels:
@@ -637,7 +642,8 @@ Entity to define and summarize: {entity_str}"""
                                               model = config.SUMMARIZE_MODEL,
                                               num_predict = 100,
                                               from_cache = True,
-                                              cache_key = str(entity.uri) + ":definition")
+                                              cache_key = str(entity.uri) + ":definition",
+                                              purpose = "definition")
         self._graph.add((uri, SKOS.definition, Literal(definition)))
         self._graph.remove((uri, SKOS.definition, None))
         self._graph.remove((uri, DCTERMS.description, None))
@@ -675,9 +681,10 @@ Entity to define and summarize: {entity_str}"""
 def main(input_graph: str):
     graph = Graph()
     graph.parse(input_graph)
-    PostProcess(input_graph)()
-    output_graph = input_graph.remove_prefix(".ttl") + "_post_processed.ttl"
+    PostProcess(graph)()
+    output_graph = input_graph.removesuffix(".ttl") + "_post_processed.ttl"
     graph.serialize(destination = output_graph, format = "ttl")
+    LLMStats.write_report(input_graph.removesuffix(".ttl") + "_llm_report.json")
 
 
 if __name__ == "__main__":
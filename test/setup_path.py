@@ -1,8 +1,23 @@
 """
-Project paths
+Project paths and test helpers
 """
 import sys
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(ROOT / "src"))
+
+
+def patch(test,
+          *patches):
+    """
+    Set attributes for the duration of a test. They are restored
+    by the test's cleanup.
+
+    Args:
+        test: the unittest.TestCase
+        patches: (object, attribute name, value) tuples
+    """
+    for obj, attr, value in patches:
+        test.addCleanup(setattr, obj, attr, getattr(obj, attr))
+        setattr(obj, attr, value)
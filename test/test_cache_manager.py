@@ -0,0 +1,189 @@
+import setup_path
+import gzip
+import requests
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from graph.extractor import cache
+from graph.extractor.cache import CacheManager
+from graph.extractor.http_pool import HttpPool, TokenBucket
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    """
+    /page/<name>: returns the name.
+    /flaky/<n>: returns 503 (or 429) for the first n requests.
+    /etag/<name>: returns the name with an ETag, or 304 if it matches.
+    /missing: returns 404.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self,
+              status: int,
+              body: str = "",
+              headers: dict = dict()):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(server.latency)
+        try:
+            if self.path.startswith("/page/"):
+                self._send(200, self.path.split("/")[-1])
+            elif self.path.startswith("/etag/"):
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self._send(304)
+                else:
+                    self._send(200, self.path.split("/")[-1], headers = {"ETag": '"v1"'})
+            elif self.path.startswith("/flaky/"):
+                failures = int(self.path.split("/")[-1])
+                count = server.requests.count(self.path)
+                if count <= failures:
+                    status = 429 if count % 2 else 503
+                    self._send(status, headers = {"Retry-After": "0"} if status == 429 else {})
+                else:
+                    self._send(200, "ok")
+            else:
+                self._send(404)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self._send(200, self.rfile.read(length).decode("utf-8"))
+
+
+class TestCacheManager(unittest.TestCase):
+
+
+    def setUp(self):
+        server = ThreadingHTTPServer(("localhost", 0), _FixtureHandler)
+        server.daemon_threads = True
+        server.lock = threading.Lock()
+        server.requests = []
+        server.active = 0
+        server.max_active = 0
+        server.latency = 0.
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+        self.url = f"http://localhost:{server.server_address[1]}"
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        setup_path.patch(self,
+                         (cache, "CACHE_DIR", Path(tmp.name)),
+                         (CacheManager, "POOL", HttpPool(max_connections = 2,
+                                                         requests_per_second = -1,
+                                                         retries = 3,
+                                                         backoff = 0.01,
+                                                         timeout = 5)))
+        CacheManager._stats.clear()
+
+    def test_get_page_cache(self):
+        url = self.url + "/page/hubble"
+        assert not CacheManager.in_cache(url, "test")
+        assert CacheManager.get_page(url, "test") == "hubble"
+        assert CacheManager.in_cache(url, "test") # Compressed
+        assert CacheManager.get_page(url, "test") == "hubble"
+        assert len(self.server.requests) == 1
+        cache_path = CacheManager._get_cache_path(url, "test")
+        with open(cache_path + ".gz", "rb") as file:
+            assert gzip.decompress(file.read()) == b"hubble"
+        CacheManager.get_page(url, "test", from_cache = False)
+        assert len(self.server.requests) == 2
+
+    def test_post(self):
+        content = CacheManager.get_page(self.url + "/post", "test",
+                                        data = {"discipline": "astronomy"},
+                                        data_str = "astronomy")
+        assert content == "discipline=astronomy"
+
+    def test_missing_page(self):
+        assert CacheManager.get_page(self.url + "/missing", "test") == ""
+        assert not Path(CacheManager._get_cache_path(self.url + "/missing", "test")).exists()
+
+    def test_retry(self):
+        assert CacheManager.get_page(self.url + "/flaky/2", "test") == "ok"
+        assert len(self.server.requests) == 3
+        assert CacheManager.get_page(self.url + "/flaky/9", "test") == ""
+        assert len(self.server.requests) == 3 + 4 # 1 request + 3 retries
+
+    def test_get_many(self):
+        self.server.latency = 0.05
+        urls = [f"{self.url}/page/p{i}" for i in range(12)]
+        contents = CacheManager.get_many(urls, "test")
+        assert contents == [f"p{i}" for i in range(12)]
+        assert self.server.max_active == 2 # max_connections
+        assert CacheManager.get_many(urls, "test") == contents
+        assert len(self.server.requests) == 12
+
+    def test_legacy_cache_file(self):
+        url = self.url + "/page/voyager"
+        with open(CacheManager._get_cache_path(url, "test"), "w", encoding = "utf-8") as file:
+            file.write("cached")
+        assert CacheManager.in_cache(url, "test")
+        assert CacheManager.get_page(url, "test") == "cached"
+        assert not self.server.requests
+
+    def test_revalidation(self):
+        url = self.url + "/etag/cassini"
+        assert CacheManager.get_page(url, "test") == "cassini"
+        assert CacheManager._read_metadata(CacheManager._get_cache_path(url, "test"))["etag"] == '"v1"'
+        assert CacheManager.get_page(url, "test", from_cache = False) == "cassini"
+        assert len(self.server.requests) == 2
+        stats = CacheManager.stats()["test"]
+        assert stats["revalidated"] == 1
+        assert stats["bytes_saved"] == len("cassini")
+        report = CacheManager.report()["test"]
+        assert report["cache_files"] == 2 # page and metadata
+
+    def test_ttl(self):
+        url = self.url + "/page/juno"
+        CacheManager.get_page(url, "test")
+        setup_path.patch(self, (cache, "CACHE_TTL_DAYS", {"test": 1}))
+        CacheManager.get_page(url, "test")
+        assert len(self.server.requests) == 1
+        cache_path = CacheManager._get_cache_path(url, "test")
+        metadata = CacheManager._read_metadata(cache_path)
+        metadata["fetched"] -= 2 * 86400
+        CacheManager._save_metadata(metadata, cache_path)
+        CacheManager.get_page(url, "test")
+        assert len(self.server.requests) == 2
+
+    def test_retry_delay(self):
+        pool = HttpPool(backoff = 0.5)
+        response = requests.Response()
+        for retry_after, delay in [("3", 3.), ("Wed, 21 Oct 2015 07:28:00 GMT", 0.),
+                                   ("soon", 2.), ("", 2.)]:
+            response.headers["Retry-After"] = retry_after
+            assert pool._retry_delay(response, attempt = 2) == delay
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate = 20, capacity = 1)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        assert time.monotonic() - start >= 0.2
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import setup_path
+import gzip
+import json
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from graph.extractor import cache
+from graph.extractor.cache import CacheManager
+from graph.extractor.cache_pack import CachePack
+
+
+class TestCachePack(unittest.TestCase):
+
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = Path(tmp.name) / "cache"
+        self.pack = CachePack(Path(tmp.name) / "pages.sqlite")
+
+        # File layout: a legacy page, a compressed page with metadata,
+        # a POST page (data_str) and a git repository
+        (self.cache_dir / "NSSDC" / "https_post_url").mkdir(parents = True)
+        (self.cache_dir / "NSSDC" / "legacy").write_text("legacy page", encoding = "utf-8")
+        (self.cache_dir / "NSSDC" / "page.gz").write_bytes(gzip.compress(b"compressed page"))
+        (self.cache_dir / "NSSDC" / "page.meta.json").write_text(json.dumps({"etag": "v1", "fetched": 1.}))
+        (self.cache_dir / "NSSDC" / "https_post_url" / "astronomy").write_text("post page", encoding = "utf-8")
+        (self.cache_dir / "SPASE" / "repo" / ".git").mkdir(parents = True)
+        (self.cache_dir / "SPASE" / "repo" / "file.xml").write_text("<xml/>", encoding = "utf-8")
+
+    def test_import_export(self):
+        assert self.pack.import_files(self.cache_dir, ["NSSDC", "SPASE"]) == 3
+        assert self.pack.keys() == ["NSSDC/https_post_url/astronomy", "NSSDC/legacy", "NSSDC/page"]
+        body, suffix, metadata = self.pack.get("NSSDC/page")
+        assert gzip.decompress(body) == b"compressed page"
+        assert suffix == ".gz"
+        assert metadata == {"etag": "v1", "fetched": 1.}
+        assert self.pack.get("NSSDC/missing") is None
+        assert self.pack.size("NSSDC/") == (3, sum(len(self.pack.get(k)[0]) for k in self.pack.keys()))
+        assert self.pack.size("SPASE/") == (0, 0)
+
+        export_dir = self.cache_dir.parent / "export"
+        assert self.pack.export_files(export_dir) == 3
+        assert (export_dir / "NSSDC" / "legacy").read_text(encoding = "utf-8") == "legacy page"
+        assert gzip.decompress((export_dir / "NSSDC" / "page.gz").read_bytes()) == b"compressed page"
+
+    def test_concurrent_readers(self):
+        self.pack.import_files(self.cache_dir, ["NSSDC"])
+        keys = self.pack.keys() * 50
+        with ThreadPoolExecutor(max_workers = 8) as executor:
+            pages = list(executor.map(self.pack.get, keys))
+        assert all(page is not None for page in pages)
+
+    def test_cache_manager(self):
+        self.pack.import_files(self.cache_dir, ["NSSDC"])
+        setup_path.patch(self,
+                         (cache, "CACHE_DIR", self.cache_dir),
+                         (CacheManager, "PACK", self.pack))
+
+        assert CacheManager._read_cache(str(self.cache_dir / "NSSDC" / "legacy")) == "legacy page"
+        assert CacheManager._read_cache(str(self.cache_dir / "NSSDC" / "page")) == "compressed page"
+        assert CacheManager.get_page("https://post.url", "NSSDC",
+                                     data = {"discipline": "astronomy"},
+                                     data_str = "astronomy") == "post page"
+        assert not CacheManager.in_cache("https://new.page/", "NSSDC")
+        path = CacheManager._get_cache_path("https://new.page/", "NSSDC")
+        CacheManager.save_cache("new page", path, metadata = {"fetched": 2.})
+        assert CacheManager._read_cache(path) == "new page"
+        assert CacheManager.in_cache("https://new.page/", "NSSDC")
+        assert CacheManager._read_metadata(path) == {"fetched": 2.}
+        assert not Path(path + ".gz").exists()
+
+
+if __name__ == "__main__":
+    unittest.main()
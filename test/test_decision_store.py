@@ -0,0 +1,80 @@
+import setup_path
+import config
+from data_mapper.decision_store import DecisionStore
+from rdflib import URIRef
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class FakeEntity():
+
+    def __init__(self, uri, data):
+        self.uri = URIRef(uri)
+        self.data = data
+
+    def get_values_for(self, attr):
+        return self.data.get(attr, set())
+
+
+class TestDecisionStore(unittest.TestCase):
+
+
+    def setUp(self):
+        setup_path.patch(self, (config, "OLLAMA_MODEL_NAME", "stub"))
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.filename = Path(self.tmp_dir.name) / "decisions.json"
+        self.hubble = FakeEntity("http://a#hubble", {"label": {"Hubble"},
+                                                     "description": {"A space telescope."}})
+        self.hst = FakeEntity("http://b#hst", {"label": {"HST"}})
+
+    def test_exact_reuse(self):
+        store = DecisionStore(policy = DecisionStore.EXACT, filename = self.filename)
+        store.start_line("a-b")
+        assert store.lookup(self.hubble, self.hst, "same_distinct", []) is None
+        store.add(self.hubble, self.hst, "same_distinct", [], True, "same telescope")
+        store.save()
+        store = DecisionStore(policy = DecisionStore.EXACT, filename = self.filename)
+        store.start_line("a-b")
+        assert store.lookup(self.hst, self.hubble, "same_distinct", []) == (True, "same telescope")
+        assert store.lookup(self.hubble, self.hst, "same_distinct_narrow_broad", []) is None
+        self.hubble.data["description"] = {"The Hubble space telescope."}
+        assert store.lookup(self.hubble, self.hst, "same_distinct", []) is None
+        assert store.report() == {"a-b": {"exact": 1, "semantic": 0, "llm": 0}}
+
+    def test_semantic_reuse(self):
+        store = DecisionStore(policy = DecisionStore.SEMANTIC, filename = self.filename)
+        store.add(self.hubble, self.hst, "same_distinct", [], True, "same telescope")
+        self.hubble.data["description"] = {"The Hubble space telescope."}
+        self.hst.data["label"] = {"hst"}
+        assert store.lookup(self.hubble, self.hst, "same_distinct", []) == (True, "same telescope")
+        self.hst.data["label"] = {"JWST"}
+        assert store.lookup(self.hubble, self.hst, "same_distinct", []) is None
+        self.hst.data["label"] = {"hst"}
+        config.OLLAMA_MODEL_NAME = "other"
+        assert store.lookup(self.hubble, self.hst, "same_distinct", []) is None
+        store.save()
+
+    def test_directional_kind(self):
+        store = DecisionStore(filename = self.filename)
+        store.add(self.hubble, self.hst, "same_distinct_narrow_broad", [], 2, "narrower")
+        assert store.lookup(self.hubble, self.hst, "same_distinct_narrow_broad", []) == (2, "narrower")
+        assert store.lookup(self.hst, self.hubble, "same_distinct_narrow_broad", []) is None
+        assert store.has_pair(self.hubble, self.hst, "same_distinct_narrow_broad")
+        assert not store.has_pair(self.hst, self.hubble, "same_distinct_narrow_broad")
+        store.add(self.hst, self.hubble, "same_distinct", [], False, "distinct", llm_called = False)
+        assert store.has_pair(self.hubble, self.hst, "same_distinct")
+        assert store.report() == {"": {"exact": 1, "semantic": 0, "llm": 1}}
+        store.save()
+
+    def test_excluded_fields(self):
+        store = DecisionStore(filename = self.filename)
+        store.add(self.hubble, self.hst, "same_distinct", ["url"], False, "distinct")
+        self.hst.data["url"] = {"http://hst"}
+        assert store.lookup(self.hubble, self.hst, "same_distinct", ["url"]) == (False, "distinct")
+        store.save()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import setup_path
+from data_mapper.tools.embedders.embedding_store import EmbeddingStore
+import numpy as np
+import tempfile
+import unittest
+
+
+class TestEmbeddingStore(unittest.TestCase):
+
+
+    def test_put_and_get(self):
+        with tempfile.TemporaryDirectory() as folder:
+            store = EmbeddingStore("test", "model:1b", folder = folder)
+            store.put_many(["a", "b"], [[1, 0, 0], [0, 1, 0]])
+            assert "a" in store
+            assert "c" not in store
+            assert len(store) == 2
+            assert np.array_equal(store.get("b"), [0, 1, 0])
+            assert store.get("c") is None
+            store.flush()
+
+    def test_grow_and_reload(self):
+        with tempfile.TemporaryDirectory() as folder:
+            store = EmbeddingStore("test", "model", folder = folder)
+            texts = [str(i) for i in range(EmbeddingStore._GROWTH + 10)]
+            vectors = [[i, i + 1] for i in range(len(texts))]
+            store.put_many(texts, vectors)
+            store.flush()
+            reloaded = EmbeddingStore("test", "model", folder = folder)
+            assert len(reloaded) == len(texts)
+            assert reloaded.dim == 2
+            assert np.array_equal(reloaded.get("1030"), [1030, 1031])
+
+    def test_dimension_mismatch(self):
+        with tempfile.TemporaryDirectory() as folder:
+            store = EmbeddingStore("test", "model", folder = folder)
+            store.put_many(["a"], [[1, 2]])
+            with self.assertRaises(ValueError):
+                store.put_many(["b"], [[1, 2, 3]])
+            store.flush()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import setup_path
+import config
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from urllib.parse import urlparse
+from evaluation.benchmark_paged_retrieval import imcce_pages_sequential, write_fixtures
+from graph.extractor import cache
+from graph.extractor.cache import CacheManager
+from graph.extractor.imcce_extractor import ImcceExtractor
+from graph.extractor.list_stub import ListStub
+
+
+class TestImcceExtractor(unittest.TestCase):
+
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        write_fixtures(Path(tmp.name) / "fixtures", 250)
+
+        self.stub = ListStub(Path(tmp.name) / "fixtures", port = 0)
+        threading.Thread(target = self.stub.serve_forever, daemon = True).start()
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+
+        setup_path.patch(self,
+                         (config, "IMCCE_HOST", self.stub.url),
+                         (cache, "CACHE_DIR", Path(tmp.name) / "cache"),
+                         (CacheManager, "PACK", None),
+                         (CacheManager.POOL, "host_limits", {urlparse(self.stub.url).netloc: (4, -1)}))
+
+    def test_prefetch(self):
+        pages = ImcceExtractor()._get_pages()
+        # The first page, then the two next ones from the total
+        assert self.stub.requests_count == 3
+        assert [len(page["data"]) for page in pages] == [100, 100, 50]
+        assert pages == imcce_pages_sequential(ImcceExtractor())
+        assert self.stub.requests_count == 3 + 1 # From cache, but for the 404 page
+
+        result = ImcceExtractor().extract()
+        assert len(result) == 250
+        assert list(result)[:2] == ["Spacecraft 0", "Spacecraft 1"]
+        assert "parent" not in result["Spacecraft 0"] # Neptune
+        assert result["Spacecraft 1"]["COSPAR_ID"] == "1991-001A"
+
+    def test_without_total(self):
+        # The pages are requested one after the other
+        get_page = ImcceExtractor._get_page
+        def without_total(extractor, offset, from_cache = True):
+            page = get_page(extractor, offset, from_cache = from_cache)
+            page.pop("total", None)
+            return page
+        setup_path.patch(self, (ImcceExtractor, "_get_page", without_total))
+        pages = ImcceExtractor()._get_pages()
+        assert [len(page["data"]) for page in pages] == [100, 100, 50]
+        assert self.stub.requests_count == 4
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import setup_path
+from data_mapper.llm_budget import LLMBudget
+import unittest
+
+
+def steps(outcomes, log = None, line = None):
+    for accepted in outcomes:
+        if log is not None:
+            log.append(line)
+        yield True, accepted
+
+
+class TestLLMBudget(unittest.TestCase):
+
+
+    def test_max_calls(self):
+        budget = LLMBudget(max_calls = 50, min_yield = 0.)
+        done = []
+        log = []
+        # Lines in order: a line is only validated when the previous one is stopped
+        for i, (line, outcomes) in enumerate([("short", [True] * 5),
+                                              ("bad", [i % 10 == 0 for i in range(200)]),
+                                              ("good", [True, False] * 100)]):
+            budget.run_line(line,
+                            steps(outcomes, log, line),
+                            on_done = lambda line = line: done.append(line),
+                            lines_left = 3 - i)
+        report = budget.report()
+        assert log == ["short"] * 5 + ["bad"] * 15 + ["good"] * 30
+        # The calls that a line did not use go to the next lines
+        assert report["short"]["llm_calls"] == 5
+        # A line with a lower yield than the previous lines gets less than
+        # an equal share (45 / 2), and the budget left goes to the next lines
+        assert report["bad"]["llm_calls"] == 15
+        assert report["good"]["llm_calls"] == 30
+        assert report["total"]["llm_calls"] == 50
+        assert report["bad"]["status"] == report["good"]["status"] == LLMBudget.OUT_OF_BUDGET
+        assert done == ["short"]
+        assert budget.exhausted()
+
+    def test_done_and_low_yield(self):
+        budget = LLMBudget(min_yield = 0.1, window = 10)
+        done = []
+        assert budget.run_line("short", steps([True] * 3), on_done = lambda: done.append("short")) == LLMBudget.DONE
+        assert budget.run_line("distinct", steps([False] * 100), on_done = lambda: done.append("distinct")) == LLMBudget.LOW_YIELD
+        report = budget.report()
+        assert report["distinct"]["llm_calls"] == 10
+        assert done == ["short", "distinct"]
+
+    def test_reused_decisions_are_free(self):
+        budget = LLMBudget(max_calls = 2)
+        budget.run_line("reused", ((False, True) for _ in range(5)))
+        assert budget.report()["reused"]["status"] == LLMBudget.DONE
+        assert budget.report()["total"]["llm_calls"] == 0
+
+
+if __name__ == "__main__":
+    unittest.main()
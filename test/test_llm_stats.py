@@ -0,0 +1,52 @@
+import setup_path
+from llm.llm_stats import LLMStats
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestLLMStats(unittest.TestCase):
+
+
+    def setUp(self):
+        LLMStats._stats.clear()
+
+    def test_report(self):
+        for latency in [1, 2, 3, 4]:
+            LLMStats.record_call("same_distinct", latency, "prompt", "same")
+        LLMStats.record_cache_hit("same_distinct")
+        LLMStats.record_retry("same_distinct")
+        LLMStats.record_call("label", 0.5, "prompt", error = True)
+        report = LLMStats.report()
+        stats = report["same_distinct"]
+        assert stats["calls"] == 4
+        assert stats["cache_hit_rate"] == 0.2
+        assert stats["retries"] == 1
+        assert stats["latency"]["p50"] == 2.5
+        assert stats["response_chars"] == 4
+        assert report["label"]["errors"] == 1
+        assert report["total"]["calls"] == 5
+        assert LLMStats.calls("same_distinct") == 4
+        assert LLMStats.calls("classify") == 0
+        assert "classify" not in LLMStats.report()
+
+    def test_summary(self):
+        assert LLMStats.summary() == "llm: no call"
+        LLMStats.record_call("classify", 1, "prompt", "telescope")
+        LLMStats.record_cache_hit("classify")
+        assert LLMStats.summary() == "llm: 1 calls, 50% cached, p50 1.0s, 0 retries"
+
+    def test_write_report(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = Path(tmp_dir) / "llm_report.json"
+            LLMStats.write_report(filename)
+            assert not filename.exists()
+            LLMStats.record_call("classify", 1, "prompt", "telescope")
+            LLMStats.write_report(filename)
+            with open(filename) as file:
+                assert json.load(file)["classify"]["calls"] == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
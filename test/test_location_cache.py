@@ -0,0 +1,87 @@
+import setup_path
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from utils import location_utilities
+from utils.location_cache import LocationCache, geohash
+from utils.location_utilities import GeocodingQueue
+
+
+class TestLocationCache(unittest.TestCase):
+
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.calls = []
+        def get_location_info(**kwargs):
+            self.calls.append(kwargs)
+            return {"location": "Earth", "label": kwargs["label"]}
+        setup_path.patch(self,
+                         (location_utilities, "location_infos", LocationCache(self.tmp / "locations.sqlite")),
+                         (location_utilities, "get_location_info", get_location_info))
+
+    def test_geohash(self):
+        assert geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+        assert geohash(48.8049, 2.2344) == geohash(48.8051, 2.2346)
+        assert geohash(48.8049, 2.2344) != geohash(48.81, 2.24)
+
+    def test_cache(self):
+        cache = LocationCache(self.tmp / "cache.sqlite")
+        cache["latlong/48.8049/2.2344"] = {"country": "France"}
+        cache["geocode/Meudon"] = {}
+        # Saved when set
+        cache = LocationCache(self.tmp / "cache.sqlite")
+        assert cache["latlong/48.8049/2.2344"] == {"country": "France"}
+        assert cache.get("geocode/Meudon") == {}
+        assert cache.get("geocode/Paris") is None
+        assert len(cache) == 2
+        # Same geohash cell
+        assert cache.near(48.8051, 2.2346) == {"country": "France"}
+        assert cache.near(48.81, 2.24) is None
+        # Nearest point of the cell
+        cache["latlong/48.8053/2.2349"] = {"country": "Nearest"}
+        assert cache.near(48.8052, 2.2348) == {"country": "Nearest"}
+        assert cache.near(48.8049, 2.2345) == {"country": "France"}
+
+        (self.tmp / "location_infos.json").write_text(json.dumps({"geocode/Meudon": {"country": "France"},
+                                                                  "country/France": {"continent": "Europe"}}))
+        assert cache.import_json(self.tmp / "location_infos.json") == 1
+        assert cache["geocode/Meudon"] == {} # Not replaced
+        assert cache["country/France"] == {"continent": "Europe"}
+
+    def test_queue(self):
+        queue = GeocodingQueue()
+        queue.add("a", label = "Alpha", address = {"Pasadena, CA, USA"}, from_cache = True)
+        queue.add("b", label = "alpha", address = "pasadena ca usa", from_cache = True)
+        queue.add("c", label = "Beta", address = "Pasadena, CA, USA", from_cache = True)
+        queue.add("d", label = "Gamma", latitude = {48.8049}, longitude = {2.2344}, from_cache = True)
+        queue.add("e", label = "Gamma", latitude = 48.8051, longitude = 2.2346, from_cache = True)
+        queue.add("f", label = "Delta", latitude = 48.8051, longitude = 2.2346, from_cache = True)
+        locations = queue.resolve()
+        # Only the same requests are resolved once: the label is geocoded
+        # when the address or the coordinates are not found
+        assert sorted(call["label"] for call in self.calls) == ["Alpha", "Beta", "Delta", "Gamma"]
+        assert locations["a"] == locations["b"] == {"location": "Earth", "label": "Alpha"}
+        assert locations["c"] == {"location": "Earth", "label": "Beta"}
+        assert locations["d"] == locations["e"] == {"location": "Earth", "label": "Gamma"}
+        assert locations["f"] == {"location": "Earth", "label": "Delta"}
+        assert queue.report() == {"requests": 6, "locations": 4, "hits": 0, "misses": 4}
+
+        # Saved in the cache
+        location_utilities.location_infos = LocationCache(self.tmp / "locations.sqlite")
+        queue.add("g", label = "Alpha", address = "Pasadena, CA, USA", from_cache = True)
+        queue.add("h", label = "Gamma", latitude = 48.805, longitude = 2.2345, from_cache = True)
+        queue.add("i", label = "Meudon", location = "France", from_cache = True)
+        locations = queue.resolve()
+        assert len(self.calls) == 5
+        assert self.calls[-1]["label"] == "Meudon"
+        assert locations["g"] == {"location": "Earth", "label": "Alpha"}
+        assert locations["h"] == {"location": "Earth", "label": "Gamma"}
+        assert queue.report() == {"requests": 9, "locations": 7, "hits": 2, "misses": 5}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import setup_path
+import config
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from urllib.parse import urlparse
+from evaluation.benchmark_paged_retrieval import nssdc_pages_sequential, write_fixtures
+from graph.extractor import cache
+from graph.extractor.cache import CacheManager
+from graph.extractor import nssdc_extractor
+from graph.extractor.list_stub import ListStub
+from graph.extractor.nssdc_extractor import NssdcExtractor
+
+
+class TestNssdcExtractor(unittest.TestCase):
+
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        write_fixtures(Path(tmp.name) / "fixtures", 30)
+
+        self.stub = ListStub(Path(tmp.name) / "fixtures", port = 0)
+        threading.Thread(target = self.stub.serve_forever, daemon = True).start()
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+
+        setup_path.patch(self,
+                         (config, "NSSDC_HOST", self.stub.url),
+                         (cache, "CACHE_DIR", Path(tmp.name) / "cache"),
+                         (CacheManager, "PACK", None),
+                         (nssdc_extractor, "EXTRACT_BATCH_SIZE", 8),
+                         (CacheManager.POOL, "host_limits", {urlparse(self.stub.url).netloc: (4, -1)}))
+
+    def test_extract(self):
+        result = NssdcExtractor().extract()
+        # One query per discipline, one request per spacecraft
+        assert self.stub.requests_count == 4 + 30
+        assert len(result) == 30
+        # Sorted by url, whatever the order of the downloads
+        assert list(result)[:2] == ["Spacecraft 0", "Spacecraft 1"]
+        data = result["Spacecraft 1"]
+        assert data["url"] == "https://nssdc.gsfc.nasa.gov/nmc/spacecraft/display.action?id=1991-001A"
+        assert data["code"] == "1991-001A"
+        assert data["alt_label"] == ["SC-1"]
+        assert data["launch_date"] == "1991-01-01"
+
+        # Same pages as the requests one after the other (from cache)
+        assert CacheManager.get_many([config.NSSDC_HOST + entity_url
+                                      for entity_url in NssdcExtractor()._get_entities_url()],
+                                     NssdcExtractor.CACHE) == nssdc_pages_sequential(NssdcExtractor())
+        assert self.stub.requests_count == 4 + 30
+
+    def test_iter_extract(self):
+        batches = list(NssdcExtractor().iter_extract())
+        assert [len(batch) for batch in batches] == [8, 8, 8, 6]
+        assert {k: v for batch in batches for k, v in batch.items()} == NssdcExtractor().extract()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import setup_path
+import tempfile
+import unittest
+from pathlib import Path
+from utils import location_utilities
+from utils import offline_geocoder
+from utils.offline_geocoder import OfflineGeocoder
+
+
+# geonameid, name, asciiname, alternatenames, latitude, longitude, feature class,
+# feature code, country code, cc2, admin1, admin2, admin3, admin4, population
+PLACES = [["2988507", "Paris", "Paris", "Lutece,Parigi,Париж", "48.85341", "2.3488", "P", "PPLC", "FR", "", "11", "75", "", "", "2138551"],
+          ["2994144", "Meudon", "Meudon", "", "48.81381", "2.235", "P", "PPL", "FR", "", "11", "92", "", "", "45352"],
+          ["5381396", "Pasadena", "Pasadena", "", "34.14778", "-118.14452", "P", "PPL", "US", "", "CA", "037", "", "", "141029"],
+          ["4717232", "Pasadena", "Pasadena", "", "29.69106", "-95.2091", "P", "PPL", "US", "", "TX", "201", "", "", "151950"],
+          ["5855927", "Hilo", "Hilo", "", "19.72991", "-155.09073", "P", "PPLA2", "US", "", "HI", "001", "", "", "43263"],
+          ["5851203", "Mauna Kea Observatories", "Mauna Kea Observatories", "Mauna Kea Observatory", "19.82076", "-155.46808", "S", "OBS", "US", "", "HI", "001", "", "", "0"],
+          ["3873544", "Cerro Paranal", "Cerro Paranal", "Paranal", "-24.62722", "-70.40444", "T", "MT", "CL", "", "02", "", "", "", "0"]]
+
+REGIONS = [["FR.11", "Île-de-France", "Ile-de-France", "3012874"],
+           ["US.CA", "California", "California", "5332921"],
+           ["US.TX", "Texas", "Texas", "4736286"],
+           ["US.HI", "Hawaii", "Hawaii", "5855797"]]
+
+
+class TestOfflineGeocoder(unittest.TestCase):
+
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.gazetteer = Path(tmp.name) / "gazetteer"
+        self.gazetteer.mkdir()
+        (self.gazetteer / "places.txt").write_text("\n".join("\t".join(row + ["", "", "", "Europe/Paris", "2024-01-01"])
+                                                             for row in PLACES), encoding = "utf-8")
+        (self.gazetteer / "admin1CodesASCII.txt").write_text("\n".join("\t".join(row) for row in REGIONS),
+                                                            encoding = "utf-8")
+        def no_request(*args, **kwargs):
+            raise AssertionError("Nominatim must not be requested")
+        setup_path.patch(self,
+                         (OfflineGeocoder, "_INDEX_FILE", Path(tmp.name) / "gazetteer.pickle"),
+                         (OfflineGeocoder, "_LOADED", False),
+                         (OfflineGeocoder, "_GEOCODER", None),
+                         (offline_geocoder, "GAZETTEER_DIR", self.gazetteer),
+                         (location_utilities.config, "GEOCODER", "offline"),
+                         (location_utilities.config, "GEOCODER_FALLBACK", False),
+                         (location_utilities, "nominatim_reverse", no_request),
+                         (location_utilities, "nominatim_geocode", no_request),
+                         (location_utilities, "location_infos", dict()))
+
+    def test_reverse(self):
+        geocoder = OfflineGeocoder.load(self.gazetteer)
+        result = geocoder.reverse((48.805, 2.23))
+        assert result.raw["addresstype"] == "city"
+        assert result.raw["name"] == "Meudon"
+        assert result.raw["address"] == {"city": "Meudon",
+                                         "state": "Île-de-France",
+                                         "country": "France",
+                                         "country_code": "fr"}
+        # Far from a city: only in its region
+        result = geocoder.reverse((19.83, -155.47))
+        assert result.raw["addresstype"] == "state"
+        assert result.raw["address"]["state"] == "Hawaii"
+        assert result.latitude == 19.83
+        # In the ocean
+        assert geocoder.reverse((30., -40.)) is None
+
+    def test_geocode(self):
+        geocoder = OfflineGeocoder.load(self.gazetteer)
+        assert geocoder.geocode("PARIS").raw["address"]["country"] == "France"
+        assert geocoder.geocode("Parigi").raw["name"] == "Paris"
+        # Most populated
+        assert geocoder.geocode("Pasadena").raw["address"]["state"] == "Texas"
+        # In the address' region
+        assert geocoder.geocode("Pasadena, CA, USA").raw["address"]["state"] == "California"
+        assert geocoder.geocode("Mauna Kea Observatory").raw["addresstype"] == "man_made"
+        assert geocoder.geocode("Tokyo, Japan").raw["addresstype"] == "country"
+        assert geocoder.geocode("Africa").raw["addresstype"] == "continent"
+        assert geocoder.geocode("Cassini") is None
+
+    def test_load_from_cache(self):
+        geocoder = OfflineGeocoder.load(self.gazetteer)
+        assert OfflineGeocoder._INDEX_FILE.exists()
+        assert OfflineGeocoder.load(self.gazetteer).places == geocoder.places
+        # Built again when the gazetteer changes
+        with open(self.gazetteer / "places.txt", "a", encoding = "utf-8") as file:
+            file.write("\n" + "\t".join(["2983990", "Reims", "Reims", "", "49.26526", "4.02853", "P", "PPL",
+                                         "FR", "", "44", "51", "", "", "180752", "", "", "", "", ""]))
+        assert OfflineGeocoder.load(self.gazetteer).geocode("Reims") is not None
+
+    def test_get_location_info(self):
+        result = location_utilities.get_location_info(latitude = 48.81, longitude = 2.235, from_cache = False)
+        assert result["city"] == "Meudon"
+        assert result["country"] == "France"
+        assert result["continent"] == "Europe"
+        result = location_utilities.get_location_info(label = "Paranal", from_cache = False)
+        assert result["country"] == "Chile"
+        assert result["continent"] == "South America"
+        result = location_utilities.get_location_info(address = {"Pasadena, CA, USA"}, from_cache = False)
+        assert result["state"] == "California"
+
+    def test_queue_labels(self):
+        # The same unknown address: the labels are geocoded
+        queue = location_utilities.GeocodingQueue()
+        queue.add("vlt", label = "Paranal", address = {"Unknown road, Nowhere"}, from_cache = True)
+        queue.add("keck", label = "Mauna Kea Observatories", address = {"Unknown road, Nowhere"}, from_cache = True)
+        locations = queue.resolve()
+        assert locations["vlt"]["country"] == "Chile"
+        assert locations["keck"]["country"] == "United States"
+        assert locations["vlt"] == location_utilities.get_location_info(label = "Paranal", from_cache = False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import setup_path
+import config
+import llm.llm_connection
+import tempfile
+import threading
+import unittest
+import requests
+from graph.extractor.http_pool import HttpPool
+from pathlib import Path
+from llm.llm_connection import LLMConnection
+from llm.ollama_stub import OllamaStub, fake_generation
+
+
+class TestOllamaStub(unittest.TestCase):
+
+
+    def start(self, **kwargs):
+        server = OllamaStub(port = 0, **kwargs)
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        setup_path.patch(self, (config, "OLLAMA_HOST", server.url))
+        return server
+
+    def test_generate(self):
+        self.start()
+        prompt = "Say weither those entities are the same or distinct.\n" + \
+                 "\nEntity 1: Hubble Space Telescope\nEntity 2: Hubble Space Telescope"
+        response = LLMConnection.generate(prompt, "stub", from_cache = False)
+        assert response.startswith("response: same.")
+        assert response == LLMConnection.generate(prompt, "stub", from_cache = False)
+
+    def test_classify_prompt(self):
+        prompt = "Categories : \n-spacecraft\n-telescope\n\nText to classify: Hubble"
+        assert fake_generation(prompt) in ["spacecraft", "telescope"]
+
+    def test_embed_batch(self):
+        self.start()
+        embeddings = LLMConnection.embed_batch(["Hubble", "Voyager 1", "Hubble"], model = "stub")
+        assert len(embeddings) == 3
+        assert embeddings[0] == embeddings[2]
+        assert embeddings[0] != embeddings[1]
+
+    def test_embed_batch_retries(self):
+        setup_path.patch(self,
+                         (LLMConnection, "_POOL", HttpPool(requests_per_second = -1,
+                                                           retries = 2,
+                                                           backoff = 0.01)))
+        server = self.start(error_rate = 0.5, seed = 9) # The first request fails
+        assert len(LLMConnection.embed_batch(["Hubble"] * 20, model = "stub")) == 20
+        assert 0 < server.errors_count < server.requests_count
+        server = self.start(error_rate = 1.)
+        with self.assertRaises(requests.ConnectionError):
+            LLMConnection.embed_batch(["Hubble"], model = "stub")
+        assert server.requests_count == 3 # 1 request + 2 retries
+
+    def test_show(self):
+        server = self.start(context_length = 2048)
+        infos = requests.post(f"{server.url}/api/show", json = {"model": "stub"}).json()["model_info"]
+        assert infos["stub.context_length"] == 2048
+
+    def test_context_length(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        setup_path.patch(self,
+                         (llm.llm_connection, "LLM_MODELS_FILE", Path(tmp_dir.name) / "llm_models.json"),
+                         (LLMConnection, "_context_length", dict()))
+        self.start(context_length = 2048)
+        assert LLMConnection._get_llm_context_length("stub") == 2048
+        # The same model name on another host
+        self.start(context_length = 4096)
+        assert LLMConnection._get_llm_context_length("stub") == 4096
+        LLMConnection._context_length = dict()
+        assert LLMConnection._get_llm_context_length("stub") == 4096
+
+    def test_error_injection(self):
+        server = self.start(error_rate = 1.)
+        with self.assertRaises(requests.ConnectionError):
+            LLMConnection.generate("prompt", "stub", from_cache = False)
+        assert server.errors_count == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
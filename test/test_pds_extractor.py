@@ -0,0 +1,80 @@
+import setup_path
+import tempfile
+import unittest
+from pathlib import Path
+from graph import entity_types
+from graph.extractor import cache
+from graph.extractor.cache import CacheManager
+from graph.extractor.pds_extractor import PdsExtractor, parse_label
+
+
+LABEL = """<?xml version="1.0" encoding="UTF-8"?>
+<Product_Context xmlns="http://pds.nasa.gov/pds4/pds/v1">
+  <Identification_Area>
+    <logical_identifier>urn:nasa:pds:context:telescope:{name}</logical_identifier>
+    <title>{title}</title>
+    <Alias_List>
+      <Alias>
+        <alternate_id>{name}-alias</alternate_id>
+        <comment>Not kept</comment>
+      </Alias>
+    </Alias_List>
+    <Modification_History>
+      <Modification_Detail>
+        <description>Not kept</description>
+      </Modification_Detail>
+    </Modification_History>
+  </Identification_Area>
+  <Reference_List>
+    <Internal_Reference>
+      <lid_reference>urn:nasa:pds:context:facility:observatory.{name}</lid_reference>
+      <reference_type>telescope_to_facility</reference_type>
+    </Internal_Reference>
+  </Reference_List>
+  <Telescope>
+    <name>{title} Telescope</name>
+    <description>A
+      telescope</description>
+    <aperture unit="m">2.4</aperture>
+    <telescope_latitude>NULL</telescope_latitude>
+  </Telescope>
+</Product_Context>"""
+
+
+class TestPdsExtractor(unittest.TestCase):
+
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        setup_path.patch(self,
+                         (cache, "CACHE_DIR", Path(tmp.name)),
+                         (CacheManager, "PACK", None))
+
+    def test_parse_label(self):
+        data = parse_label(LABEL.format(name = "t1", title = "T1"), "telescope", "url")
+        assert data == {"is_part_of": ["urn:nasa:pds:context:facility:observatory.t1"],
+                        "label": "T1 Telescope",
+                        "description": {"A telescope"},
+                        "aperture": {"2.4m"},
+                        "alt_label": {"t1-alias"},
+                        "url": "url",
+                        "code": "urn:nasa:pds:context:telescope:t1",
+                        "type": entity_types.TELESCOPE,
+                        "type_confidence": 1}
+
+    def test_iter_labels(self):
+        resources = []
+        for i in range(20):
+            url = f"{PdsExtractor.URL}telescope/t{i}_1.0.xml"
+            CacheManager.save_cache(LABEL.format(name = f"t{i}", title = f"T{i}"),
+                                    CacheManager._get_cache_path(url, PdsExtractor.CACHE))
+            resources.append(("telescope", url))
+        entities = list(PdsExtractor()._iter_labels(resources, from_cache = True))
+        # In the resources' order
+        assert [data["url"] for data in entities] == [url for _, url in resources]
+        assert entities[3]["label"] == "T3 Telescope"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import setup_path
+from data_mapper.prescreen import PreScreen
+from graph.mapping_graph import MappingGraph
+from graph.properties import Properties
+from rdflib import Graph, Literal, XSD
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+properties = Properties()
+
+
+def decisions(n = 200, seed = 0):
+    rng = random.Random(seed)
+    result = []
+    for _ in range(n):
+        is_same = rng.random() < 0.3
+        label = rng.uniform(0.6, 1.) if is_same else rng.uniform(0., 0.7)
+        result.append(({"levenshtein_similarity": label,
+                        "distance_filter": -1.}, is_same))
+    return result
+
+
+class TestPreScreen(unittest.TestCase):
+
+
+    def test_reject(self):
+        prescreen = PreScreen(threshold = 0.05)
+        assert prescreen.fit_decisions(decisions())
+        assert prescreen.reject({"levenshtein_similarity": 0.05})[0]
+        assert not prescreen.reject({"levenshtein_similarity": 0.95})[0]
+        report = prescreen.report()
+        assert report["llm_calls_saved"] == 1
+        assert report["checked"] == 2
+        assert report["held_out_decisions"] == 40
+        assert 0 <= report["false_reject_rate"] <= 1
+
+    def test_not_enough_decisions(self):
+        prescreen = PreScreen()
+        assert not prescreen.fit_decisions(decisions(n = 10))
+        assert prescreen.reject({"levenshtein_similarity": 0.})[0] is False
+
+    def test_load_decisions(self):
+        sssom = MappingGraph._SSSOM
+        graph = Graph()
+        for i, (predicate, validator) in enumerate([(properties.exact_match, "gemma3:4b"),
+                                                    (properties.distinct, "gemma3:4b"),
+                                                    (properties.distinct, PreScreen.NAME)]):
+            mapping = properties.OBS[f"mapping{i}"]
+            graph.add((mapping, sssom.predicate_id, predicate))
+            graph.add((mapping, sssom.similarity_measure, Literal("hybrid", datatype = XSD.string)))
+            graph.add((mapping, sssom.creator_label, Literal(validator, datatype = XSD.string)))
+            graph.add((mapping, sssom.similarity_score, Literal(0.5, datatype = XSD.float)))
+            graph.add((mapping, properties.OBS["tfidf"], Literal(0.1 * i, datatype = XSD.float)))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mapping_file = Path(tmp_dir) / "mapping.ttl"
+            graph.serialize(destination = mapping_file, format = "ttl")
+            loaded = sorted(PreScreen.load_decisions([mapping_file]), key = lambda d: d[0]["tfidf"])
+        assert len(loaded) == 2
+        assert loaded[0] == ({"tfidf": 0., "hybrid": 0.5}, True)
+        assert loaded[1][1] is False
+
+
+if __name__ == "__main__":
+    unittest.main()
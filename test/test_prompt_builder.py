@@ -0,0 +1,37 @@
+import setup_path
+from llm.prompt_builder import PromptBuilder, count_tokens, truncate_to_tokens
+import unittest
+
+
+class TestPromptBuilder(unittest.TestCase):
+
+
+    def test_count_tokens(self):
+        assert count_tokens("") == 0
+        assert count_tokens("a b, c.") == 5
+        assert count_tokens("spectrometer") == 3
+
+    def test_truncate_to_tokens(self):
+        assert truncate_to_tokens("one two three four", 2) == "one two"
+        assert truncate_to_tokens("one two", 10) == "one two"
+        assert truncate_to_tokens("one two", 0) == ""
+
+    def test_instructions_are_kept(self):
+        instructions = "Say whether those entities are the same or distinct.\n"
+        long_text = "word " * 1000
+        prompt = PromptBuilder.build("test",
+                                     instructions = instructions,
+                                     sections = [("\nEntity 1: ", long_text),
+                                                 ("\nEntity 2: ", "Hubble Space Telescope")],
+                                     context_length = 200,
+                                     reserved_tokens = 50)
+        assert prompt.startswith(instructions)
+        assert prompt.endswith("\nEntity 2: Hubble Space Telescope")
+        assert count_tokens(prompt) <= 150
+        counts = PromptBuilder.get_token_counts()["test"]
+        assert counts["calls"] == 1
+        assert counts["truncated"] == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import setup_path
+import copy
+import json
+import random
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+from evaluation.benchmark_spase_self_merge import merge_blocked, merge_pairwise
+from graph import entity_types
+from graph.extractor import cache
+from graph.extractor import spase_extractor
+from graph.extractor.spase_extractor import SpaseExtractor
+
+
+def _observatory(name: str) -> dict:
+    return {"Spase": {"Observatory": {"ResourceID": f"spase://SMWG/Observatory/{name}",
+                                      "ResourceHeader": {"ResourceName": name,
+                                                         "Description": f"The {name} observatory"},
+                                      "Location": {"ObservatoryRegion": "Earth.Surface"}}}}
+
+
+def _entities(seed: int,
+              count: int) -> dict:
+    """
+    Random SPASE entities (before merging) sharing labels,
+    acronyms, identifiers, locations and hosts.
+    """
+    rand = random.Random(seed)
+    words = ["IAGA", "Cluster", "Swarm", "Fort.Rae", "Obs", "-x"]
+    def label():
+        label = " ".join(rand.choice(words) for _ in range(rand.randint(1, 3)))
+        if rand.random() < .3:
+            label += f" ({rand.choice(['AB', 'A (B) C'])})"
+        if rand.random() < .3:
+            label += f" {rand.randint(1, 3)}"
+        return label
+    uris = sorted({f"/SMWG/{rand.choice(['Observatory', 'Deprecated'])}/{label().replace(' ', '_')}{rand.randint(0, 5)}"
+                   for _ in range(count)})
+    result = dict()
+    for uri in uris:
+        data = {"label": label(),
+                "type": rand.choice([entity_types.GROUND_FACILITY, entity_types.SPACE_FACILITY, entity_types.INSTRUMENT]),
+                "code": {uri},
+                "url": {"https://hpde.io/" + uri.split('/')[-1][:4] + ".json"}}
+        if rand.random() < .5:
+            data["alt_label"] = {label() for _ in range(rand.randint(1, 3))}
+        if rand.random() < .2:
+            data["NSSDCA_ID"] = {rand.choice(["1990-037B", "1977-084A"])}
+        if rand.random() < .3:
+            data["latitude"] = {rand.uniform(0, 2)}
+            data["longitude"] = {rand.uniform(0, 2)}
+        elif rand.random() < .3:
+            data["start_date"] = {rand.choice(["2001", "2002"])}
+        result[uri] = data
+    hosts = [uri for uri in uris if result[uri]["type"] != entity_types.INSTRUMENT]
+    for uri in uris:
+        if result[uri]["type"] == entity_types.INSTRUMENT:
+            result[uri]["is_part_of"] = {rand.choice(hosts)}
+    return result
+
+
+class TestSpaseExtractor(unittest.TestCase):
+
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # Local repository cloned by the extractor
+        self.origin = Path(tmp.name) / "origin" / "hpde.io"
+        self.origin.mkdir(parents = True)
+        self._git("init", "-q")
+        for name in ["Alpha", "Beta", "Gamma"]:
+            self._write(name)
+        (self.origin / "README.md").write_text("Not extracted")
+        self._commit()
+        setup_path.patch(self,
+                         (cache, "CACHE_DIR", Path(tmp.name) / "cache"),
+                         (spase_extractor, "CACHE_DIR", Path(tmp.name) / "cache"),
+                         (SpaseExtractor, "URL", str(self.origin)),
+                         (SpaseExtractor, "_PARSED_FILES_FILE", Path(tmp.name) / "parsed_files.pickle"),
+                         (SpaseExtractor, "PARSED_FILES", None))
+        # git clone appends .git to the url
+        (self.origin.parent / "hpde.io.git").symlink_to(self.origin)
+
+    def _git(self, *command):
+        subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@test"] + list(command),
+                       cwd = self.origin, check = True, capture_output = True)
+
+    def _write(self, name: str):
+        file = self.origin / "SMWG" / "Observatory" / f"{name}.json"
+        file.parent.mkdir(parents = True, exist_ok = True)
+        file.write_text(json.dumps(_observatory(name)))
+
+    def _commit(self):
+        self._git("add", "-A")
+        self._git("commit", "-q", "-m", "update")
+
+    def test_incremental(self):
+        result = SpaseExtractor().extract()
+        assert result.keys() == {"/SMWG/Observatory/Alpha", "/SMWG/Observatory/Beta", "/SMWG/Observatory/Gamma"}
+
+        (self.origin / "SMWG" / "Observatory" / "Beta.json").unlink()
+        self._write("Delta")
+        self._write("Éta") # Quoted by git diff without -z
+        data = _observatory("Gamma")
+        data["Spase"]["Observatory"]["ResourceHeader"]["Description"] = "Modified"
+        (self.origin / "SMWG" / "Observatory" / "Gamma.json").write_text(json.dumps(data))
+        self._commit()
+        # Not in the diff: Alpha is not parsed again
+        clone = spase_extractor.CACHE_DIR / SpaseExtractor.CACHE / SpaseExtractor.GIT_REPO
+        alpha = clone / "SMWG" / "Observatory" / "Alpha.json"
+
+        SpaseExtractor.PARSED_FILES = None # Loaded from its file
+        result = SpaseExtractor().extract()
+        assert alpha.read_text() == json.dumps(_observatory("Alpha"))
+        assert result.keys() == {"/SMWG/Observatory/Alpha", "/SMWG/Observatory/Delta", "/SMWG/Observatory/Éta",
+                                 "/SMWG/Observatory/Gamma"}
+        assert result["/SMWG/Observatory/Gamma"]["description"] == {"Modified"}
+
+        # Same result as a full extraction
+        alpha.write_text("")
+        incremental = SpaseExtractor().extract()
+        assert incremental == result
+        full = SpaseExtractor().extract(from_cache = False)
+        assert full.keys() == {"/SMWG/Observatory/Delta", "/SMWG/Observatory/Éta",
+                               "/SMWG/Observatory/Gamma"} # Alpha.json is empty
+        alpha.write_text(json.dumps(_observatory("Alpha")))
+        assert SpaseExtractor().extract(from_cache = False) == result
+
+    def test_blob_hash(self):
+        file = self.origin / "SMWG" / "Observatory" / "Alpha.json"
+        git_hash = subprocess.run(["git", "hash-object", str(file)], capture_output = True, text = True).stdout.strip()
+        assert spase_extractor.blob_hash(file.read_bytes()) == git_hash
+
+    def test_self_merge_blocking(self):
+        # The blocking index merges the same entities as the comparison of every pair
+        for seed in range(5):
+            entities = _entities(seed, 120)
+            merged = merge_blocked(SpaseExtractor(), copy.deepcopy(entities))
+            assert len(merged) < len(entities)
+            assert merged == merge_pairwise(SpaseExtractor(), copy.deepcopy(entities))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,226 @@
+import setup_path
+import update
+from graph.graph import Graph
+from graph.extractor.aas_extractor import AasExtractor
+from graph.extractor.naif_extractor import NaifExtractor
+from graph.extractor.cache import CacheManager, VersionManager, VersionStream
+from graph.entity import Entity
+from pathlib import Path
+from rdflib.namespace import OWL
+import tempfile
+import time
+import unittest
+
+
+@unittest.skipUnless(CacheManager.in_cache(AasExtractor.URL, AasExtractor.CACHE),
+                     "AAS page is not in the cache folder")
+class TestParallelExtraction(unittest.TestCase):
+
+
+    def _extract(self,
+                 jobs: int) -> list:
+        result = []
+        for Extractor, batches in update.extract_all([AasExtractor], jobs = jobs):
+            data = dict()
+            for batch in batches:
+                data.update(batch)
+            result.append((Extractor, data, batches.seconds))
+        return result
+
+    def test_threads(self):
+        serial = self._extract(jobs = 1)
+        parallel = self._extract(jobs = 2)
+        assert [e for e, _, _ in serial] == [e for e, _, _ in parallel] == [AasExtractor]
+        assert serial[0][1] == parallel[0][1]
+        assert parallel[0][2] >= 0
+
+    def test_processes(self):
+        serial = self._extract(jobs = 1)
+        setup_path.patch(self, (update, "CPU_BOUND_EXTRACTORS", [AasExtractor]))
+        parallel = self._extract(jobs = 2)
+        assert serial[0][1] == parallel[0][1]
+
+
+class _CountingExtractor():
+    """
+    Yields 20 batches of 1 entity and counts the extracted batches.
+    """
+    NAMESPACE = "counting"
+    CACHE = "counting/"
+    extracted = 0
+
+    def iter_extract(self,
+                     from_cache: bool = True):
+        for i in range(20):
+            type(self).extracted += 1
+            yield {f"e{i}": {"label": f"e{i}", "type": "spacecraft"}}
+
+
+class _OtherCountingExtractor(_CountingExtractor):
+    NAMESPACE = "other_counting"
+    CACHE = "other_counting/"
+    extracted = 0
+
+
+class TestExtractionQueue(unittest.TestCase):
+
+
+    def setUp(self):
+        _CountingExtractor.extracted = 0
+        _OtherCountingExtractor.extracted = 0
+
+    def test_bounded(self):
+        ahead = []
+        for Extractor, batches in update.extract_all([_CountingExtractor, _OtherCountingExtractor], jobs = 2):
+            for i, batch in enumerate(batches):
+                time.sleep(0.01)
+                ahead.append(Extractor.extracted - i)
+            if Extractor is _CountingExtractor:
+                # Run at the same time, but only a few batches in advance
+                assert 0 < _OtherCountingExtractor.extracted <= update.EXTRACT_QUEUE_SIZE + 2
+        assert len(ahead) == 40
+        assert max(ahead) <= update.EXTRACT_QUEUE_SIZE + 2
+
+    def test_processes(self):
+        setup_path.patch(self, (update, "CPU_BOUND_EXTRACTORS", [_CountingExtractor]))
+        result = []
+        for Extractor, batches in update.extract_all([_CountingExtractor, _OtherCountingExtractor], jobs = 2):
+            for batch in batches:
+                result.extend(batch)
+            break
+        assert result == [f"e{i}" for i in range(20)]
+
+    def test_stopped(self):
+        # The extractors are stopped when their batches are not consumed
+        for Extractor, batches in update.extract_all([_CountingExtractor, _OtherCountingExtractor], jobs = 2):
+            next(batches)
+            break
+        assert _CountingExtractor.extracted < 20
+        assert _OtherCountingExtractor.extracted < 20
+
+
+class TestAddEntities(unittest.TestCase):
+
+
+    def test_replace_source(self):
+        Graph(replace = True)
+        updater = update.Updater()
+        updater.add_entities({"Hubble": {"label": "Hubble", "type": "spacecraft"}},
+                             extractor = AasExtractor())
+        updater.add_entities({"Voyager": {"label": "Voyager", "type": "spacecraft"}},
+                             extractor = NaifExtractor())
+        graph = updater.graph.graph
+        aas = updater.graph.get_namespace(AasExtractor.NAMESPACE)
+        naif = updater.graph.get_namespace(NaifExtractor.NAMESPACE)
+        naif_triples = set(graph.triples((naif["voyager"], None, None)))
+        assert naif_triples
+
+        updater.add_entities({"JWST": {"label": "JWST", "type": "spacecraft"}},
+                             extractor = AasExtractor())
+        assert not set(graph.triples((aas["hubble"], None, None)))
+        assert set(graph.triples((aas["jwst"], None, None)))
+        assert set(graph.triples((naif["voyager"], None, None))) == naif_triples
+        Graph(replace = True)
+
+    def _versions(self,
+                  versions: list[dict],
+                  stream: bool,
+                  incremental: bool,
+                  remove_deprecated: bool = True) -> tuple[set, list]:
+        """
+        Triples and changesets after the updates of the versions, added
+        by batches of 2 entities (add_stream) or at once (a VersionStream
+        of the whole data, then add_entities that replaces all the
+        entities of the list, as before the streaming extractors).
+        """
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        setup_path.patch(self, (VersionManager, "VERSION_MANAGER", Path(tmp.name)))
+        Graph(replace = True)
+        updater = update.Updater()
+        extractor = AasExtractor()
+        changes = []
+        for version in versions:
+            data = [(k, dict(v)) for k, v in version]
+            if stream:
+                batches = [dict(data[i:i + 2]) for i in range(0, len(data), 2)]
+                changes.append(updater.add_stream(batches,
+                                                  extractor = extractor,
+                                                  remove_deprecated = remove_deprecated,
+                                                  incremental = incremental))
+            else:
+                data = dict(data) # Yielded again: replaces the previous entity
+                old_data = {entity: Entity(entity).data
+                            for entity, in updater.graph.get_entities_from_list(extractor)}
+                version_stream = VersionStream(extractor,
+                                               remove_deprecated = remove_deprecated,
+                                               input_graph_values = old_data)
+                version_stream.add(data)
+                data.update(version_stream.close())
+                changes.append(version_stream.changes)
+                updater.add_entities(data,
+                                     extractor = extractor)
+        # Without the ontology's metadata (versions of the lists)
+        triples = {triple for triple in updater.graph.graph if triple[0] != OWL.Ontology}
+        Graph(replace = True)
+        return triples, changes
+
+    def test_version_mismatch(self):
+        first = {"Hubble": {"label": "Hubble", "type": "spacecraft"},
+                 "Voyager": {"label": "Voyager", "type": "spacecraft"}}
+        second = {"Hubble": {"label": "Hubble", "alt_label": {"HST"}, "type": "spacecraft"},
+                  "JWST": {"label": "JWST", "type": "spacecraft"}}
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        setup_path.patch(self, (VersionManager, "VERSION_MANAGER", Path(tmp.name)))
+        extractor = AasExtractor()
+        Graph(replace = True)
+        updater = update.Updater()
+        updater.add_stream([{k: dict(v) for k, v in first.items()}], extractor = extractor)
+        assert updater.graph.version_states()[extractor.NAMESPACE]
+        # Another update replaces the version files with the second version
+        versions = VersionStream(extractor)
+        versions.add({k: dict(v) for k, v in second.items()})
+        versions.close()
+        # No changes with the version files, but the ontology has the first version
+        changes = updater.add_stream([{k: dict(v) for k, v in second.items()}],
+                                     extractor = extractor,
+                                     incremental = True)
+        assert not any(changes.values())
+        assert updater.graph.version_states()[extractor.NAMESPACE] == versions.state
+        triples = {triple for triple in updater.graph.graph if triple[0] != OWL.Ontology}
+        # Hubble is replaced too
+        assert triples == self._versions([list(second.items())], stream = False, incremental = False)[0]
+
+    def test_stream(self):
+        first = [("Hubble", {"label": "Hubble", "type": "spacecraft"}),
+                 ("Voyager", {"label": "Voyager", "type": "spacecraft"}),
+                 ("Gaia", {"label": "Gaia", "type": "spacecraft"}),
+                 ("Cassini", {"label": "Cassini", "type": "spacecraft"}),
+                 ("No type", {"label": "No type"})]
+        second = [("Hubble", {"label": "Hubble", "alt_label": {"HST"}, "type": "spacecraft"}),
+                  ("JWST", {"label": "JWST", "type": "spacecraft"}),
+                  ("Gaia", {"label": "Gaia", "type": "spacecraft"}),
+                  ("Cassini", {"label": "Cassini", "type": "spacecraft"}),
+                  ("cassini", {"label": "Cassini probe", "type": "spacecraft"}), # Same URI
+                  ("JWST", {"label": "Webb", "type": "spacecraft"})] # Yielded again
+        third = [("Gaia", {"label": "Gaia", "type": "spacecraft"}),
+                 ("Cassini", {"label": "Cassini", "type": "spacecraft"})]
+        # [first, second, first]: Voyager is deprecated, then extracted again
+        for versions in [[first], [first, second], [first, second, third], [second, third], [third, first],
+                         [first, second, first]]:
+            for incremental in [False, True]:
+                for remove_deprecated in [True, False]:
+                    kwargs = {"incremental": incremental, "remove_deprecated": remove_deprecated}
+                    assert self._versions(versions, stream = True, **kwargs) == \
+                           self._versions(versions, stream = False, **kwargs)
+        # The reappearing entity is replaced, without its deprecated value
+        triples, changes = self._versions([first, second, first], stream = True,
+                                          incremental = True, remove_deprecated = False)
+        assert "Voyager" in changes[1]["removed"] and "Voyager" in changes[2]["modified"]
+        voyager = {(str(p), str(o)) for s, p, o in triples if str(s).endswith("#voyager")}
+        assert voyager and not any("deprecated" in p.lower() for p, _ in voyager)
+
+
+if __name__ == "__main__":
+    unittest.main()
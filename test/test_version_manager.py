@@ -0,0 +1,111 @@
+import setup_path
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from graph.extractor.cache import VersionJournal, VersionManager, VersionStream
+
+
+class _Extractor():
+    NAMESPACE = "test"
+
+
+def compare_versions(new_data: dict,
+                     remove_deprecated: bool = True) -> dict:
+    """
+    Compare all the entities with the previous version at once.
+    """
+    versions = VersionStream(_Extractor(), remove_deprecated = remove_deprecated)
+    versions.add(new_data)
+    new_data.update(versions.close())
+    return versions.changes
+
+
+class TestVersionManager(unittest.TestCase):
+
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        setup_path.patch(self, (VersionManager, "VERSION_MANAGER", Path(tmp.name)))
+
+    def test_content_hash(self):
+        entity = {"label": "Hubble", "alt_label": {"HST", "Hubble Space Telescope"}}
+        same = {"alt_label": {"Hubble Space Telescope", "HST"}, "label": "Hubble",
+                "modified": "2020-01-01T00:00:00Z"}
+        assert VersionManager.content_hash(entity) == VersionManager.content_hash(same)
+        assert VersionManager.content_hash(entity) != VersionManager.content_hash({"label": "Hubble"})
+
+    def test_version_stream(self):
+        first = {"hubble": {"label": "Hubble"},
+                 "voyager": {"label": "Voyager"}}
+        changes = compare_versions(first)
+        assert changes["added"] == {"hubble", "voyager"}
+        with open(VersionManager.VERSION_MANAGER / "test.hashes.json", "r") as file:
+            assert json.load(file).keys() == {"hubble", "voyager"}
+
+        second = {"hubble": {"label": "Hubble", "alt_label": {"HST"}},
+                  "voyager": {"label": "Voyager"},
+                  "jwst": {"label": "JWST"}}
+        changes = compare_versions(second, remove_deprecated = False)
+        assert changes == {"added": {"jwst"}, "removed": set(), "modified": {"hubble"}}
+        assert second["hubble"]["modified"] == VersionManager._TODAY
+        assert second["voyager"]["modified"] == first["voyager"]["modified"]
+
+        third = {"hubble": {"label": "Hubble", "alt_label": {"HST"}}}
+        changes = compare_versions(third, remove_deprecated = False)
+        assert changes == {"added": set(), "removed": {"voyager", "jwst"}, "modified": set()}
+        assert third["voyager"]["deprecated"] == ":__"
+        # Already deprecated entities are not removed again
+        changes = compare_versions({"hubble": {"label": "Hubble", "alt_label": {"HST"}}},
+                                   remove_deprecated = False)
+        assert not changes["removed"]
+
+        # A deprecated entity extracted again is modified
+        setup_path.patch(self, (VersionManager, "_TODAY", "2030-01-01T00:00:00Z"))
+        fourth = {"hubble": {"label": "Hubble", "alt_label": {"HST"}},
+                  "voyager": {"label": "Voyager"}}
+        changes = compare_versions(fourth, remove_deprecated = False)
+        assert changes == {"added": set(), "removed": set(), "modified": {"voyager"}}
+        assert "deprecated" not in fourth["voyager"]
+        assert fourth["voyager"]["modified"] == "2030-01-01T00:00:00Z"
+        assert fourth["hubble"]["modified"] == second["hubble"]["modified"]
+
+    def test_load_changes(self):
+        filename = VersionManager.VERSION_MANAGER / "changes.json"
+        with open(filename, "w") as file:
+            json.dump({"aas": {"added": ["a"], "removed": [], "modified": ["b"]},
+                       "naif": {"added": ["c"], "removed": ["d"], "modified": []}}, file)
+        changes = VersionManager.load_changes(filename)
+        assert changes == {"added": {"a", "c"}, "removed": {"d"}, "modified": {"b"}}
+
+    def test_version_journal(self):
+        filename = str(VersionManager.VERSION_MANAGER / "versions.json")
+        journal = filename + VersionJournal.JOURNAL_SUFFIX
+        with VersionJournal(filename, batch_size = 2, interval = 3600) as versions:
+            versions.refresh({"Q1": {"modified_date": "1"}})
+            assert not Path(journal).exists() # In memory
+            versions.refresh({"Q2": {"modified_date": "2"}})
+            assert Path(journal).exists() # Batch saved
+            versions.refresh({"Q3": {"modified_date": "3"}})
+        assert not Path(journal).exists()
+        with open(filename, "r") as file:
+            version = json.load(file)
+        assert version["results_count"] == 3
+        assert version["results"]["Q3"] == {"modified_date": "3"}
+
+        # Killed run: the saved batches are kept, the half-written line is ignored
+        versions = VersionJournal(filename, batch_size = 1)
+        versions.refresh({"Q1": {"modified_date": "4"}})
+        with open(journal, "a") as file:
+            file.write('{"Q2": {"modif')
+        VersionJournal.compact(filename)
+        with open(filename, "r") as file:
+            version = json.load(file)
+        assert version["results"]["Q1"] == {"modified_date": "4"}
+        assert version["results"]["Q2"] == {"modified_date": "2"}
+        assert not Path(journal).exists()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import setup_path
+import config
+import json
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from graph.extractor import cache
+from graph.extractor.cache import CacheManager
+from graph.extractor.wikidata_extractor import WikidataExtractor
+from graph.extractor.wikidata_stub import WikidataStub
+
+
+def _page(item: str,
+          labels: dict,
+          claims: dict = dict(),
+          **kwargs) -> dict:
+    """
+    Special:EntityData response of an item.
+    """
+    return {"entities": {item: {"type": "item",
+                                "id": item,
+                                "labels": {lang: {"language": lang, "value": value}
+                                           for lang, value in labels.items()},
+                                "aliases": kwargs.get("aliases", dict()),
+                                "descriptions": kwargs.get("descriptions", dict()),
+                                "sitelinks": kwargs.get("sitelinks", dict()),
+                                "claims": claims,
+                                "modified": "2024-01-01T00:00:00Z"}}}
+
+
+def _claim(datatype: str,
+           value) -> list:
+    return [{"mainsnak": {"datatype": datatype, "datavalue": {"value": value}}}]
+
+
+FIXTURES = {
+    "Q1": _page("Q1", {"fr": "Télescope spatial Hubble", "en": "Hubble Space Telescope"},
+                claims = {"P31": _claim("wikibase-item", {"id": "Q2"}),
+                          "P247": _claim("external-id", "1990-037B"),
+                          "P2067": _claim("quantity", {"amount": "+11110", "unit": "http://www.wikidata.org/entity/Q11570"}),
+                          "P18": _claim("wikibase-item", {"id": "Q4"})}, # Not kept
+                aliases = {"en": [{"language": "en", "value": "HST"}]},
+                descriptions = {"en": {"language": "en", "value": "space telescope"}},
+                sitelinks = {"enwiki": {"site": "enwiki", "title": "Hubble Space Telescope",
+                                        "url": "https://en.wikipedia.org/wiki/Hubble_Space_Telescope"}}),
+    "Q2": _page("Q2", {"en": "space telescope"}),
+    "Q11570": _page("Q11570", {"fr": "kilogramme"}),
+}
+
+
+class TestWikidataExtractor(unittest.TestCase):
+
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        fixtures = Path(tmp.name) / "fixtures"
+        fixtures.mkdir()
+        for item, page in FIXTURES.items():
+            (fixtures / f"{item}.json").write_text(json.dumps(page), encoding = "utf-8")
+        self.wikipedia = {f"Page {i}": {"lastrevid": i,
+                                        "extract": f'<p class="mw-empty-elt"></p><p><b>Page {i}</b> intro.</p><p>Next.</p>'}
+                          for i in range(45)}
+        (fixtures / "wikipedia").mkdir()
+        (fixtures / "wikipedia" / "en.json").write_text(json.dumps(self.wikipedia), encoding = "utf-8")
+
+        self.stub = WikidataStub(fixtures, port = 0)
+        threading.Thread(target = self.stub.serve_forever, daemon = True).start()
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+
+        setup_path.patch(self,
+                         (config, "WIKIDATA_HOST", self.stub.url),
+                         (config, "WIKIPEDIA_HOST", self.stub.url + "/{lang}"),
+                         (WikidataExtractor, "_INTROS_FILE", Path(tmp.name) / "intros.json"),
+                         (WikidataExtractor, "INTRO_BY_PAGE", None),
+                         (cache, "CACHE_DIR", Path(tmp.name) / "cache"),
+                         (CacheManager, "PACK", None),
+                         (WikidataExtractor, "_LABELS_FILE", Path(tmp.name) / "labels.json"),
+                         (WikidataExtractor, "LABEL_BY_WIKIDATA_ITEM", None))
+        self.extractor = WikidataExtractor()
+
+    def test_batched_entities(self):
+        data = self.extractor._extract_entities(["http://www.wikidata.org/entity/Q1"],
+                                                from_cache = True)["http://www.wikidata.org/entity/Q1"]
+        # One request for the entity, one for the labels of Q2 and Q11570
+        assert self.stub.requests_count == 2
+        assert data["label"] == "Hubble Space Telescope"
+        assert data["source_type"] == ["space telescope"]
+        assert data["mass"] == ["+11110 kilogramme"]
+        assert data["alt_label"] == {"Télescope spatial Hubble@fr", "HST@en"}
+        # Same output as the parsing of the whole Special:EntityData page
+        assert data == self.extractor._properties_to_dict(json.dumps(FIXTURES["Q1"]))
+
+        # Entities and labels are in cache
+        WikidataExtractor._save_labels()
+        WikidataExtractor.LABEL_BY_WIKIDATA_ITEM = None
+        assert self.extractor._extract_entity("Q1", from_cache = True) == data
+        assert self.stub.requests_count == 2
+
+    def test_batches(self):
+        items = [f"Q{i}" for i in range(100, 220)] + ["Q2"]
+        entities = self.extractor._get_entities(items, props = "labels")
+        assert self.stub.requests_count == 3 # 50 ids per request
+        assert list(entities) == ["Q2"] # The others are missing
+        assert self.extractor._get_label("Q2") == "space telescope"
+        assert self.extractor._get_label("1") is None # Not an item
+
+    def test_invalid_id(self):
+        # The whole batch fails: it is requested again without the invalid id
+        entities = self.extractor._get_entities(["Q1", "Q2", "L1", "P1"], props = "labels")
+        assert entities.keys() == {"Q1", "Q2"}
+        assert self.stub.requests_count == 3
+
+    def test_failed_batch(self):
+        # Not requested again item by item
+        setup_path.patch(self, (config, "WIKIDATA_HOST", self.stub.url + "/down"))
+        assert self.extractor._get_entities(["Q1", "Q2", "Q3"], props = "labels") == dict()
+        assert self.stub.requests_count == 1
+
+    def test_wikipedia_intros(self):
+        entities = [{"ext_ref": f"https://en.wikipedia.org/wiki/Page_{i}"} for i in range(45)]
+        entities.append({"ext_ref": "https://en.wikipedia.org/wiki/Missing_page"})
+        self.extractor._get_wikipedia_intros(entities)
+        # One request for the revisions, three for the intros (20 per request)
+        assert self.stub.requests_count == 4
+        assert entities[3]["description"] == "Page 3 intro."
+        assert "description" not in entities[-1]
+
+        entities = [{"ext_ref": f"https://en.wikipedia.org/wiki/Page_{i}"} for i in range(45)]
+        self.extractor._get_wikipedia_intros(entities)
+        assert self.stub.requests_count == 4 # From cache
+        assert entities[3]["description"] == "Page 3 intro."
+
+        # Only the modified pages are requested again
+        WikidataExtractor.INTRO_BY_PAGE["en"]["Page 3"]["revid"] = 0
+        entities = [{"ext_ref": f"https://en.wikipedia.org/wiki/Page_{i}"} for i in range(45)]
+        self.extractor._get_wikipedia_intros(entities, from_cache = False)
+        assert self.stub.requests_count == 4 + 2
+        assert WikidataExtractor.INTRO_BY_PAGE["en"]["Page 3"]["revid"] == 3
+
+
+if __name__ == "__main__":
+    unittest.main()